@@ -1,112 +1,204 @@
-import csv
-import os.path
-import errno
-import xlsxwriter
+if __package__:
+    from .UnifyConverter import UnifyConverter
+    from .UnifyFieldMapping import (UnifyFieldMapping, SourceColumn, ConstantField, DerivedField, WideColumnName,
+                                    WideColumnValue)
+    from .UnifiedTable import UnifiedTable
+else:
+    # run as a script from Source_Code
+    from UnifyConverter import UnifyConverter
+    from UnifyFieldMapping import (UnifyFieldMapping, SourceColumn, ConstantField, DerivedField, WideColumnName,
+                                   WideColumnValue)
+    from UnifiedTable import UnifiedTable
+import functools
+import itertools
 
 
-class AgilentUnify:
+# instrument runs in a bunch of different gas modes, and provides data for each analyte in each mode. generally one
+# is better/ more accurate/ more reliable. Maybe will filter out some of these in the future for a less cluttered
+# file. (22June21)
+tune_step_names = {'1': 'no gas',
+                   '2': 'H',
+                   '3': 'He'}
+
+
+@functools.lru_cache(maxsize=4096)
+def split_date_and_time_acquired(date_and_time_acquired):
+    """the new ICP software's 'Date and Time Acquired' as (date, time). Thousands of rows share each timestamp, so
+    each distinct one is only split once.
+
+    Parameters
+    ----------
+    date_and_time_acquired : string
+        e.g. '06/22/2021 10:11:12'. The software adds a leading 0 to single digit numbers, so it can be sliced.
+    """
+
+    return date_and_time_acquired[0:10], date_and_time_acquired[11:]
+
+
+@functools.lru_cache(maxsize=4096)
+def new_icp_analyte_name(analyte, mass, tune_step):
+    """the analyte name for a new ICP row, e.g. 'Pb 208 [He]', with the tune step code decoded through
+    tune_step_names. A batch only has a few hundred analyte/mass/tune step combinations, so each is only built once.
+
+    Parameters
+    ----------
+    analyte : string
+        the element.
+    mass : string
+        the isotope mass.
+    tune_step : string
+        the tune step code, '1' to '3'.
+    """
+
+    return analyte + ' ' + mass + ' [' + tune_step_names.get(tune_step, 'not found') + ']'
+
+
+def new_icp_batch_name(batch_name):
+    """the unified file's name for a new ICP export, from its 'Batch Name'. """
+
+    # could do this better, getting the main file name from the first item (individual data file
+    # name) minus the last 3 numbers
+    return batch_name[:-2]
+
+
+@functools.lru_cache(maxsize=4096)
+def split_old_icp_date_time(date_time):
+    """the old ICP's 'Date Time' as (date, time). Cached like split_date_and_time_acquired.
+
+    Parameters
+    ----------
+    date_time : string
+        e.g. '6/2/2021 10:11:12 AM'.
+    """
+
+    # have to use split because old ICP doesn't add 0's to the start of single digit day numbers
+    sample_date_and_time = date_time.split(" ")
+    return sample_date_and_time[0], sample_date_and_time[1] + " " + sample_date_and_time[2]
+
+
+def old_icp_batch_name(date_time):
+    """a placeholder name for an old ICP export's unified file, from its first 'Date Time'. As of right now, no way
+    to carry through the filename. I'm sure it's an option in the software output settings, will figure out later.
+    (22June21) """
+
+    return "Harry_icp_" + date_time[0]
+
+
+class AgilentUnify(UnifyConverter):
     """Converts Agilent csv data to the Unified Excel Format. Handles two different types of .csv outputs.
 
+    With Agilent instruments we can always trim fields we don't need, and put fields in whatever order we want, so
+    the columns are mapped by header name (see field_mapping and old_icp_field_mapping) - the order of fields doesn't
+    matter, and any extra fields are ignored.
+
     Attributes
     ----------
-    csv_file_in_list_of_list_format : list(list)
-        csv file to be converted in a list of lists.
-    csv_file_in_list_of_list_format_condensed : list(list)
-        csv file to be converted in a list of lists. Any extra fields not required are removed.
+    old_icp : bool
+        True if the export is from the older ICP/MS. Set by agilent_unify_controller.
     required_fields_index_dictionary : dict
-        dictionary of required file fields, and their indexes. 0's are placeholders, indexes are found later.
-        relevant to the newer ICP/MS.
+        the columns field_mapping reads, and their indexes. Relevant to the newer ICP/MS.
     required_fields_index_dictionary_old_icp : dict
-        dictionary of required file fields, and their indexes. 0's are placeholders, indexes are found later.
-        relevant to the older ICP/MS.
-    main_file_name : string
-        the name of the excel file to be generated. Same as the batch name you'd use for the TargetLynx file.
+        the columns old_icp_field_mapping reads, and their indexes. Relevant to the older ICP/MS.
+    field_mapping : UnifyFieldMapping
+        how a newer ICP/MS row (one analyte per line) becomes a condensed line.
+    old_icp_field_mapping : UnifyFieldMapping
+        how an older ICP/MS row becomes condensed lines. The older ICP/MS as far as I can tell won't provide one
+        analyte per line, will only do one sample per line, with each analyte given as a field from column 7 on - so
+        the sample data is copied onto a line for each analyte.
+
+    The rest are as in UnifyConverter.
     """
 
-    def __init__(self, csv_file_in_list_of_list_format):
+    converter_version = 4
+    instrument_name = 'Agilent'
+    excel_column_a_width = 40
+    excel_header_cell_formats = (1, 2, 2, 2, 2, 2, 3, 3, 3)
+    field_mapping = UnifyFieldMapping([ConstantField('Agilent Instruments: ICP'),
+                                       SourceColumn('Data File Name'),
+                                       DerivedField(split_date_and_time_acquired, 'Date and Time Acquired',
+                                                    field_count=2),
+                                       SourceColumn('Sample Name'),
+                                       SourceColumn('Sample Type'),
+                                       DerivedField(new_icp_analyte_name, 'Analyte', 'Mass', 'Tune Step'),
+                                       SourceColumn('Concentration'),
+                                       ConstantField(" ")],
+                                      batch_name=DerivedField(new_icp_batch_name, 'Batch Name'))
+    old_icp_field_mapping = UnifyFieldMapping([ConstantField('Agilent Instruments: ICP'),
+                                               ConstantField('no data file provided'),
+                                               DerivedField(split_old_icp_date_time, 'Date Time', field_count=2),
+                                               SourceColumn('Solution Label'),
+                                               SourceColumn('Type'),
+                                               WideColumnName(),
+                                               WideColumnValue(),
+                                               ConstantField(" ")],
+                                              batch_name=DerivedField(old_icp_batch_name, 'Date Time'),
+                                              # from 6 on, it's just data
+                                              wide_columns_from=6)
+
+    def __init__(self, csv_file_in_list_of_list_format,
+                 unified_files_directory=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles'):
         """
         Parameters
         ----------
         csv_file_in_list_of_list_format : list(list)
             csv file to be converted in a list of lists.
+        unified_files_directory : string
+            the directory the unified files are written to. Defaults to UnifiedExcelFiles on the T drive.
         """
-        self.csv_file_in_list_of_list_format = csv_file_in_list_of_list_format
-        self.csv_file_in_list_of_list_format_condensed = [['data source',
-                                                           'filename',
-                                                           'create date',
-                                                           'create time',
-                                                           'sample name',
-                                                           'sample type',
-                                                           'analyte name',
-                                                           'analyte concentration',
-                                                           'percent recovery']]
-        self.required_fields_index_dictionary = {'Sample Name': 0,
-                                                 'Sample Type': 0,
-                                                 'Date and Time Acquired': 0,
-                                                 'Data File Name': 0,
-                                                 'Batch Name': 0,
-                                                 'Analyte': 0,
-                                                 'Mass': 0,
-                                                 'Concentration': 0,
-                                                 'Units': 0,
-                                                 'Tune Step': 0,
-                                                 }
-        self.required_fields_index_dictionary_old_icp = {'Solution Label': 0,
-                                                         'Type': 0,
-                                                         'Date Time': 0,
-                                                         }
-        self.main_file_name = ""
-
-    def agilent_unify_controller(self, old_icp=False):
+        super().__init__(csv_file_in_list_of_list_format, unified_files_directory)
+        self.old_icp = False
+        self.required_fields_index_dictionary_old_icp = dict.fromkeys(
+            self.old_icp_field_mapping.source_column_names(), 0)
+
+    def agilent_unify_controller(self, old_icp=False, streaming=False, columnar=False, output_formats=None):
         """The main controller function for AgilentUnify.
 
         Parameters
         ----------
         old_icp=False
             True if we are handling old ICP output.
+        streaming=False
+            True if csv_file_in_list_of_list_format is an iterator of rows (e.g. a csv.reader on an open file) that
+            should be streamed through to the excel file one row at a time, instead of condensed into a list first.
+        columnar=False
+            True to condense into a UnifiedTable (unified_table) instead of a list of lists.
+        output_formats=None
+            the outputs to write in one pass, e.g. ['xlsx', 'csv'] - see generate_output_files. None for just the
+            excel file.
             """
-        if old_icp:
-            self.find_indexes_of_required_fields(old_icp)
-            self.create_condensed_csv_file_with_only_relevant_fields(old_icp)
-        else:
-            self.find_indexes_of_required_fields()
-            self.create_condensed_csv_file_with_only_relevant_fields()
-        self.generate_excel_files()
+        self.old_icp = old_icp
+        with self.unify_instrumentation.profile():
+            self.condense_and_write(streaming, columnar, output_formats)
         # have the option of generating excel files with xlsxwriter, can format somewhat
         # or make un-formatted csv files.
         # self.generate_csv_files()
+        # or a typed, compressed parquet file for loading into the database/dataframes.
+        # self.generate_parquet_files()
+        # or straight into the database, e.g. UnifiedDatabaseSink(UnifiedConnectionPool.for_sqlite('unified.db')).
+        # self.load_condensed_lines_into_database(database_sink)
 
-    def find_indexes_of_required_fields(self, old_icp=False):
-        """finds the indexes of the fields we need to create our unified excel format.
-
-        This is somewhat unnecessary, because with Agilent instruments, we can always trim fields we don't need, and
-        we can put fields in whatever order we want, so we could in theory already know these indexes. However, having
-        this function in place allows us to be lazy - we don't need to care about the order of fields, and we can ignore
-        any extra fields.
+    def find_indexes_of_required_fields(self, old_icp=None, header_row=None):
+        """compiles the field mapping for the export against its header - finds the indexes of the fields we need to
+        create our unified excel format, and generates the row transformer that uses them.
 
         Parameters
         ----------
-        old_icp=False
-            True if we are handling old ICP output.
+        old_icp=None
+            True if we are handling old ICP output. None to leave old_icp as it is.
+        header_row=None
+            the header row of the csv file. Defaults to the first line of csv_file_in_list_of_list_format.
         """
-        if old_icp:
-            required_field_index_counter = 0
-            for item in self.csv_file_in_list_of_list_format[0]:
-                if item in self.required_fields_index_dictionary_old_icp.keys():
-                    # then it is a required field
-                    # add the index we are at to the dictionary
-                    self.required_fields_index_dictionary_old_icp[item] = required_field_index_counter
-                required_field_index_counter += 1
+        if old_icp is not None:
+            self.old_icp = old_icp
+        if header_row is None:
+            header_row = self.csv_file_in_list_of_list_format[0]
+        if self.old_icp:
+            self.required_fields_index_dictionary_old_icp = self.compile_field_mapping(self.old_icp_field_mapping,
+                                                                                        header_row)
         else:
-            required_field_index_counter = 0
-            for item in self.csv_file_in_list_of_list_format[0]:
-                if item in self.required_fields_index_dictionary.keys():
-                    # then it is a required field
-                    # add the index we are at to the dictionary
-                    self.required_fields_index_dictionary[item] = required_field_index_counter
-                required_field_index_counter += 1
-
-    def create_condensed_csv_file_with_only_relevant_fields(self, old_icp=False):
+            self.required_fields_index_dictionary = self.compile_field_mapping(self.field_mapping, header_row)
+
+    def create_condensed_csv_file_with_only_relevant_fields(self, old_icp=None):
         """takes only the required fields from the full csv file, and creates a condensed list of lists.
 
         older ICP/MS as far as I can tell won't provide one analyte per line, will only do one sample per line,
@@ -115,163 +207,159 @@ class AgilentUnify:
 
         Parameters
         ----------
-        old_icp=False
-            True if we are handling old ICP output. """
-        if old_icp:
-            # from 6 on, it's just data
-            analytes_list = self.csv_file_in_list_of_list_format[0][6:]
-            for item in self.csv_file_in_list_of_list_format[1:]:
-                # have to use split because old ICP doesn't add 0's to the start of single digit day numbers
-                sample_date_and_time = item[self.required_fields_index_dictionary_old_icp['Date Time']].split(" ")
-                sample_date = sample_date_and_time[0]
-                sample_time = sample_date_and_time[1] + " " + sample_date_and_time[2]
-                if len(self.main_file_name) > 0:
-                    pass
-                else:
-                    # putting in a placeholder file name. As of right now, no way to carry through the filename. I'm
-                    # sure it's an option in the software output settings, will figure out later. (22June21)
-                    self.main_file_name = "Harry_icp_" + sample_date[0]
-                analyte_counter = 6
-                for analyte in analytes_list:
-                    # iterating through the analytes, creating a new line for each one.
-                    condensed_line = ['Agilent Instruments: ICP',
-                                      'no data file provided',
-                                      sample_date,
-                                      sample_time,
-                                      item[self.required_fields_index_dictionary_old_icp['Solution Label']],
-                                      item[self.required_fields_index_dictionary_old_icp['Type']],
-                                      analyte,
-                                      item[analyte_counter],
-                                      " "]
-                    self.csv_file_in_list_of_list_format_condensed.append(condensed_line)
-                    analyte_counter += 1
-        else:
-            # much more straightforward, because each line is an analyte, and I've already pretty much selected
-            # the fields that I want.
-            for item in self.csv_file_in_list_of_list_format[1:]:
-                # instrument runs in a bunch of different gas modes, and provides data for each analyte in each mode
-                # generally one is better/ more accurate/ more reliable. Maybe will filter out some of these
-                # in the future for a less cluttered file. (22June21)
-                if item[self.required_fields_index_dictionary['Tune Step']] == '1':
-                    tune_step = 'no gas'
-                elif item[self.required_fields_index_dictionary['Tune Step']] == '2':
-                    tune_step = 'H'
-                elif item[self.required_fields_index_dictionary['Tune Step']] == '3':
-                    tune_step = 'He'
-                else:
-                    tune_step = 'not found'
-                # can do this because new ICP software adds a leading 0 to single digit numbers
-                sample_date = item[self.required_fields_index_dictionary['Date and Time Acquired']][0:10]
-                sample_time = item[self.required_fields_index_dictionary['Date and Time Acquired']][11:]
-                analyte_name = str(item[self.required_fields_index_dictionary['Analyte']] + ' ' +
-                                   item[self.required_fields_index_dictionary['Mass']] + ' [' +
-                                   tune_step + ']'
-                                   )
-                condensed_line = ['Agilent Instruments: ICP',
-                                  item[self.required_fields_index_dictionary['Data File Name']],
-                                  sample_date,
-                                  sample_time,
-                                  item[self.required_fields_index_dictionary['Sample Name']],
-                                  item[self.required_fields_index_dictionary['Sample Type']],
-                                  analyte_name,
-                                  item[self.required_fields_index_dictionary['Concentration']],
-                                  " "]
-                self.csv_file_in_list_of_list_format_condensed.append(condensed_line)
-            # could do this better, getting the main file name from the first item (individual data file name) minus
-            # the last 3 numbers
-            self.main_file_name = self.csv_file_in_list_of_list_format[1][5][:-2]
-
-    def generate_excel_files(self):
-        """generates excel file versions of the unified excel format, using xlsxwriter.
-
-        allows us to add formatting to the file produced, which we can't do with the .csv version. the formats
-        denote shared fields - all rows in the file will have the same values in header_cell_format_1 cells,
-        all rows in a sample will have the same values in header_cell_format_2 cells, and the cells with
-        header_format_3 change each line. """
-
-        target = r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles\ '
-        batch_name = str(self.main_file_name)
-        filename = target[:-1] + batch_name + '.xlsx'
-        workbook = xlsxwriter.Workbook(filename)
-        worksheet = workbook.add_worksheet()
-        # set column width
-        worksheet.set_column('A:A', 40)
-        worksheet.set_column('B:I', 20)
-        # header format for the first two columns
-        header_cell_format_1 = workbook.add_format({'bold': True, 'font_color': 'white', 'bg_color': '#2321a7'})
-        header_cell_format_2 = workbook.add_format({'bold': True, 'font_color': 'white', 'bg_color': '#3330db'})
-        header_cell_format_3 = workbook.add_format({'bold': True, 'font_color': 'black', 'bg_color': '#29abdc'})
-        # helps with the editing to change the color of each second line
-        odd_sample_format = workbook.add_format({'bg_color': "#c7d6db"})
-        even_sample_format = workbook.add_format({'bg_color': "#e9edef"})
-        row = 0
-        for item in self.csv_file_in_list_of_list_format_condensed:
-            if row == 0:
-                worksheet.write(row, 0, item[0], header_cell_format_1)
-                worksheet.write(row, 1, item[1], header_cell_format_2)
-                worksheet.write(row, 2, item[2], header_cell_format_2)
-                worksheet.write(row, 3, item[3], header_cell_format_2)
-                worksheet.write(row, 4, item[4], header_cell_format_2)
-                worksheet.write(row, 5, item[5], header_cell_format_2)
-                worksheet.write(row, 6, item[6], header_cell_format_3)
-                worksheet.write(row, 7, item[7], header_cell_format_3)
-                worksheet.write(row, 8, item[8], header_cell_format_3)
-            else:
-                if row % 2 == 0:
-                    worksheet.write(row, 0, item[0], even_sample_format)
-                    worksheet.write(row, 1, item[1], even_sample_format)
-                    worksheet.write(row, 2, item[2], even_sample_format)
-                    worksheet.write(row, 3, item[3], even_sample_format)
-                    worksheet.write(row, 4, item[4], even_sample_format)
-                    worksheet.write(row, 5, item[5], even_sample_format)
-                    worksheet.write(row, 6, item[6], even_sample_format)
-                    worksheet.write(row, 7, item[7], even_sample_format)
-                    worksheet.write(row, 8, item[8], even_sample_format)
-                else:
-                    worksheet.write(row, 0, item[0], odd_sample_format)
-                    worksheet.write(row, 1, item[1], odd_sample_format)
-                    worksheet.write(row, 2, item[2], odd_sample_format)
-                    worksheet.write(row, 3, item[3], odd_sample_format)
-                    worksheet.write(row, 4, item[4], odd_sample_format)
-                    worksheet.write(row, 5, item[5], odd_sample_format)
-                    worksheet.write(row, 6, item[6], odd_sample_format)
-                    worksheet.write(row, 7, item[7], odd_sample_format)
-                    worksheet.write(row, 8, item[8], odd_sample_format)
-
-            row += 1
-        workbook.close()
-
-    def generate_csv_files(self):
-        """generates csv file versions of the unified excel format, using python's built in csv library.
-
-        files generated have no formatting. Can use generate_excel_files, which comes with visual formatting."""
-
-        target = r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles\ '
-        try:
-            batch_name = str(self.main_file_name)
-            filename = target[:-1] + batch_name + '.csv'
-            filename = filename.replace('/', '-')
-            with self.safe_open_w(filename) as f:
-                csv_writer = csv.writer(f)
-                for item in self.csv_file_in_list_of_list_format_condensed:
-                    csv_writer.writerow(item)
-        except OSError:
-            pass
+        old_icp=None
+            True if we are handling old ICP output. None to leave old_icp as it is. """
+        if old_icp is not None:
+            self.old_icp = old_icp
+        super().create_condensed_csv_file_with_only_relevant_fields()
 
-    def mkdir_p(self, path):
-        """tries to make the directory."""
+    def create_unified_table(self, old_icp=None):
+        """condenses the csv file into a columnar UnifiedTable rather than a list of lists. Makes the biggest
+        difference for old ICP files, where the sample fields are copied onto every analyte line - those go through
+        the vectorized melt_old_icp_rows_into_unified_table instead of the python loop.
 
-        try:
-            os.makedirs(path)
-        except OSError as exc:  # Python >2.5
-            if exc.errno == errno.EEXIST and os.path.isdir(path):
-                pass
-            else:
-                raise
+        Parameters
+        ----------
+        old_icp=None
+            True if we are handling old ICP output. None to leave old_icp as it is.
+        """
+
+        if old_icp is not None:
+            self.old_icp = old_icp
+        if not self.old_icp:
+            super().create_unified_table()
+            return
+        csv_file_rows = iter(self.csv_file_in_list_of_list_format)
+        header_row = next(csv_file_rows, [])
+        self.find_indexes_of_required_fields(header_row=header_row)
+        self.unified_table = self.melt_old_icp_rows_into_unified_table(list(csv_file_rows), header_row)
+        if len(self.unified_table) == 0:
+            raise ValueError("No sample lines found in the {} csv file.".format(self.instrument_name))
+
+    def melt_old_icp_rows_into_unified_table(self, sample_rows, header_row):
+        """vectorized wide-to-long melt of old ICP output, straight into a UnifiedTable.
+
+        Same result as generate_condensed_lines(old_icp=True), but instead of building a line per analyte per
+        sample in python, the per-sample fields are worked out once per sample and spread over that sample's
+        analytes with numpy.repeat, the analyte names are laid down with numpy.tile, and the whole analyte block
+        is converted to float64 in one go. Only the odd non-numeric concentration is handled one at a time.
+
+        Parameters
+        ----------
+        sample_rows : list(list)
+            the csv rows after the header, one per sample.
+        header_row : list
+            the header row - analyte names are from column 6 on.
+
+        Raises
+        ------
+        ValueError
+            a sample row is shorter than the header, so its analytes can't be lined up.
+        """
+
+        # numpy is imported where it's used, so importing this module (and the converters) stays quick
+        import numpy
+        # from 6 on, it's just data
+        analytes_list = header_row[6:]
+        analyte_count = len(analytes_list)
+        for row_number, item in enumerate(sample_rows, 2):
+            if len(item) < len(header_row):
+                raise ValueError("old ICP row {} has {} fields, the header has {}".format(row_number, len(item),
+                                                                                          len(header_row)))
+        date_time_index = self.required_fields_index_dictionary_old_icp['Date Time']
+        sample_dates_and_times = [split_old_icp_date_time(item[date_time_index]) for item in sample_rows]
+        if sample_rows:
+            # placeholder file name, the same as old_icp_field_mapping's
+            self.set_main_file_name(old_icp_batch_name(sample_rows[0][date_time_index]))
+        solution_label_index = self.required_fields_index_dictionary_old_icp['Solution Label']
+        type_index = self.required_fields_index_dictionary_old_icp['Type']
+        string_columns = [(['Agilent Instruments: ICP'], numpy.zeros(len(sample_rows) * analyte_count, numpy.uint8)),
+                          (['no data file provided'], numpy.zeros(len(sample_rows) * analyte_count, numpy.uint8)),
+                          self.encode_sample_column([sample_date for sample_date, _ in sample_dates_and_times],
+                                                    analyte_count),
+                          self.encode_sample_column([sample_time for _, sample_time in sample_dates_and_times],
+                                                    analyte_count),
+                          self.encode_sample_column([item[solution_label_index] for item in sample_rows],
+                                                    analyte_count),
+                          self.encode_sample_column([item[type_index] for item in sample_rows], analyte_count)]
+        analyte_values, analyte_codes = numpy.unique(numpy.array(analytes_list, dtype=object).astype(str),
+                                                     return_inverse=True)
+        # back to str, so numpy.str_ doesn't end up in the condensed lines and the sinks
+        string_columns.append(([str(analyte_value) for analyte_value in analyte_values],
+                               numpy.tile(analyte_codes, len(sample_rows))))
+        string_columns.append(([" "], numpy.zeros(len(sample_rows) * analyte_count, numpy.uint8)))
+        analyte_block = [item[6:6 + analyte_count] for item in sample_rows]
+        concentration_values, concentration_text = self.convert_concentrations_to_float64(analyte_block)
+        return UnifiedTable.from_columns(string_columns, concentration_values, concentration_text)
 
-    def safe_open_w(self, path):
-        """ Open "path" for writing, creating any parent directories as needed. """
+    def encode_sample_column(self, sample_values, analyte_count):
+        """dictionary encodes one value per sample, then repeats each sample's code once per analyte.
 
-        self.mkdir_p(os.path.dirname(path))
-        return open(path, 'w', newline='')
+        Parameters
+        ----------
+        sample_values : list
+            one value per sample.
+        analyte_count : int
+            how many analyte lines each sample becomes.
+        """
+
+        import numpy
+        value_codes = {}
+        sample_codes = numpy.array([value_codes.setdefault(value, len(value_codes)) for value in sample_values],
+                                   dtype=numpy.uint32)
+        return list(value_codes), numpy.repeat(sample_codes, analyte_count)
+
+    def convert_concentrations_to_float64(self, analyte_block):
+        """converts the block of concentration strings to a flat float64 array in one go, with numpy doing the
+        parsing. If some aren't numbers ('<LOD', blanks etc.) they are NaN, and their text comes back in a dict
+        (condensed line -> text) so it can still be written out. So does the text of numbers the float wouldn't
+        write out as exported, e.g. '0.050' - see UnifiedTable.
+
+        Parameters
+        ----------
+        analyte_block : list(list)
+            the concentration strings, one list per sample, one string per analyte.
+        """
 
+        import numpy
+        try:
+            concentration_values = numpy.array(analyte_block, dtype=numpy.float64).reshape(-1)
+        except ValueError:
+            pass
+        else:
+            # numpy writes float64 the same shortest way repr does, so any text that differs is kept
+            concentration_strings = numpy.array(analyte_block, dtype=str).reshape(-1)
+            changed_rows = numpy.flatnonzero(concentration_strings != concentration_values.astype(str))
+            return concentration_values, {int(row): str(concentration_strings[row]) for row in changed_rows}
+        concentration_values = numpy.full(sum(len(sample) for sample in analyte_block), numpy.nan)
+        concentration_text = {}
+        for row, concentration in enumerate(itertools.chain.from_iterable(analyte_block)):
+            try:
+                concentration_value = float(concentration)
+            except ValueError:
+                concentration_text[row] = concentration
+                continue
+            concentration_values[row] = concentration_value
+            if repr(concentration_value) != concentration:
+                concentration_text[row] = concentration
+        return concentration_values, concentration_text
+
+    def generate_condensed_lines(self, csv_file_rows, old_icp=None, header_row=None):
+        """yields condensed lines one at a time, through the compiled field mapping. Sets main_file_name from the
+        first row it sees.
+
+        Parameters
+        ----------
+        csv_file_rows : iterable(list)
+            the csv rows after the header.
+        old_icp=None
+            True if we are handling old ICP output. None to leave old_icp as it is.
+        header_row=None
+            the header row of the csv file, if the field mapping hasn't been compiled against it yet.
+        """
+        if old_icp is not None:
+            self.old_icp = old_icp
+        field_mapping = self.old_icp_field_mapping if self.old_icp else self.field_mapping
+        if self.compiled_field_mapping is None or self.compiled_field_mapping.field_mapping is not field_mapping:
+            self.find_indexes_of_required_fields(header_row=header_row)
+        return self.compiled_field_mapping.transform_rows(csv_file_rows, self.set_main_file_name)
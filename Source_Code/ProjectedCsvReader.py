@@ -0,0 +1,152 @@
+import operator
+import locale
+import mmap
+import csv
+import io
+import os
+
+
+class ProjectedCsvReader:
+    """Reads only some of a csv file's columns, memory-mapped, without splitting or decoding the rest.
+
+    csv.reader splits and decodes every field of every row, and Waters exports are dozens of columns wide when the
+    converter only wants nine of them. This resolves the columns wanted once (from the header), then for each row:
+    splits the raw bytes only as far as the last column wanted - the rest of the row is never split at all - checks
+    the skip_blank_index column is filled in before decoding anything (so Waters' blank lines cost next to nothing),
+    and decodes just the wanted fields. Rows come out with only those fields, in column_indexes order.
+
+    The file is memory-mapped, so the OS pages it in as it's read rather than it being copied through a file
+    buffer. Rows with a quote in them (quoted commas, or newlines inside a field) go through csv.reader instead, so
+    anything csv.reader reads comes out the same, just faster.
+
+    Attributes
+    ----------
+    filename : string
+        the csv file.
+    encoding : string
+        the file's encoding. Defaults to the same one open() would use.
+    header_row : list
+        the first row, all of it.
+    header_size : int
+        the header's length in bytes, where the data rows start.
+    column_indexes : list(int)
+        the columns each row is projected onto, in order.
+    skip_blank_index : int
+        rows with nothing in this column are skipped. None to keep every row.
+    """
+
+    def __init__(self, filename, encoding=None):
+        """reads the header.
+
+        Parameters
+        ----------
+        filename : string
+            the csv file.
+        encoding : string
+            the file's encoding. Defaults to the same one open() would use.
+
+        Raises
+        ------
+        UnicodeDecodeError
+            file is not being recognized as a csv file.
+        """
+
+        self.filename = filename
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        with open(filename, 'rb') as csv_file:
+            header_bytes = csv_file.readline()
+        self.header_row = next(csv.reader(io.StringIO(header_bytes.decode(self.encoding), newline='')), [])
+        self.header_size = len(header_bytes)
+        self.column_indexes = list(range(len(self.header_row)))
+        self.skip_blank_index = None
+
+    def project(self, column_indexes, skip_blank_index=None):
+        """sets the columns to read. Returns the reader, so it can be iterated straight away.
+
+        Parameters
+        ----------
+        column_indexes : list(int)
+            the columns each row is projected onto, in order. Repeats are fine.
+        skip_blank_index : int
+            rows with nothing in this column are skipped. None to keep every row.
+        """
+
+        self.column_indexes = list(column_indexes)
+        self.skip_blank_index = skip_blank_index
+        return self
+
+    def projected_header_row(self):
+        """the header, projected the same way as the rows. """
+
+        return [self.header_row[column_index] if column_index < len(self.header_row) else ''
+                for column_index in self.column_indexes]
+
+    def __iter__(self):
+        return self.generate_projected_rows()
+
+    def generate_projected_rows(self):
+        """yields the data rows, projected onto column_indexes, skipping blank ones.
+
+        Raises
+        ------
+        UnicodeDecodeError
+            file is not being recognized as a csv file.
+        """
+
+        if not self.column_indexes:
+            return
+        # split one past the last column wanted - that piece holds the rest of the row, unsplit
+        last_index = max(self.column_indexes + [self.skip_blank_index or 0])
+        # if the last column wanted can be the row's last column, its field ends with the line ending
+        strip_line_endings = last_index + 1 >= len(self.header_row)
+        skip_blank_index = self.skip_blank_index
+        encoding = self.encoding
+        if len(self.column_indexes) == 1:
+            column_index = self.column_indexes[0]
+            get_projected_fields = lambda fields: (fields[column_index],)
+        else:
+            get_projected_fields = operator.itemgetter(*self.column_indexes)
+        with open(self.filename, 'rb') as csv_file:
+            if self.header_size >= os.fstat(csv_file.fileno()).st_size:
+                # nothing after the header (and an empty file can't be mapped)
+                return
+            with mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as csv_map:
+                csv_map.seek(self.header_size)
+                for line in iter(csv_map.readline, b''):
+                    if b'"' in line:
+                        fields = self.read_quoted_row(line, csv_map, last_index)
+                        if skip_blank_index is None or fields[skip_blank_index]:
+                            yield list(get_projected_fields(fields))
+                        continue
+                    if strip_line_endings:
+                        line = line.rstrip(b'\r\n')
+                    fields = line.split(b',', last_index + 1)
+                    if len(fields) <= last_index:
+                        # a short row - the missing fields are read as ''
+                        fields[-1] = fields[-1].rstrip(b'\r\n')
+                        fields.extend([b''] * (last_index + 1 - len(fields)))
+                    if skip_blank_index is not None and not fields[skip_blank_index]:
+                        continue
+                    # joined, decoded once and split again - one decode per row instead of one per field
+                    yield b'\x00'.join(get_projected_fields(fields)).decode(encoding).split('\x00')
+
+    def read_quoted_row(self, line, csv_map, last_index):
+        """parses a row with quotes in it with csv.reader, reading on while a quoted field carries over a line
+        break. Returns its fields, padded out to last_index with ''.
+
+        Parameters
+        ----------
+        line : bytes
+            the row's first line.
+        csv_map : mmap.mmap
+            the file, positioned after line.
+        last_index : int
+            the last column wanted.
+        """
+
+        while line.count(b'"') % 2 and csv_map.tell() < csv_map.size():
+            line += csv_map.readline()
+        fields = next(csv.reader(io.StringIO(line.decode(self.encoding), newline='')), [])
+        if len(fields) <= last_index:
+            fields.extend([''] * (last_index + 1 - len(fields)))
+        return fields
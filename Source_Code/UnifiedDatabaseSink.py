@@ -0,0 +1,236 @@
+if __package__:
+    from .UnifiedSchema import unified_column_names, parse_create_date, parse_float
+else:
+    # run as a script from Source_Code
+    from UnifiedSchema import unified_column_names, parse_create_date, parse_float
+import contextlib
+import threading
+import sqlite3
+import queue
+
+
+class UnifiedConnectionPool:
+    """A small pool of database connections, so each batch (or each worker thread) doesn't open its own.
+
+    Connections are made with the connect callable the first time they're needed, up to max_connections, and handed
+    back to the pool when the caller is done. Any DB-API driver works - sqlite3 locally, pyodbc for SQL Server.
+
+    Attributes
+    ----------
+    connect : callable
+        makes a new connection, e.g. lambda: pyodbc.connect(connection_string).
+    max_connections : int
+        the most connections open at once. Callers wait for a free one after that.
+    """
+
+    def __init__(self, connect, max_connections=4):
+        """
+        Parameters
+        ----------
+        connect : callable
+            makes a new connection.
+        max_connections : int
+            the most connections open at once.
+        """
+
+        self.connect = connect
+        self.max_connections = max_connections
+        self.idle_connections = queue.LifoQueue()
+        self.connections_made = 0
+        self.connections_made_lock = threading.Lock()
+
+    @classmethod
+    def for_sqlite(cls, database_filename, max_connections=4):
+        """a pool of SQLite connections - the local stand-in for SQL Server.
+
+        WAL mode lets readers carry on while a batch is written, and synchronous=NORMAL only syncs at checkpoints,
+        which is still safe against corruption in WAL mode.
+
+        Parameters
+        ----------
+        database_filename : string
+            the SQLite file. Created if it doesn't exist.
+        max_connections : int
+            the most connections open at once.
+        """
+
+        def connect():
+            connection = sqlite3.connect(database_filename, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            return connection
+        return cls(connect, max_connections)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """borrows a connection for the length of a with block. """
+
+        try:
+            connection = self.idle_connections.get_nowait()
+        except queue.Empty:
+            with self.connections_made_lock:
+                make_connection = self.connections_made < self.max_connections
+                if make_connection:
+                    self.connections_made += 1
+            connection = self.connect() if make_connection else self.idle_connections.get()
+        try:
+            yield connection
+        finally:
+            self.idle_connections.put(connection)
+
+    def close(self):
+        """closes every idle connection. """
+
+        while True:
+            try:
+                self.idle_connections.get_nowait().close()
+            except queue.Empty:
+                break
+            with self.connections_made_lock:
+                self.connections_made -= 1
+
+
+class UnifiedDatabaseSink:
+    """Bulk-loads condensed lines into a database table, instead of writing xlsx and reading it back in.
+
+    Rows are sent batch_size at a time with executemany, each batch in its own transaction, so a failure part way
+    through only loses the batch it happened in. Rows are upserted on (filename, create date, create time, sample
+    name, analyte name), so loading the same batch again updates its rows instead of duplicating them - re-runs are
+    idempotent. The date and time are in the key because the filename alone doesn't identify a run: every old ICP
+    line has 'no data file provided', and its Blanks, QCs and CalStds are named the same every batch. Create date is
+    stored as an ISO date (or its text if it isn't one - a NULL in the key would never conflict, so re-runs would
+    duplicate), and concentration and percent recovery as numbers (NULL if they aren't), with the text of
+    non-numeric concentrations kept in analyte_concentration_text.
+
+    The statements are SQLite's. For another database, override create_table_statements and upsert_statement (e.g. a
+    MERGE for SQL Server) - the batching and pooling stay the same.
+
+    Attributes
+    ----------
+    connection_pool : UnifiedConnectionPool
+        where connections come from.
+    table_name : string
+        the table rows are loaded into. Created if it doesn't exist.
+    batch_size : int
+        rows per executemany/transaction.
+    rows_written : int
+        the number of rows sent to the database.
+    """
+
+    key_column_names = ['filename', 'create_date', 'create_time', 'sample_name', 'analyte_name']
+
+    def __init__(self, connection_pool, table_name='unified_results', batch_size=10000):
+        """
+        Parameters
+        ----------
+        connection_pool : UnifiedConnectionPool
+            where connections come from.
+        table_name : string
+            the table rows are loaded into.
+        batch_size : int
+            rows per executemany/transaction.
+        """
+
+        self.connection_pool = connection_pool
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self.column_names = unified_column_names + ['analyte_concentration_text']
+        self.create_table()
+
+    def create_table(self):
+        """creates the table and its unique key, if they don't exist yet. """
+
+        with self.connection_pool.connection() as connection:
+            cursor = connection.cursor()
+            for statement in self.create_table_statements():
+                cursor.execute(statement)
+            connection.commit()
+
+    def create_table_statements(self):
+        """the statements that create the table and the unique key the upsert relies on. """
+
+        return ["CREATE TABLE IF NOT EXISTS {} ("
+                "data_source TEXT, "
+                "filename TEXT NOT NULL, "
+                "create_date DATE, "
+                "create_time TEXT, "
+                "sample_name TEXT NOT NULL, "
+                "sample_type TEXT, "
+                "analyte_name TEXT NOT NULL, "
+                "analyte_concentration REAL, "
+                "percent_recovery REAL, "
+                "analyte_concentration_text TEXT, "
+                "UNIQUE ({}))".format(self.table_name, ', '.join(self.key_column_names))]
+
+    def upsert_statement(self):
+        """the parameterised insert-or-update for one row. """
+
+        update_column_names = [column_name for column_name in self.column_names
+                               if column_name not in self.key_column_names]
+        return ("INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) DO UPDATE SET {}".format(
+            self.table_name,
+            ', '.join(self.column_names),
+            ', '.join('?' * len(self.column_names)),
+            ', '.join(self.key_column_names),
+            ', '.join('{0} = excluded.{0}'.format(column_name) for column_name in update_column_names)))
+
+    def write_condensed_lines(self, condensed_lines):
+        """upserts the condensed lines. The first line is the header, and is skipped.
+
+        Parameters
+        ----------
+        condensed_lines : iterable(list)
+            the header, followed by the condensed data lines.
+        """
+
+        condensed_lines = iter(condensed_lines)
+        next(condensed_lines, None)
+        batch = []
+        for item in condensed_lines:
+            batch.append(self.database_row(item))
+            if len(batch) == self.batch_size:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+
+    def write_batch(self, database_rows):
+        """upserts one batch of rows in a single transaction.
+
+        Parameters
+        ----------
+        database_rows : list(tuple)
+            rows from database_row().
+        """
+
+        with self.connection_pool.connection() as connection:
+            try:
+                connection.cursor().executemany(self.upsert_statement(), database_rows)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+        self.rows_written += len(database_rows)
+
+    def database_row(self, condensed_line):
+        """the typed parameters for one condensed line.
+
+        Parameters
+        ----------
+        condensed_line : list
+            the nine unified fields.
+        """
+
+        create_date = parse_create_date(condensed_line[2])
+        concentration = parse_float(condensed_line[7])
+        return (condensed_line[0],
+                condensed_line[1],
+                condensed_line[2] if create_date is None else create_date.isoformat(),
+                condensed_line[3],
+                condensed_line[4],
+                condensed_line[5],
+                condensed_line[6],
+                concentration,
+                parse_float(condensed_line[8]),
+                condensed_line[7] if concentration is None else None)
@@ -0,0 +1,189 @@
+import os.path
+
+
+class UnifiedExcelWriter:
+    """Writes condensed lines to an excel file in the unified excel format. Shared by WatersUnify and AgilentUnify.
+
+    The workbook is opened in xlsxwriter's constant_memory mode, so each row is flushed to disk as soon as the next
+    one starts and memory use doesn't grow with the batch. Excel can't hold more than 1,048,576 rows on a sheet, so
+    when a batch gets there the writer rolls over onto a new sheet (or a new file) and repeats the header, instead of
+    producing a workbook Excel refuses to open.
+
+    It takes typed condensed lines (see typed_condensed_line - UnifyOutputPipeline types them for it), and each row
+    goes in with one write_row, so cells are their real types: concentrations and percent recoveries numbers, so
+    they can be summed and charted without "number stored as text", and create date and time excel dates and times.
+    Text that doesn't parse, like '<LOD', is written as it is. The date, time and number formats are set once per
+    column, and the alternating row colours are a conditional format over each sheet's rows, so no cell needs a
+    format of its own.
+
+    Attributes
+    ----------
+    filename : string
+        the excel file to write. Extra files made by rolling over get _2, _3 etc. added before the extension.
+    column_a_width : int
+        width of the data source column.
+    header_cell_formats : list
+        which header format (1, 2 or 3) each of the nine header cells gets.
+    roll_over_to : string
+        'sheet' to roll over onto a new sheet in the same workbook, 'file' to start a new workbook.
+    max_rows_per_sheet : int
+        rows per sheet, header included. Excel's limit unless lowered.
+    filenames_written : list
+        every excel file written, in order.
+    rows_written : int
+        the number of data rows written, headers not included.
+    """
+
+    excel_max_rows_per_sheet = 1048576
+    date_num_format = 'yyyy-mm-dd'
+    time_num_format = 'hh:mm:ss'
+    number_num_format = 'General'
+    odd_row_color = '#c7d6db'
+    even_row_color = '#e9edef'
+
+    def __init__(self, filename, column_a_width=50, header_cell_formats=(1, 2, 2, 2, 2, 3, 3, 3, 3),
+                 roll_over_to='sheet', max_rows_per_sheet=excel_max_rows_per_sheet):
+        """
+        Parameters
+        ----------
+        filename : string
+            the excel file to write.
+        column_a_width : int
+            width of the data source column.
+        header_cell_formats : tuple
+            which header format (1, 2 or 3) each of the nine header cells gets.
+        roll_over_to : string
+            'sheet' or 'file' - where rows go once a sheet is full.
+        max_rows_per_sheet : int
+            rows per sheet, header included.
+
+        Raises
+        ------
+        ValueError
+            roll_over_to isn't 'sheet' or 'file', or max_rows_per_sheet leaves no room for data.
+        """
+
+        if roll_over_to not in ('sheet', 'file'):
+            raise ValueError("roll_over_to must be 'sheet' or 'file', not {!r}".format(roll_over_to))
+        if not 2 <= max_rows_per_sheet <= self.excel_max_rows_per_sheet:
+            raise ValueError("max_rows_per_sheet must be between 2 and {}".format(self.excel_max_rows_per_sheet))
+        self.filename = filename
+        self.column_a_width = column_a_width
+        self.header_cell_formats = list(header_cell_formats)
+        self.roll_over_to = roll_over_to
+        self.max_rows_per_sheet = max_rows_per_sheet
+        self.filenames_written = []
+        self.rows_written = 0
+        self.workbook = None
+        self.worksheet = None
+        self.cell_formats = {}
+
+    def write_condensed_lines(self, condensed_lines):
+        """writes the condensed lines to the excel file(s). The first line is the header.
+
+        Parameters
+        ----------
+        condensed_lines : iterable(list)
+            the header, followed by the typed condensed data lines.
+        """
+
+        condensed_lines = iter(condensed_lines)
+        header_line = next(condensed_lines, None)
+        if header_line is None:
+            return
+        self.open_workbook(self.filename)
+        self.add_worksheet(header_line)
+        try:
+            row = 1
+            for item in condensed_lines:
+                if row == self.max_rows_per_sheet:
+                    # sheet is full, carry on with the header repeated on a fresh one
+                    self.add_row_colors(row)
+                    if self.roll_over_to == 'file':
+                        self.workbook.close()
+                        self.open_workbook(self.roll_over_filename(len(self.filenames_written) + 1))
+                    self.add_worksheet(header_line)
+                    row = 1
+                self.worksheet.write_row(row, 0, item)
+                row += 1
+                self.rows_written += 1
+            self.add_row_colors(row)
+        finally:
+            self.workbook.close()
+
+    def open_workbook(self, filename):
+        """opens a new constant memory workbook and sets up its formats.
+
+        Parameters
+        ----------
+        filename : string
+            the excel file to write.
+        """
+
+        # imported here rather than at the top, so nothing pays for xlsxwriter until a workbook is written
+        import xlsxwriter
+        self.workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+        self.filenames_written.append(filename)
+        # header format for the first two columns
+        self.cell_formats = {1: self.workbook.add_format({'bold': True, 'font_color': 'white', 'bg_color': '#2321a7'}),
+                             2: self.workbook.add_format({'bold': True, 'font_color': 'white', 'bg_color': '#3330db'}),
+                             3: self.workbook.add_format({'bold': True, 'font_color': 'black', 'bg_color': '#29abdc'}),
+                             'date': self.workbook.add_format({'num_format': self.date_num_format}),
+                             'time': self.workbook.add_format({'num_format': self.time_num_format}),
+                             'number': self.workbook.add_format({'num_format': self.number_num_format}),
+                             # helps with the editing to change the color of each second line
+                             'odd': self.workbook.add_format({'bg_color': self.odd_row_color}),
+                             'even': self.workbook.add_format({'bg_color': self.even_row_color})}
+
+    def add_worksheet(self, header_line):
+        """adds a worksheet to the open workbook, sets the column widths and formats and writes the header.
+
+        Parameters
+        ----------
+        header_line : list
+            the nine unified field names.
+        """
+
+        self.worksheet = self.workbook.add_worksheet()
+        # set column width, and the date, time and number formats of the cells written without one
+        self.worksheet.set_column('A:A', self.column_a_width)
+        self.worksheet.set_column('B:B', 20)
+        self.worksheet.set_column('C:C', 20, self.cell_formats['date'])
+        self.worksheet.set_column('D:D', 20, self.cell_formats['time'])
+        self.worksheet.set_column('E:G', 20)
+        self.worksheet.set_column('H:I', 20, self.cell_formats['number'])
+        for column, (field_name, header_cell_format) in enumerate(zip(header_line, self.header_cell_formats)):
+            self.worksheet.write(0, column, field_name, self.cell_formats[header_cell_format])
+
+    def add_row_colors(self, row_count):
+        """colours the data rows of the current sheet, alternating by row. Conditional formats only change the fill,
+        so the column's date and time formats still apply underneath.
+
+        Parameters
+        ----------
+        row_count : int
+            rows on the sheet, header included.
+        """
+
+        if row_count < 2:
+            return
+        data_range = 'A2:I{}'.format(row_count)
+        # the header is excel row 1, so the first data row (row 1 here, an odd one) is excel row 2
+        self.worksheet.conditional_format(data_range, {'type': 'formula', 'criteria': '=MOD(ROW(),2)=0',
+                                                       'format': self.cell_formats['odd']})
+        self.worksheet.conditional_format(data_range, {'type': 'formula', 'criteria': '=MOD(ROW(),2)=1',
+                                                       'format': self.cell_formats['even']})
+
+    def roll_over_filename(self, file_number):
+        """the filename for the nth file when rolling over to new files, e.g. batch.xlsx -> batch_2.xlsx.
+
+        Parameters
+        ----------
+        file_number : int
+            which file this is, starting from 1.
+        """
+
+        if file_number == 1:
+            return self.filename
+        base_filename, extension = os.path.splitext(self.filename)
+        return "{}_{}{}".format(base_filename, file_number, extension)
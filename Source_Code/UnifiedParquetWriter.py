@@ -0,0 +1,283 @@
+if __package__:
+    from .UnifiedSchema import unified_column_names, parse_create_date, parse_float
+else:
+    # run as a script from Source_Code
+    from UnifiedSchema import unified_column_names, parse_create_date, parse_float
+import datetime
+import os.path
+import glob
+
+# the text columns after the nine unified ones - what the typed columns can't give back as the instrument wrote it
+unified_text_column_names = ['analyte_concentration_text', 'create_date_text', 'percent_recovery_text']
+
+# loaded on first use by load_pyarrow - it takes a few hundred ms to import, and is only needed for parquet/arrow
+pyarrow = None
+
+
+def kept_number_text(text, number):
+    """the text of a concentration or percent recovery, if its float column can't give it back as it was written -
+    it isn't a number ('<LOD', ' '), or repr(float) writes it differently ('0.050', '1.20E+03'). None if the float
+    is enough.
+
+    Parameters
+    ----------
+    text : string
+        the value as it was written.
+    number : float
+        parse_float(text).
+    """
+
+    if not isinstance(text, str):
+        return None
+    return text if number is None or repr(number) != text else None
+
+
+def load_pyarrow():
+    """imports pyarrow (and the parts of it used here) the first time it's needed.
+
+    Raises
+    ------
+    ImportError
+        pyarrow isn't installed.
+    """
+
+    global pyarrow
+    if pyarrow is None:
+        try:
+            import pyarrow.parquet
+            import pyarrow.ipc
+            import pyarrow.dataset
+        except ImportError:
+            raise ImportError("pyarrow is needed for parquet/arrow output - pip install pyarrow")
+    return pyarrow
+
+
+class UnifiedParquetWriter:
+    """Writes condensed lines to a typed, compressed Parquet (or Arrow IPC) file. Shared by both converters.
+
+    The file has the nine unified columns (named as in UnifiedSchema.unified_column_names), typed rather than all
+    text: create date is a date32, analyte concentration and percent recovery are float64, and the repeating string
+    columns are dictionary encoded. Concentrations that aren't numbers ('<LOD', blanks) are null in
+    analyte_concentration, with their text in an extra analyte_concentration_text column so nothing is lost - as is
+    the text of ones the float would write differently ('0.050'). percent_recovery_text does the same for percent
+    recovery (' ' for none), and create_date_text keeps each date as the instrument wrote it (22-Jun-21), so reading
+    a file back (see UnifyMerge) gives the condensed lines it was written from. Rows are converted and written
+    batch_size at a time, so memory use doesn't grow with the batch.
+
+    Reading a day's worth back (read_unified_files) is then one pyarrow call, with no parsing - rather than opening
+    thousands of spreadsheets.
+
+    Attributes
+    ----------
+    filename : string
+        the file to write.
+    file_format : string
+        'parquet', or 'arrow' for an Arrow IPC file.
+    compression : string
+        the codec, e.g. 'zstd', 'snappy' or None.
+    batch_size : int
+        rows converted and written at a time.
+    rows_written : int
+        the number of data rows written.
+    """
+
+    file_formats = ('parquet', 'arrow')
+
+    def __init__(self, filename, file_format='parquet', compression='zstd', batch_size=65536):
+        """
+        Parameters
+        ----------
+        filename : string
+            the file to write.
+        file_format : string
+            'parquet' or 'arrow'.
+        compression : string
+            the codec. Arrow IPC files only support 'zstd', 'lz4' or None.
+        batch_size : int
+            rows converted and written at a time.
+
+        Raises
+        ------
+        ImportError
+            pyarrow isn't installed.
+        ValueError
+            file_format isn't 'parquet' or 'arrow'.
+        """
+
+        load_pyarrow()
+        if file_format not in self.file_formats:
+            raise ValueError("file_format must be 'parquet' or 'arrow', not {!r}".format(file_format))
+        self.filename = filename
+        self.file_format = file_format
+        self.compression = compression
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self.schema = unified_arrow_schema()
+
+    def write_condensed_lines(self, condensed_lines):
+        """writes the condensed lines to the file. The first line is the header, and is skipped - the column names
+        come from the schema.
+
+        Parameters
+        ----------
+        condensed_lines : iterable(list)
+            the header, followed by the condensed data lines.
+        """
+
+        condensed_lines = iter(condensed_lines)
+        if next(condensed_lines, None) is None:
+            return
+        with self.open_file() as writer:
+            batch = []
+            for item in condensed_lines:
+                batch.append(item)
+                if len(batch) == self.batch_size:
+                    self.write_record_batch(writer, self.record_batch_from_condensed_lines(batch))
+                    batch = []
+            if batch or self.rows_written == 0:
+                self.write_record_batch(writer, self.record_batch_from_condensed_lines(batch))
+
+    def write_unified_table(self, unified_table):
+        """writes a UnifiedTable to the file, straight from its codes and concentration array.
+
+        The table is already dictionary encoded, so the string columns go over as they are and each distinct date
+        and percent recovery is only parsed once.
+
+        Parameters
+        ----------
+        unified_table : UnifiedTable
+            the condensed data.
+        """
+
+        import numpy
+        string_values = dict(zip(unified_table.string_field_indexes, unified_table.string_values))
+        date_field_index, percent_recovery_field_index = 2, 8
+        # per distinct value, then looked up by code for every row
+        date_days = [parse_create_date(value) for value in string_values[date_field_index]]
+        date_mask = numpy.array([day is None for day in date_days], dtype=bool)
+        date_days = numpy.array([0 if day is None else (day - datetime.date(1970, 1, 1)).days for day in date_days],
+                                dtype=numpy.int32)
+        percent_recovery = [parse_float(value) for value in string_values[percent_recovery_field_index]]
+        percent_recovery_text = list(map(kept_number_text, string_values[percent_recovery_field_index],
+                                         percent_recovery))
+        percent_recovery = numpy.array([numpy.nan if number is None else number for number in percent_recovery],
+                                       dtype=numpy.float64)
+        dictionaries = {field_index: pyarrow.array(values, pyarrow.string())
+                        for field_index, values in string_values.items()}
+        codes = {field_index: unified_table.codes_array(unified_table.field_names[field_index]).astype(numpy.int32)
+                 for field_index in unified_table.string_field_indexes}
+        concentration = unified_table.concentration_array()
+        with self.open_file() as writer:
+            for start in range(0, max(len(unified_table), 1), self.batch_size):
+                stop = min(start + self.batch_size, len(unified_table))
+                columns = []
+                for field_index, column_name in enumerate(unified_column_names):
+                    if field_index == date_field_index:
+                        batch_codes = codes[field_index][start:stop]
+                        columns.append(pyarrow.array(date_days[batch_codes], type=pyarrow.date32(),
+                                                     mask=date_mask[batch_codes]))
+                    elif field_index == percent_recovery_field_index:
+                        batch_values = percent_recovery[codes[field_index][start:stop]]
+                        columns.append(pyarrow.array(batch_values, mask=numpy.isnan(batch_values)))
+                    elif field_index == unified_table.concentration_field_index:
+                        batch_values = concentration[start:stop]
+                        columns.append(pyarrow.array(batch_values, mask=numpy.isnan(batch_values)))
+                    else:
+                        columns.append(pyarrow.DictionaryArray.from_arrays(codes[field_index][start:stop],
+                                                                           dictionaries[field_index]))
+                # the table keeps the same concentration text kept_number_text does
+                columns.append(pyarrow.array([unified_table.concentration_text.get(row) for row in range(start, stop)]
+                                             if unified_table.concentration_text else [None] * (stop - start),
+                                             pyarrow.string()))
+                columns.append(pyarrow.DictionaryArray.from_arrays(codes[date_field_index][start:stop],
+                                                                   dictionaries[date_field_index]))
+                columns.append(pyarrow.array([percent_recovery_text[code] for code in
+                                              codes[percent_recovery_field_index][start:stop].tolist()],
+                                             pyarrow.string()))
+                self.write_record_batch(writer, pyarrow.RecordBatch.from_arrays(columns, schema=self.schema))
+
+    def open_file(self):
+        """the parquet or arrow writer for filename. Use it as a context manager so the file is always closed. """
+
+        if self.file_format == 'parquet':
+            return pyarrow.parquet.ParquetWriter(self.filename, self.schema, compression=self.compression)
+        return pyarrow.ipc.new_file(self.filename, self.schema,
+                                    options=pyarrow.ipc.IpcWriteOptions(compression=self.compression))
+
+    def write_record_batch(self, writer, record_batch):
+        """writes one batch of rows and counts them. """
+
+        writer.write_batch(record_batch)
+        self.rows_written += record_batch.num_rows
+
+    def record_batch_from_condensed_lines(self, condensed_lines):
+        """converts a list of condensed lines into a typed record batch.
+
+        Parameters
+        ----------
+        condensed_lines : list(list)
+            nine-field condensed lines, no header.
+        """
+
+        columns = [list(column) for column in zip(*condensed_lines)] or [[] for _ in unified_column_names]
+        concentrations = [parse_float(value) for value in columns[7]]
+        percent_recoveries = [parse_float(value) for value in columns[8]]
+        arrays = [pyarrow.array(columns[0], pyarrow.string()).dictionary_encode(),
+                  pyarrow.array(columns[1], pyarrow.string()).dictionary_encode(),
+                  pyarrow.array([parse_create_date(value) for value in columns[2]], pyarrow.date32()),
+                  pyarrow.array(columns[3], pyarrow.string()).dictionary_encode(),
+                  pyarrow.array(columns[4], pyarrow.string()).dictionary_encode(),
+                  pyarrow.array(columns[5], pyarrow.string()).dictionary_encode(),
+                  pyarrow.array(columns[6], pyarrow.string()).dictionary_encode(),
+                  pyarrow.array(concentrations, pyarrow.float64()),
+                  pyarrow.array(percent_recoveries, pyarrow.float64()),
+                  pyarrow.array(list(map(kept_number_text, columns[7], concentrations)), pyarrow.string()),
+                  pyarrow.array(columns[2], pyarrow.string()).dictionary_encode(),
+                  pyarrow.array(list(map(kept_number_text, columns[8], percent_recoveries)), pyarrow.string())]
+        return pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+def unified_arrow_schema():
+    """the arrow schema of the unified parquet/arrow files.
+
+    Raises
+    ------
+    ImportError
+        pyarrow isn't installed.
+    """
+
+    load_pyarrow()
+    dictionary_string = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    column_types = [dictionary_string, dictionary_string, pyarrow.date32(), dictionary_string, dictionary_string,
+                    dictionary_string, dictionary_string, pyarrow.float64(), pyarrow.float64()]
+    text_column_types = [pyarrow.string(), dictionary_string, pyarrow.string()]
+    return pyarrow.schema([pyarrow.field(column_name, column_type)
+                           for column_name, column_type in zip(unified_column_names + unified_text_column_names,
+                                                               column_types + text_column_types)])
+
+
+def read_unified_files(path, file_format='parquet'):
+    """reads unified parquet/arrow files back into one pyarrow Table, e.g. a day's batches for the database or
+    .to_pandas().
+
+    Parameters
+    ----------
+    path : string
+        a unified file, a directory of them, or a glob pattern.
+    file_format : string
+        'parquet' or 'arrow'.
+
+    Raises
+    ------
+    ImportError
+        pyarrow isn't installed.
+    """
+
+    load_pyarrow()
+    if os.path.isdir(path):
+        path = os.path.join(path, '*.' + file_format)
+    filenames = sorted(glob.glob(path))
+    if not filenames:
+        return unified_arrow_schema().empty_table()
+    dataset_format = 'ipc' if file_format == 'arrow' else file_format
+    return pyarrow.dataset.dataset(filenames, format=dataset_format, schema=unified_arrow_schema()).to_table()
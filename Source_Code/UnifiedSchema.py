@@ -0,0 +1,162 @@
+import functools
+import datetime
+import math
+
+
+# the nine fields of the unified excel format, in order
+unified_field_names = ['data source',
+                       'filename',
+                       'create date',
+                       'create time',
+                       'sample name',
+                       'sample type',
+                       'analyte name',
+                       'analyte concentration',
+                       'percent recovery']
+
+# the same fields as column names for typed outputs (parquet, databases), where spaces get in the way
+unified_column_names = [field_name.replace(' ', '_') for field_name in unified_field_names]
+
+# Waters writes 22-Jun-21, the new ICP software 06/22/2021 (or ISO), the old ICP 6/2/2021 (no leading zeros)
+create_date_formats = ['%d-%b-%y', '%d-%b-%Y', '%m/%d/%Y', '%Y-%m-%d', '%Y/%m/%d', '%d/%m/%Y', '%m/%d/%y']
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_create_date(create_date):
+    """the create date as a datetime.date, or None if it isn't in any of create_date_formats.
+
+    Every row in a sample (and often a whole batch) has the same date string, so results are cached and each
+    distinct string is only parsed once.
+
+    Parameters
+    ----------
+    create_date : string
+        the create date as the instrument wrote it.
+    """
+
+    create_date = create_date.strip()
+    for create_date_format in create_date_formats:
+        try:
+            return datetime.datetime.strptime(create_date, create_date_format).date()
+        except ValueError:
+            pass
+    return None
+
+
+# Waters and the new ICP software write 24 hour times, the old ICP 12 hour ones with AM/PM
+create_time_formats = ['%H:%M:%S', '%H:%M', '%I:%M:%S %p', '%I:%M %p']
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_create_time(create_time):
+    """the create time as a datetime.time, or None if it isn't in any of create_time_formats. Cached like
+    parse_create_date.
+
+    Parameters
+    ----------
+    create_time : string
+        the create time as the instrument wrote it.
+    """
+
+    create_time = create_time.strip()
+    for create_time_format in create_time_formats:
+        try:
+            return datetime.datetime.strptime(create_time, create_time_format).time()
+        except ValueError:
+            pass
+    return None
+
+
+def parse_float(value):
+    """the value as a float, or None if it isn't a finite number (blank, '<LOD', ' ', 'NaN' and so on).
+
+    Parameters
+    ----------
+    value : string or float
+        a concentration or percent recovery.
+    """
+
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def typed_number(value):
+    """the value as a float if it's a number, otherwise its text as written - below-limit results like '<LOD' or
+    '< 0.05', 'ND', and the blank percent recoveries are results in their own right, not missing numbers, so they
+    are kept rather than turned into blanks.
+
+    Parameters
+    ----------
+    value : string or float
+        a concentration or percent recovery.
+    """
+
+    number = parse_float(value)
+    if number is not None:
+        return number
+    return value if isinstance(value, str) else ''
+
+
+def typed_create_date(create_date):
+    """the create date as a datetime.date, or its text as written if it isn't a date (or isn't text). Cached through
+    parse_create_date.
+
+    Parameters
+    ----------
+    create_date : string
+        the create date as the instrument wrote it.
+    """
+
+    if isinstance(create_date, str):
+        return parse_create_date(create_date) or create_date
+    return create_date
+
+
+def typed_create_time(create_time):
+    """the create time as a datetime.time, or its text as written. Cached through parse_create_time.
+
+    Parameters
+    ----------
+    create_time : string
+        the create time as the instrument wrote it.
+    """
+
+    if isinstance(create_time, str):
+        return parse_create_time(create_time) or create_time
+    return create_time
+
+
+# field index -> its typed conversion, for the fields that aren't just text
+typed_field_functions = {2: typed_create_date,
+                         3: typed_create_time,
+                         7: typed_number,
+                         8: typed_number}
+
+
+def typed_condensed_line(condensed_line):
+    """the condensed line with python types where its text allows - create date a datetime.date, create time a
+    datetime.time, concentration and percent recovery floats (see typed_number). Anything that doesn't parse keeps
+    its text, so a header line comes through as it is.
+
+    Dates and times go through the cached parse_create_date and parse_create_time, so a batch's few distinct
+    timestamps are only parsed once however many rows share them. A UnifiedTable does better still, and types each
+    distinct value once (see UnifiedTable.typed_condensed_lines).
+
+    Parameters
+    ----------
+    condensed_line : list
+        the nine unified fields, as text (or already typed).
+    """
+
+    return [condensed_line[0],
+            condensed_line[1],
+            typed_create_date(condensed_line[2]),
+            typed_create_time(condensed_line[3]),
+            condensed_line[4],
+            condensed_line[5],
+            condensed_line[6],
+            typed_number(condensed_line[7]),
+            typed_number(condensed_line[8])]
@@ -0,0 +1,236 @@
+if __package__:
+    from .UnifiedSchema import unified_field_names, typed_field_functions
+else:
+    # run as a script from Source_Code
+    from UnifiedSchema import unified_field_names, typed_field_functions
+import array
+import math
+
+
+class UnifiedTable:
+    """Columnar, dictionary-encoded store for condensed data, instead of a list of nine-element lists.
+
+    Most of the unified fields repeat - data source and filename are the same for a whole batch, and date, time,
+    sample name and type are the same for every analyte in a sample. So each string column keeps every distinct value
+    once, and each row only stores a code per column - 1 byte while a column has fewer than 256 distinct values,
+    2 bytes up to 65536, 4 after that. Analyte concentration is stored as float64, so it is a NumPy column
+    (concentration_array) without any parsing. Concentrations that aren't numbers (blank, '<LOD' and so on) are NaN
+    in the array, and their text is kept in concentration_text so nothing is lost. So is the text of numbers a float
+    wouldn't give back as they were exported ('0.050', '1.20E+03', 'NaN'), so the table writes out the same unified
+    files as the list of lists does.
+
+    Iterating the table gives back condensed lines (concentration as a float, or its text), and condensed_lines()
+    puts the header in front, so generate_excel_files and generate_csv_files take a table as they are.
+    typed_condensed_lines() gives them typed instead, for the excel file - each distinct date, time and percent
+    recovery is converted once, rather than once a row.
+
+    Rows are appended to array.array buffers. The NumPy views returned by concentration_array and codes_array share
+    that memory, so take them once the table is built - appending while a view is alive raises BufferError.
+
+    Attributes
+    ----------
+    field_names : list
+        the nine unified field names, in order.
+    string_values : list(list)
+        for each string column, its distinct values, indexed by code.
+    string_codes : list(array.array)
+        for each string column, one code per row.
+    concentration_values : array.array
+        analyte concentration per row, NaN where it isn't a number.
+    concentration_text : dict
+        row -> original text, for concentrations that aren't numbers, or that repr(float(text)) doesn't give back.
+    """
+
+    field_names = unified_field_names
+    concentration_field_index = 7
+    string_field_indexes = [0, 1, 2, 3, 4, 5, 6, 8]
+    # codes start at 1 byte each and are widened when a column gets more distinct values than fit
+    wider_code_typecodes = {'B': ('H', 256), 'H': ('I', 65536)}
+
+    def __init__(self):
+        # value -> code, per string column, only needed while appending
+        self.string_value_codes = [{} for _ in self.string_field_indexes]
+        self.string_values = [[] for _ in self.string_field_indexes]
+        self.string_codes = [array.array('B') for _ in self.string_field_indexes]
+        self.concentration_values = array.array('d')
+        self.concentration_text = {}
+
+    @classmethod
+    def from_condensed_lines(cls, condensed_lines):
+        """builds a table from condensed lines (no header), e.g. a converter's generate_condensed_lines.
+
+        Parameters
+        ----------
+        condensed_lines : iterable(list)
+            nine-field condensed lines.
+        """
+
+        unified_table = cls()
+        unified_table.extend(condensed_lines)
+        return unified_table
+
+    @classmethod
+    def from_columns(cls, string_columns, concentration_values, concentration_text=None):
+        """builds a table straight from already encoded columns, e.g. from a vectorized NumPy conversion.
+
+        Parameters
+        ----------
+        string_columns : list(tuple)
+            (distinct values, NumPy array of codes) for each string column, in string_field_indexes order. The
+            values should be distinct, so that appending more rows later finds them.
+        concentration_values : numpy.ndarray
+            analyte concentration per row, NaN where it isn't a number.
+        concentration_text : dict
+            row -> original text, for concentrations that aren't numbers, or that repr(float(text)) doesn't give
+            back.
+        """
+
+        # numpy is imported where it's used, so importing this module (and the converters) stays quick
+        import numpy
+        unified_table = cls()
+        for column, (values, codes) in enumerate(string_columns):
+            unified_table.string_values[column] = list(values)
+            unified_table.string_value_codes[column] = {value: code for code, value in enumerate(values)}
+            typecode = 'B' if len(values) <= 256 else 'H' if len(values) <= 65536 else 'I'
+            unified_table.string_codes[column] = array.array(typecode)
+            unified_table.string_codes[column].frombytes(numpy.ascontiguousarray(codes, dtype=typecode).tobytes())
+        unified_table.concentration_values.frombytes(
+            numpy.ascontiguousarray(concentration_values, dtype=numpy.float64).tobytes())
+        unified_table.concentration_text = dict(concentration_text or {})
+        return unified_table
+
+    def __len__(self):
+        return len(self.concentration_values)
+
+    def append(self, condensed_line):
+        """adds one condensed line.
+
+        Parameters
+        ----------
+        condensed_line : list
+            the nine unified fields.
+        """
+
+        for column, field_index in enumerate(self.string_field_indexes):
+            value = condensed_line[field_index]
+            value_codes = self.string_value_codes[column]
+            code = value_codes.get(value)
+            if code is None:
+                code = value_codes[value] = len(self.string_values[column])
+                self.string_values[column].append(value)
+                wider_code_typecode = self.wider_code_typecodes.get(self.string_codes[column].typecode)
+                if wider_code_typecode is not None and code == wider_code_typecode[1]:
+                    self.string_codes[column] = array.array(wider_code_typecode[0], self.string_codes[column])
+            self.string_codes[column].append(code)
+        concentration = condensed_line[self.concentration_field_index]
+        try:
+            concentration_value = float(concentration)
+        except (TypeError, ValueError):
+            # '<LOD', blanks etc. - keep the text so it can be written back out
+            self.concentration_text[len(self.concentration_values)] = concentration
+            self.concentration_values.append(float('nan'))
+            return
+        if isinstance(concentration, str) and (repr(concentration_value) != concentration or
+                                               not math.isfinite(concentration_value)):
+            # '0.050', '1.20E+03' - a number, but the float alone would write it out differently. 'inf' too, which
+            # typed output keeps as text
+            self.concentration_text[len(self.concentration_values)] = concentration
+        self.concentration_values.append(concentration_value)
+
+    def extend(self, condensed_lines):
+        """adds every condensed line from an iterable.
+
+        Parameters
+        ----------
+        condensed_lines : iterable(list)
+            nine-field condensed lines.
+        """
+
+        append = self.append
+        for condensed_line in condensed_lines:
+            append(condensed_line)
+
+    def __getitem__(self, row):
+        """the condensed line at a row. """
+
+        if row < 0:
+            row += len(self)
+        condensed_line = [None] * 9
+        for column, field_index in enumerate(self.string_field_indexes):
+            condensed_line[field_index] = self.string_values[column][self.string_codes[column][row]]
+        condensed_line[self.concentration_field_index] = self.concentration_text.get(row,
+                                                                                     self.concentration_values[row])
+        return condensed_line
+
+    def __iter__(self):
+        """yields each row as a condensed line. """
+
+        # decoding a column at a time would build eight full lists - go a row at a time to keep memory flat
+        string_values = self.string_values
+        string_codes = self.string_codes
+        concentration_text = self.concentration_text
+        for row, concentration in enumerate(self.concentration_values):
+            yield [string_values[0][string_codes[0][row]],
+                   string_values[1][string_codes[1][row]],
+                   string_values[2][string_codes[2][row]],
+                   string_values[3][string_codes[3][row]],
+                   string_values[4][string_codes[4][row]],
+                   string_values[5][string_codes[5][row]],
+                   string_values[6][string_codes[6][row]],
+                   concentration_text.get(row, concentration),
+                   string_values[7][string_codes[7][row]]]
+
+    def condensed_lines(self):
+        """the header followed by every row - the shape the excel and csv writers take. """
+
+        yield list(self.field_names)
+        yield from self
+
+    def typed_condensed_lines(self):
+        """the header followed by every row, typed as typed_condensed_line types them. The string columns are typed
+        once per distinct value and looked up by code, and the concentrations are already floats - the text of the
+        ones that aren't finite numbers ('<LOD', blanks) is used instead, as typed_number does. """
+
+        yield list(self.field_names)
+        typed_values = [[typed_field_functions[field_index](value) for value in values]
+                        if field_index in typed_field_functions else values
+                        for field_index, values in zip(self.string_field_indexes, self.string_values)]
+        string_codes = self.string_codes
+        concentration_text = self.concentration_text
+        isfinite = math.isfinite
+        for row, concentration in enumerate(self.concentration_values):
+            yield [typed_values[0][string_codes[0][row]],
+                   typed_values[1][string_codes[1][row]],
+                   typed_values[2][string_codes[2][row]],
+                   typed_values[3][string_codes[3][row]],
+                   typed_values[4][string_codes[4][row]],
+                   typed_values[5][string_codes[5][row]],
+                   typed_values[6][string_codes[6][row]],
+                   concentration if isfinite(concentration) else concentration_text.get(row, ''),
+                   typed_values[7][string_codes[7][row]]]
+
+    def concentration_array(self):
+        """analyte concentration as a float64 NumPy array, sharing the table's memory. NaN where not a number. """
+
+        import numpy
+        return numpy.frombuffer(self.concentration_values, dtype=numpy.float64)
+
+    def codes_array(self, field_name):
+        """the codes of a string column as an unsigned NumPy array (uint8, uint16 or uint32, whichever the column
+        has needed), sharing the table's memory. Look codes up in string_values.
+
+        Parameters
+        ----------
+        field_name : string
+            one of field_names, other than analyte concentration.
+        """
+
+        import numpy
+        column = self.string_field_indexes.index(self.field_names.index(field_name))
+        return numpy.frombuffer(self.string_codes[column], dtype=self.string_codes[column].typecode)
+
+    def nbytes(self):
+        """roughly how much memory the row data takes - codes and concentrations, not the distinct values. """
+
+        return (sum(codes.itemsize * len(codes) for codes in self.string_codes) +
+                self.concentration_values.itemsize * len(self.concentration_values))
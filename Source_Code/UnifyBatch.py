@@ -0,0 +1,445 @@
+if __package__:
+    from .UnifyFormatRegistry import unify_format_registry
+    from .UnifyCache import UnifyCache
+    from .UnifyOutputPipeline import UnifyOutputPipeline
+    from .UnifyInstrumentation import UnifyInstrumentation
+    from .UnifyIndex import UnifyIndex, indexed_output_formats, default_index_filename
+else:
+    # run as a script from Source_Code
+    from UnifyFormatRegistry import unify_format_registry
+    from UnifyCache import UnifyCache
+    from UnifyOutputPipeline import UnifyOutputPipeline
+    from UnifyInstrumentation import UnifyInstrumentation
+    from UnifyIndex import UnifyIndex, indexed_output_formats, default_index_filename
+import concurrent.futures
+import argparse
+import itertools
+import glob
+import csv
+import os
+import time
+
+
+def read_csv_file_in_list_format(filename):
+    """Opens the csv file at the filename and reads it into a list of lists, the same way UnifyTK does.
+
+    Parameters
+    ----------
+    filename : string
+        the csv file to read.
+    """
+
+    csv_file_in_list_format = []
+    with open(filename, newline='') as csv_file:
+        csv_file_reader = csv.reader(csv_file)
+        for item in csv_file_reader:
+            csv_file_in_list_format.append(item)
+    return csv_file_in_list_format
+
+
+default_cache_index_filename = '.unify_cache.sqlite3'
+
+
+def unify_pathway_decider(csv_file_rows, unified_files_directory, streaming=False, unify_format=None,
+                          output_formats=None, unify_instrumentation=None):
+    """Decides which pathway to send the csv down, and runs it. Uses the formats in unify_format_registry.
+
+    Parameters
+    ----------
+    csv_file_rows : list(list) or iterator(list)
+        csv file to be converted in a list of lists, or an iterator over its rows if streaming.
+    unified_files_directory : string
+        the directory the unified files are written to.
+    streaming=False
+        True to stream the rows through the converter one at a time instead of condensing into a list first.
+    unify_format=None
+        the UnifyFormat, if it has already been detected. Otherwise it is detected from the header row.
+    output_formats=None
+        the outputs to write in one pass, e.g. ['xlsx', 'csv']. None for just the excel file.
+    unify_instrumentation=None
+        times the converter's phases, if given.
+
+    Returns
+    -------
+    tuple
+        the name of the pathway taken, and the filename of the unified file written.
+
+    Raises
+    ------
+    ValueError
+        no valid unify pathway was detected for the csv file.
+    """
+
+    if unify_format is None:
+        if streaming:
+            # only the header is needed to decide, so take it off the front and put it back for the converter
+            csv_file_rows = iter(csv_file_rows)
+            header_row = next(csv_file_rows, [])
+            csv_file_rows = itertools.chain([header_row], csv_file_rows)
+        else:
+            header_row = csv_file_rows[0] if csv_file_rows else []
+        unify_format = unify_format_registry.detect_format_from_header_row(header_row)
+    converter = unify_format.convert(csv_file_rows, unified_files_directory, unify_instrumentation,
+                                     streaming=streaming, output_formats=output_formats)
+    return unify_format.name, converter.output_filename
+
+
+def conversion_cache_key(unify_cache, filename, unified_files_directory, unify_format, output_formats=None):
+    """the UnifyCache key for converting a file down a pathway to output_formats in unified_files_directory.
+
+    Parameters
+    ----------
+    unify_cache : UnifyCache
+        the cache.
+    filename : string
+        the export - only its bytes go into the key, not its name.
+    unified_files_directory : string
+        the directory the unified files are written to.
+    unify_format : UnifyFormat
+        the format it was detected as.
+    output_formats=None
+        the output format names, or None for just the excel file.
+    """
+
+    # a conversion to other formats isn't a hit, so they're part of the key
+    cache_pathway = unify_format.name
+    if output_formats is not None:
+        cache_pathway += ':' + '+'.join(output_formats)
+    return unify_cache.cache_key(filename, cache_pathway, unify_format.converter_class.converter_version,
+                                 unified_files_directory)
+
+
+def unify_single_file(filename, unified_files_directory, streaming=False, cache_index_filename=None,
+                      format_name=None, output_formats=None, instrument=False, profile_directory=None,
+                      index_filename=None):
+    """Reads and unifies one file. Runs inside a worker process, so it never raises - failures come back as results.
+
+    Parameters
+    ----------
+    filename : string
+        the csv file to unify.
+    unified_files_directory : string
+        the directory the unified files are written to.
+    streaming=False
+        True to stream rows from the open file through the converter, rather than reading the whole file first.
+    cache_index_filename=None
+        the UnifyCache index to check first. If the same bytes have been converted by the same converter version
+        into the same directory, and the unified files are all still there, the conversion is skipped. None turns
+        the cache off.
+    format_name=None
+        the name of the file's format, if the caller has already classified it. Otherwise it is detected from the
+        head of the file.
+    output_formats=None
+        the outputs to write in one pass, e.g. ['xlsx', 'csv']. None for just the excel file.
+    instrument=False
+        True to time each phase of the conversion (see UnifyInstrumentation) and return them under 'phases'.
+    profile_directory=None
+        a directory to dump a cProfile of the conversion to, as <input file name>.prof. Turns instrument on.
+    index_filename=None
+        the UnifyIndex to add the converted results to, in the same pass as the output files. None for no index.
+
+    Returns
+    -------
+    dict
+        filename, success, cached, pathway, output filename (the main one), output filenames (every one written),
+        message, the time taken in seconds and the phases.
+    """
+
+    start_time = time.perf_counter()
+    result = {'filename': filename,
+              'success': False,
+              'cached': False,
+              'pathway': '',
+              'output_filename': '',
+              'output_filenames': [],
+              'message': '',
+              'seconds': 0.0,
+              'phases': []}
+    profile_filename = None
+    if profile_directory is not None:
+        profile_filename = os.path.join(profile_directory, os.path.basename(filename) + '.prof')
+    unify_instrumentation = UnifyInstrumentation(enabled=instrument or profile_directory is not None,
+                                                 profile_filename=profile_filename,
+                                                 labels={'filename': os.path.basename(filename)})
+    try:
+        if format_name is not None:
+            unify_format = unify_format_registry.format_named(format_name)
+        else:
+            unify_format = unify_format_registry.detect_format(filename)
+        result['pathway'] = unify_format.name
+        unify_instrumentation.labels['pathway'] = unify_format.name
+        unify_cache = cache_key = None
+        if cache_index_filename is not None:
+            unify_cache = UnifyCache(cache_index_filename)
+            cache_key = conversion_cache_key(unify_cache, filename, unified_files_directory, unify_format,
+                                             output_formats)
+            cached_output_filenames = unify_cache.cached_output_filenames(cache_key)
+            if cached_output_filenames is not None:
+                result.update(success=True, cached=True, output_filename=cached_output_filenames[0],
+                              output_filenames=cached_output_filenames)
+                if index_filename is not None:
+                    # converted before the index was, maybe - the cached file is indexed as it is
+                    index_message = UnifyIndex(index_filename).index_unified_file_if_missing(result['output_filename'])
+                    if index_message:
+                        result['message'] = "cached, but not indexed: {}".format(index_message)
+                result['seconds'] = time.perf_counter() - start_time
+                return result
+        index_output_sink = None
+        if index_filename is not None:
+            output_formats, index_output_sink = indexed_output_formats(output_formats, index_filename)
+        if not unify_format.reads_csv:
+            # e.g. TargetLynx XML - the converter reads the file itself
+            converter = unify_format.convert(filename, unified_files_directory, unify_instrumentation,
+                                             output_formats=output_formats)
+        elif unify_format.reads_projected_csv:
+            # e.g. Waters - the converter reads only the columns it uses, straight from the file
+            converter = unify_format.convert(filename, unified_files_directory, unify_instrumentation,
+                                             streaming=streaming, projected=True, output_formats=output_formats)
+        elif streaming:
+            with open(filename, newline='') as csv_file:
+                converter = unify_format.convert(csv.reader(csv_file), unified_files_directory, unify_instrumentation,
+                                                 streaming=True, output_formats=output_formats)
+        else:
+            with unify_instrumentation.phase('read') as unify_phase:
+                csv_file_in_list_format = read_csv_file_in_list_format(filename)
+                unify_phase.rows_out = max(len(csv_file_in_list_format) - 1, 0)
+            converter = unify_format.convert(csv_file_in_list_format, unified_files_directory, unify_instrumentation,
+                                             streaming=False, output_formats=output_formats)
+        # every file, so the cache can tell if any of them has gone
+        result.update(output_filename=converter.output_filename,
+                      output_filenames=converter.output_filenames or [converter.output_filename])
+        if unify_cache is not None:
+            unify_cache.store(cache_key, filename, result['output_filenames'])
+        if index_output_sink is not None and index_output_sink.error is not None:
+            result['message'] = "converted, but not indexed: {}".format(index_output_sink.error)
+        result['success'] = True
+    except UnicodeDecodeError:
+        result['message'] = "This file is not being recognized as a csv file."
+    except Exception as exc:
+        # one bad export shouldn't take the whole batch down with it
+        result['message'] = "{}: {}".format(type(exc).__name__, exc)
+    result['seconds'] = time.perf_counter() - start_time
+    result['phases'] = unify_instrumentation.phase_dicts()
+    return result
+
+
+def find_files_to_unify(input_path):
+    """the files at input_path, sorted. A directory means every file in it with a registered format's extension
+    (.csv and .xml), anything else is treated as a glob.
+
+    Parameters
+    ----------
+    input_path : string
+        a directory of files to unify, or a glob pattern matching them.
+    """
+
+    if os.path.isdir(input_path):
+        patterns = [os.path.join(input_path, file_pattern) for file_pattern in unify_format_registry.file_patterns()]
+    else:
+        patterns = [input_path]
+    return sorted(filename for pattern in patterns for filename in glob.glob(pattern) if os.path.isfile(filename))
+
+
+class UnifyBatch:
+    """Unifies a whole directory (or glob) of exports at once, fanned out over a process pool. No Tk required.
+
+    Attributes
+    ----------
+    input_path : string
+        a directory of files to unify, or a glob pattern matching them.
+    unified_files_directory : string
+        the directory the unified files are written to.
+    max_workers : int
+        the number of worker processes. None lets concurrent.futures pick (one per core).
+    streaming : bool
+        True to stream each file through its converter a row at a time instead of reading it all in first.
+    cache_index_filename : string
+        the UnifyCache index used to skip files that have already been converted. None turns the cache off.
+    output_formats : list
+        the outputs written for each file, e.g. ['xlsx', 'csv']. None for just the excel file.
+    metrics_json_filename : string
+        a JSON file to append every file's phase timings to, or None.
+    metrics_prometheus_filename : string
+        a Prometheus text file to write every file's phase timings to, or None.
+    profile_directory : string
+        a directory to dump a cProfile per file to, or None.
+    index_filename : string
+        the UnifyIndex the converted results are added to. None for no index.
+    files_to_unify : list
+        the files found at input_path.
+    batch_results : list(dict)
+        one result per file, as returned by unify_single_file.
+    """
+
+    def __init__(self, input_path,
+                 unified_files_directory=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                 max_workers=None, streaming=False, cache_index_filename=None, output_formats=None,
+                 metrics_json_filename=None, metrics_prometheus_filename=None, profile_directory=None,
+                 index_filename=None):
+        """
+        Parameters
+        ----------
+        input_path : string
+            a directory of files to unify, or a glob pattern matching them.
+        unified_files_directory : string
+            the directory the unified files are written to.
+        max_workers : int
+            the number of worker processes. None uses one per core.
+        streaming : bool
+            True to stream each file through its converter a row at a time.
+        cache_index_filename : string
+            the UnifyCache index to use, or None for no cache.
+        output_formats : list
+            the outputs written for each file. None for just the excel file.
+        metrics_json_filename : string
+            a JSON file to append every file's phase timings to, or None.
+        metrics_prometheus_filename : string
+            a Prometheus text file to write every file's phase timings to, or None.
+        profile_directory : string
+            a directory to dump a cProfile per file to, or None.
+        index_filename : string
+            the UnifyIndex to add the converted results to, or None for no index.
+        """
+
+        self.input_path = input_path
+        self.unified_files_directory = unified_files_directory
+        self.max_workers = max_workers
+        self.streaming = streaming
+        self.cache_index_filename = cache_index_filename
+        self.output_formats = output_formats
+        self.metrics_json_filename = metrics_json_filename
+        self.metrics_prometheus_filename = metrics_prometheus_filename
+        self.profile_directory = profile_directory
+        self.index_filename = index_filename
+        self.files_to_unify = []
+        self.batch_results = []
+
+    def unify_batch_controller(self):
+        """main function for the class. Returns True if every file was unified. """
+
+        self.find_files_to_unify()
+        self.run_process_pool()
+        self.print_batch_summary()
+        self.write_batch_metrics()
+        return all(result['success'] for result in self.batch_results)
+
+    def find_files_to_unify(self):
+        """finds the files to unify. A directory means every .csv and .xml file in it, anything else is treated as a
+        glob. """
+
+        self.files_to_unify = find_files_to_unify(self.input_path)
+
+    def run_process_pool(self):
+        """classifies every file from its head, then sends the supported ones to the process pool, printing a line
+        for each as it finishes.
+
+        Unsupported files are rejected up front without being parsed. Each supported file is submitted as its own
+        task - the biggest files take the longest, and handing them out individually keeps all the workers busy
+        until the end of the batch. """
+
+        self.batch_results = []
+        routed_files, rejected_files = unify_format_registry.classify_files(self.files_to_unify)
+        for filename, message in rejected_files:
+            self.batch_results.append({'filename': filename, 'success': False, 'cached': False, 'pathway': '',
+                                       'output_filename': '', 'output_filenames': [], 'message': message,
+                                       'seconds': 0.0})
+            print("REJECT {} ({})".format(filename, message))
+        if not routed_files:
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(unify_single_file, filename, self.unified_files_directory, self.streaming,
+                                       self.cache_index_filename, unify_format.name, self.output_formats,
+                                       self.instrumented(), self.profile_directory, self.index_filename)
+                       for filename, unify_format in routed_files]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                self.batch_results.append(result)
+                status = 'cached' if result['cached'] else 'ok    ' if result['success'] else 'FAILED'
+                print("{} {} ({:.2f}s)".format(status, result['filename'], result['seconds']))
+        # as_completed hands them back in finishing order, the summary reads better in file order
+        self.batch_results.sort(key=lambda result: result['filename'])
+
+    def instrumented(self):
+        """True if phase timings are wanted for any output. """
+
+        return bool(self.metrics_json_filename or self.metrics_prometheus_filename or self.profile_directory)
+
+    def write_batch_metrics(self):
+        """writes the phase timings of every file in the batch to the JSON and/or Prometheus files. """
+
+        phase_dicts = [phase_dict for result in self.batch_results for phase_dict in result.get('phases', [])]
+        unify_instrumentation = UnifyInstrumentation()
+        if self.metrics_json_filename:
+            unify_instrumentation.write_json(self.metrics_json_filename, phase_dicts)
+        if self.metrics_prometheus_filename:
+            unify_instrumentation.write_prometheus(self.metrics_prometheus_filename, phase_dicts)
+
+    def print_batch_summary(self):
+        """prints a per-file success/failure summary for the batch. """
+
+        succeeded = [result for result in self.batch_results if result['success']]
+        failed = [result for result in self.batch_results if not result['success']]
+        cached = [result for result in succeeded if result['cached']]
+        print("\n{} files found, {} unified ({} unchanged, skipped), {} failed.".format(
+            len(self.files_to_unify), len(succeeded), len(cached), len(failed)))
+        for result in succeeded:
+            print("  {} -> {} [{}]{}".format(result['filename'], result['output_filename'], result['pathway'],
+                                             ' - ' + result['message'] if result['message'] else ''))
+        if failed:
+            print("\nFailed files:")
+            for result in failed:
+                print("  {}: {}".format(result['filename'], result['message']))
+
+
+def main(argv=None):
+    """command line entry point for batch unifying. """
+
+    parser = argparse.ArgumentParser(description="Unify a directory (or glob) of Waters and Agilent exports.")
+    parser.add_argument('input_path',
+                        help="directory of .csv/.xml files to unify, or a glob pattern such as 'exports/*.csv'")
+    parser.add_argument('-o', '--output-directory',
+                        default=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                        help="directory to write the unified files to")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="number of worker processes (default: one per core)")
+    parser.add_argument('-s', '--streaming', action='store_true',
+                        help="stream rows through the converters instead of reading each file into memory first")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="convert every file, even ones already converted with the same contents")
+    parser.add_argument('--cache-index', default=None,
+                        help="conversion cache index file (default: " + default_cache_index_filename +
+                             " in the output directory)")
+    parser.add_argument('-f', '--formats', default=None,
+                        help="comma separated outputs to write in one pass: xlsx, csv, parquet, arrow (default: xlsx)")
+    parser.add_argument('--no-index', action='store_true',
+                        help="don't add the converted results to the index UnifyIndex.py queries")
+    parser.add_argument('--index', default=None,
+                        help="results index file (default: " + default_index_filename + " in the output directory)")
+    parser.add_argument('--metrics-json', default=None,
+                        help="append each file's per-phase timings, rows/s and peak memory to this JSON file")
+    parser.add_argument('--metrics-prometheus', default=None,
+                        help="write each file's per-phase timings to this Prometheus text file")
+    parser.add_argument('--profile-directory', default=None,
+                        help="dump a cProfile of each file's conversion into this directory")
+    args = parser.parse_args(argv)
+    output_formats = None
+    if args.formats:
+        output_formats = [output_format.strip() for output_format in args.formats.split(',') if output_format.strip()]
+        for output_format in output_formats:
+            if output_format not in UnifyOutputPipeline.output_sink_formats:
+                parser.error("unknown output format {!r}, expected one of {}".format(
+                    output_format, ', '.join(UnifyOutputPipeline.output_sink_formats)))
+    cache_index_filename = None
+    if not args.no_cache:
+        cache_index_filename = args.cache_index or os.path.join(args.output_directory, default_cache_index_filename)
+    index_filename = None
+    if not args.no_index:
+        index_filename = args.index or os.path.join(args.output_directory, default_index_filename)
+    all_succeeded = UnifyBatch(args.input_path, args.output_directory, args.workers, args.streaming,
+                               cache_index_filename, output_formats, args.metrics_json, args.metrics_prometheus,
+                               args.profile_directory, index_filename).unify_batch_controller()
+    return 0 if all_succeeded else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,583 @@
+if __package__:
+    from .AgilentUnify import AgilentUnify
+    from .WatersUnify import WatersUnify
+    from .UnifyBatch import read_csv_file_in_list_format
+    from .UnifiedTable import UnifiedTable
+    from .UnifiedDatabaseSink import UnifiedDatabaseSink, UnifiedConnectionPool
+    from .UnifyInstrumentation import peak_rss_in_megabytes
+else:
+    # run as a script from Source_Code
+    from AgilentUnify import AgilentUnify
+    from WatersUnify import WatersUnify
+    from UnifyBatch import read_csv_file_in_list_format
+    from UnifiedTable import UnifiedTable
+    from UnifiedDatabaseSink import UnifiedDatabaseSink, UnifiedConnectionPool
+    from UnifyInstrumentation import peak_rss_in_megabytes
+import concurrent.futures
+import multiprocessing
+import subprocess
+import argparse
+import datetime
+import platform
+import tempfile
+import shutil
+import random
+import json
+import time
+import csv
+import os
+
+
+def generate_waters_export(filename, output_rows, compounds_per_sample=10, extra_columns=20, fill_extra_columns=False):
+    """writes a synthetic Waters (TargetLynx) csv export, one compound result per row, with a blank line at the end.
+
+    Parameters
+    ----------
+    filename : string
+        the csv file to write.
+    output_rows : int
+        the number of condensed rows the file should produce.
+    compounds_per_sample : int
+        compounds per sample, so the sample fields repeat the way they do in a real batch.
+    extra_columns : int
+        unused columns added after the required ones - real exports carry dozens.
+    fill_extra_columns : bool
+        True to put numbers in the unused columns, the way a real export's peak areas, heights and so on are.
+    """
+
+    header_row = ['', 'version', 'name16', 'createdate', 'createtime', 'sampleid', 'type', 'name20', 'analconc',
+                  'percrecovery', 'stdconc', 'vial', 'methodname'] + ['field' + str(i) for i in range(extra_columns)]
+    padding = [''] * extra_columns
+    random_number = random.Random(output_rows)
+    with open(filename, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(header_row)
+        for row in range(output_rows):
+            sample = row // compounds_per_sample
+            csv_writer.writerow(['', '1', 'BENCH21_{:06d}'.format(sample), '22-Jun-21',
+                                 '{:02d}:{:02d}:00'.format(sample // 60 % 24, sample % 60), 'Sample ' + str(sample),
+                                 'Analyte', 'Compound ' + str(row % compounds_per_sample),
+                                 '{:.4f}'.format(random_number.random() * 100), '{:.1f}'.format(random_number.gauss(100, 5)),
+                                 '', str(sample % 48 + 1), 'UPLC-MSMS Cannabinoids'] +
+                                (['{:.3f}'.format(random_number.random() * 1000) for _ in padding]
+                                 if fill_extra_columns else padding))
+        csv_writer.writerow([''] * len(header_row))
+
+
+def generate_agilent_export(filename, output_rows, analytes_per_sample=20):
+    """writes a synthetic new ICP/MS ('Sample Type' header) export, one analyte in one tune step per row.
+
+    Parameters
+    ----------
+    filename : string
+        the csv file to write.
+    output_rows : int
+        the number of condensed rows the file should produce.
+    analytes_per_sample : int
+        analyte/tune step combinations per sample.
+    """
+
+    header_row = ['Sample Name', 'Sample Type', 'Date and Time Acquired', 'Data File Name', 'Vial Number',
+                  'Batch Name', 'Analyte', 'Mass', 'Concentration', 'Units', 'Tune Step']
+    elements = [('Pb', '208'), ('Cd', '111'), ('As', '75'), ('Hg', '202'), ('Cr', '52'), ('Ni', '60'), ('Cu', '63')]
+    random_number = random.Random(output_rows)
+    with open(filename, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(header_row)
+        for row in range(output_rows):
+            sample = row // analytes_per_sample
+            element, mass = elements[row % len(elements)]
+            csv_writer.writerow(['Sample ' + str(sample), 'Sample',
+                                 '06/22/2021 {:02d}:{:02d}:00'.format(sample // 60 % 24, sample % 60),
+                                 '{:03d}SMPL.d'.format(sample % 1000), str(sample % 89 + 1), 'BENCH_ICP01',
+                                 element, mass, '{:.4f}'.format(random_number.random()), 'ppb', str(row % 3 + 1)])
+
+
+def generate_old_icp_export(filename, output_rows, analytes_per_sample=30):
+    """writes a synthetic old ICP ('Type' header) export - one sample per row, one column per analyte.
+
+    Parameters
+    ----------
+    filename : string
+        the csv file to write.
+    output_rows : int
+        the number of condensed rows the file should produce (rounded up to a whole sample).
+    analytes_per_sample : int
+        analyte columns, from column 6 on.
+    """
+
+    header_row = ['Solution Label', 'Type', 'Date Time', 'Rack:Tube', 'Dilution', 'Weight'] + \
+                 ['El{} {}.{:03d} nm'.format(i, 200 + i, i) for i in range(analytes_per_sample)]
+    random_number = random.Random(output_rows)
+    samples = -(-output_rows // analytes_per_sample)
+    with open(filename, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(header_row)
+        for sample in range(samples):
+            # old ICP doesn't pad single digit days and months
+            csv_writer.writerow(['Sample ' + str(sample), 'Sample',
+                                 '6/2/2021 {}:{:02d}:00 AM'.format(sample // 60 % 12 + 1, sample % 60),
+                                 '1:' + str(sample % 60 + 1), '1', '0.25'] +
+                                ['{:.3f}'.format(random_number.random()) for _ in range(analytes_per_sample)])
+
+
+def run_benchmark_case(pathway, filename, output_directory):
+    """converts one synthetic file, timing each phase. Runs in its own process so peak RSS belongs to this case.
+
+    Parameters
+    ----------
+    pathway : string
+        'waters', 'agilent' or 'old_icp'.
+    filename : string
+        the synthetic export to convert.
+    output_directory : string
+        where the unified files go.
+
+    Returns
+    -------
+    dict
+        input/output row counts, phase timings in seconds, rows/s per phase and peak RSS in MB.
+    """
+
+    old_icp = pathway == 'old_icp'
+    phase_seconds = {}
+    start_time = time.perf_counter()
+    csv_file_in_list_format = read_csv_file_in_list_format(filename)
+    phase_seconds['read'] = time.perf_counter() - start_time
+    if pathway == 'waters':
+        converter = WatersUnify(csv_file_in_list_format, output_directory)
+    else:
+        converter = AgilentUnify(csv_file_in_list_format, output_directory)
+    start_time = time.perf_counter()
+    if pathway == 'waters':
+        converter.find_indexes_of_required_fields()
+    else:
+        converter.find_indexes_of_required_fields(old_icp)
+    phase_seconds['index discovery'] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    if pathway == 'waters':
+        converter.create_condensed_csv_file_with_only_relevant_fields()
+    else:
+        converter.create_condensed_csv_file_with_only_relevant_fields(old_icp)
+    phase_seconds['condensing'] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    converter.generate_excel_files()
+    phase_seconds['xlsx writing'] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    converter.generate_csv_files()
+    phase_seconds['csv writing'] = time.perf_counter() - start_time
+
+    input_rows = len(csv_file_in_list_format) - 1
+    output_rows = len(converter.csv_file_in_list_of_list_format_condensed) - 1
+    rows_per_second = {}
+    for phase, seconds in phase_seconds.items():
+        # reading is measured against the rows read in, everything else against the rows produced
+        rows = input_rows if phase == 'read' else output_rows
+        rows_per_second[phase] = rows / seconds if seconds > 0 else None
+    return {'input_rows': input_rows,
+            'output_rows': output_rows,
+            'input_megabytes': os.path.getsize(filename) / (1024 * 1024),
+            'phase_seconds': phase_seconds,
+            'rows_per_second': rows_per_second,
+            'total_seconds': sum(phase_seconds.values()),
+            'peak_rss_megabytes': peak_rss_in_megabytes()}
+
+
+def run_old_icp_melt_case(filename):
+    """times the old ICP wide-to-long melt three ways on one file: the python loop into a list of lists (the
+    default pathway), the same loop into a UnifiedTable, and the vectorized NumPy melt.
+
+    Parameters
+    ----------
+    filename : string
+        a synthetic old ICP export.
+
+    Returns
+    -------
+    dict
+        samples, analytes, output rows, and seconds and rows/s for each method.
+    """
+
+    csv_file_in_list_format = read_csv_file_in_list_format(filename)
+    method_seconds = {}
+    start_time = time.perf_counter()
+    converter = AgilentUnify(csv_file_in_list_format)
+    converter.find_indexes_of_required_fields(True)
+    converter.create_condensed_csv_file_with_only_relevant_fields(True)
+    method_seconds['python loop (list)'] = time.perf_counter() - start_time
+    output_rows = len(converter.csv_file_in_list_of_list_format_condensed) - 1
+    del converter
+    start_time = time.perf_counter()
+    converter = AgilentUnify(csv_file_in_list_format)
+    converter.find_indexes_of_required_fields(True)
+    UnifiedTable.from_condensed_lines(converter.generate_condensed_lines(csv_file_in_list_format[1:], True,
+                                                                         csv_file_in_list_format[0]))
+    method_seconds['python loop (table)'] = time.perf_counter() - start_time
+    del converter
+    start_time = time.perf_counter()
+    converter = AgilentUnify(csv_file_in_list_format)
+    converter.create_unified_table(True)
+    method_seconds['numpy melt (table)'] = time.perf_counter() - start_time
+    return {'samples': len(csv_file_in_list_format) - 1,
+            'analytes': len(csv_file_in_list_format[0]) - 6,
+            'output_rows': output_rows,
+            'method_seconds': method_seconds,
+            'rows_per_second': {method: output_rows / seconds for method, seconds in method_seconds.items()},
+            'peak_rss_megabytes': peak_rss_in_megabytes()}
+
+
+def run_projected_read_case(filename):
+    """times reading and condensing one wide Waters export both ways: csv.reader into a list of lists (what
+    UnifyTK's open_and_read_in_csv_file and UnifyBatch do) and ProjectedCsvReader, and checks they agree.
+
+    Parameters
+    ----------
+    filename : string
+        a synthetic Waters export.
+
+    Returns
+    -------
+    dict
+        input rows, columns, output rows, and read/condense seconds and rows/s for each method.
+    """
+
+    method_seconds = {}
+    start_time = time.perf_counter()
+    csv_file_in_list_format = read_csv_file_in_list_format(filename)
+    read_seconds = time.perf_counter() - start_time
+    converter = WatersUnify(csv_file_in_list_format)
+    converter.find_indexes_of_required_fields()
+    converter.create_condensed_csv_file_with_only_relevant_fields()
+    method_seconds['csv.reader'] = {'read': read_seconds, 'read + condense': time.perf_counter() - start_time}
+    input_rows = len(csv_file_in_list_format) - 1
+    columns = len(csv_file_in_list_format[0])
+    condensed_lines = converter.csv_file_in_list_of_list_format_condensed
+    del converter, csv_file_in_list_format
+    start_time = time.perf_counter()
+    converter = WatersUnify(filename)
+    converter.read_projected_csv_file(filename)
+    converter.csv_file_in_list_of_list_format = list(converter.csv_file_in_list_of_list_format)
+    read_seconds = time.perf_counter() - start_time
+    converter.find_indexes_of_required_fields()
+    converter.create_condensed_csv_file_with_only_relevant_fields()
+    method_seconds['projected'] = {'read': read_seconds, 'read + condense': time.perf_counter() - start_time}
+    output_rows = len(condensed_lines) - 1
+    return {'input_rows': input_rows,
+            'columns': columns,
+            'output_rows': output_rows,
+            'same_output': converter.csv_file_in_list_of_list_format_condensed == condensed_lines,
+            'method_seconds': method_seconds,
+            'rows_per_second': {method: {phase: input_rows / seconds for phase, seconds in phase_seconds.items()}
+                                for method, phase_seconds in method_seconds.items()},
+            'peak_rss_megabytes': peak_rss_in_megabytes()}
+
+
+def run_database_sink_case(filename, database_filename):
+    """loads one synthetic Waters export into a SQLite database twice - the first load inserts every row, the
+    second is a re-run that upserts over them - and times both.
+
+    Parameters
+    ----------
+    filename : string
+        a synthetic Waters export.
+    database_filename : string
+        the SQLite file to load into.
+
+    Returns
+    -------
+    dict
+        output rows, seconds and rows/s for each load, the rows in the table afterwards and peak RSS in MB.
+    """
+
+    converter = WatersUnify(read_csv_file_in_list_format(filename))
+    converter.find_indexes_of_required_fields()
+    converter.create_condensed_csv_file_with_only_relevant_fields()
+    output_rows = len(converter.csv_file_in_list_of_list_format_condensed) - 1
+    connection_pool = UnifiedConnectionPool.for_sqlite(database_filename)
+    database_sink = UnifiedDatabaseSink(connection_pool)
+    load_seconds = {}
+    for load in ('insert', 'upsert re-run'):
+        start_time = time.perf_counter()
+        converter.load_condensed_lines_into_database(database_sink)
+        load_seconds[load] = time.perf_counter() - start_time
+    with connection_pool.connection() as connection:
+        table_rows = connection.execute("SELECT COUNT(*) FROM " + database_sink.table_name).fetchone()[0]
+    connection_pool.close()
+    return {'output_rows': output_rows,
+            'load_seconds': load_seconds,
+            'rows_per_second': {load: output_rows / seconds for load, seconds in load_seconds.items()},
+            'table_rows': table_rows,
+            'peak_rss_megabytes': peak_rss_in_megabytes()}
+
+
+def parse_row_count(row_count):
+    """turns '1k', '10k', '1m', '10m' or a plain number into an int. """
+
+    row_count = row_count.strip().lower()
+    multipliers = {'k': 1000, 'm': 1000000}
+    if row_count and row_count[-1] in multipliers:
+        return int(float(row_count[:-1]) * multipliers[row_count[-1]])
+    return int(row_count)
+
+
+def current_git_commit():
+    """the commit the benchmark is being run against, so results can be compared across commits. """
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class UnifyBenchmark:
+    """Times the conversion phases on synthetic exports for all three pathways, and records the results as JSON.
+
+    Every case runs in a freshly spawned process, so the peak RSS recorded is that case's own and not left over from
+    a bigger one. Each run is appended to the results file along with the commit it ran on.
+
+    Attributes
+    ----------
+    pathways : list
+        any of 'waters', 'agilent' and 'old_icp'.
+    output_row_counts : list(int)
+        the sizes to test, in condensed output rows.
+    results_filename : string
+        the JSON file the run is appended to.
+    keep_files : bool
+        True to leave the synthetic exports and unified files behind for inspection.
+    old_icp_melt_shapes : list(tuple)
+        (samples, analytes) shapes to compare the old ICP melt methods on.
+    database_row_counts : list(int)
+        the sizes to time the SQLite database sink on, in condensed output rows.
+    projected_read_shapes : list(tuple)
+        (rows, extra columns) shapes of Waters export to compare csv.reader and ProjectedCsvReader on.
+    benchmark_results : list(dict)
+        one result per pathway and size.
+    melt_results : list(dict)
+        one result per old ICP melt shape.
+    database_results : list(dict)
+        one result per database sink size.
+    projected_read_results : list(dict)
+        one result per projected read shape.
+    """
+
+    export_generators = {'waters': generate_waters_export,
+                         'agilent': generate_agilent_export,
+                         'old_icp': generate_old_icp_export}
+
+    def __init__(self, pathways=('waters', 'agilent', 'old_icp'), output_row_counts=(1000, 10000, 100000),
+                 results_filename='unify_benchmark_results.json', keep_files=False, old_icp_melt_shapes=(),
+                 database_row_counts=(), projected_read_shapes=()):
+        """
+        Parameters
+        ----------
+        pathways : tuple
+            any of 'waters', 'agilent' and 'old_icp'.
+        output_row_counts : tuple(int)
+            the sizes to test, in condensed output rows.
+        results_filename : string
+            the JSON file the run is appended to.
+        keep_files : bool
+            True to leave the synthetic exports and unified files behind.
+        old_icp_melt_shapes : tuple(tuple)
+            (samples, analytes) shapes to compare the old ICP melt methods on.
+        database_row_counts : tuple(int)
+            the sizes to time the SQLite database sink on.
+        projected_read_shapes : tuple(tuple)
+            (rows, extra columns) shapes of Waters export to compare the csv readers on.
+        """
+
+        self.pathways = list(pathways)
+        self.output_row_counts = list(output_row_counts)
+        self.results_filename = results_filename
+        self.keep_files = keep_files
+        self.old_icp_melt_shapes = list(old_icp_melt_shapes)
+        self.database_row_counts = list(database_row_counts)
+        self.projected_read_shapes = list(projected_read_shapes)
+        self.benchmark_results = []
+        self.melt_results = []
+        self.database_results = []
+        self.projected_read_results = []
+
+    def unify_benchmark_controller(self):
+        """main function for the class. """
+
+        work_directory = tempfile.mkdtemp(prefix='unify_benchmark_')
+        try:
+            self.run_benchmark_cases(work_directory)
+            self.run_old_icp_melt_cases(work_directory)
+            self.run_database_sink_cases(work_directory)
+            self.run_projected_read_cases(work_directory)
+        finally:
+            if self.keep_files:
+                print("synthetic files left in " + work_directory)
+            else:
+                shutil.rmtree(work_directory, ignore_errors=True)
+        self.save_benchmark_results()
+
+    def run_benchmark_cases(self, work_directory):
+        """generates each synthetic export and converts it in a fresh process.
+
+        Parameters
+        ----------
+        work_directory : string
+            scratch directory for the synthetic exports and the unified files.
+        """
+
+        spawn_context = multiprocessing.get_context('spawn')
+        for output_rows in self.output_row_counts:
+            for pathway in self.pathways:
+                filename = os.path.join(work_directory, '{}_{}.csv'.format(pathway, output_rows))
+                self.export_generators[pathway](filename, output_rows)
+                output_directory = os.path.join(work_directory, 'unified_{}_{}'.format(pathway, output_rows))
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=spawn_context) as executor:
+                    result = executor.submit(run_benchmark_case, pathway, filename, output_directory).result()
+                result['pathway'] = pathway
+                self.benchmark_results.append(result)
+                self.print_benchmark_result(result)
+                if not self.keep_files:
+                    # the big sizes take gigabytes, don't let them pile up
+                    os.remove(filename)
+                    shutil.rmtree(output_directory, ignore_errors=True)
+
+    def run_old_icp_melt_cases(self, work_directory):
+        """compares the old ICP melt methods on wide synthetic files, each in a fresh process.
+
+        Parameters
+        ----------
+        work_directory : string
+            scratch directory for the synthetic exports.
+        """
+
+        spawn_context = multiprocessing.get_context('spawn')
+        for samples, analytes in self.old_icp_melt_shapes:
+            filename = os.path.join(work_directory, 'old_icp_melt_{}x{}.csv'.format(samples, analytes))
+            generate_old_icp_export(filename, samples * analytes, analytes)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=spawn_context) as executor:
+                result = executor.submit(run_old_icp_melt_case, filename).result()
+            self.melt_results.append(result)
+            print("old ICP melt {:,} samples x {} analytes: {}".format(
+                samples, analytes, ', '.join('{} {:.2f}s'.format(method, seconds)
+                                             for method, seconds in result['method_seconds'].items())))
+            if not self.keep_files:
+                os.remove(filename)
+
+    def run_database_sink_cases(self, work_directory):
+        """times loading synthetic Waters exports into a fresh SQLite database, each in a fresh process.
+
+        Parameters
+        ----------
+        work_directory : string
+            scratch directory for the synthetic exports and databases.
+        """
+
+        spawn_context = multiprocessing.get_context('spawn')
+        for output_rows in self.database_row_counts:
+            filename = os.path.join(work_directory, 'database_{}.csv'.format(output_rows))
+            database_filename = os.path.join(work_directory, 'database_{}.sqlite3'.format(output_rows))
+            generate_waters_export(filename, output_rows)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=spawn_context) as executor:
+                result = executor.submit(run_database_sink_case, filename, database_filename).result()
+            self.database_results.append(result)
+            print("database sink {:,} rows: {} ({:,} rows in table)".format(
+                result['output_rows'], ', '.join('{} {:.2f}s ({:,.0f} rows/s)'.format(load, seconds,
+                                                                                      result['rows_per_second'][load])
+                                                 for load, seconds in result['load_seconds'].items()),
+                result['table_rows']))
+            if not self.keep_files:
+                for leftover_filename in (filename, database_filename, database_filename + '-wal',
+                                          database_filename + '-shm'):
+                    if os.path.exists(leftover_filename):
+                        os.remove(leftover_filename)
+
+    def run_projected_read_cases(self, work_directory):
+        """compares csv.reader and ProjectedCsvReader on wide synthetic Waters exports, each in a fresh process.
+
+        Parameters
+        ----------
+        work_directory : string
+            scratch directory for the synthetic exports.
+        """
+
+        spawn_context = multiprocessing.get_context('spawn')
+        for output_rows, extra_columns in self.projected_read_shapes:
+            filename = os.path.join(work_directory, 'projected_{}x{}.csv'.format(output_rows, extra_columns))
+            generate_waters_export(filename, output_rows, extra_columns=extra_columns, fill_extra_columns=True)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=spawn_context) as executor:
+                result = executor.submit(run_projected_read_case, filename).result()
+            self.projected_read_results.append(result)
+            print("projected read {:,} rows x {} columns{}: {}".format(
+                result['input_rows'], result['columns'], '' if result['same_output'] else ' (OUTPUT DIFFERS)',
+                ', '.join('{} read {:.2f}s, read + condense {:.2f}s'.format(method, phase_seconds['read'],
+                                                                          phase_seconds['read + condense'])
+                          for method, phase_seconds in result['method_seconds'].items())))
+            if not self.keep_files:
+                os.remove(filename)
+
+    def print_benchmark_result(self, result):
+        """prints one line per case, with the rows/s of each phase. """
+
+        phases = ', '.join('{} {:,.0f} rows/s'.format(phase, rows_per_second or 0)
+                           for phase, rows_per_second in result['rows_per_second'].items())
+        peak_rss = result['peak_rss_megabytes']
+        print("{:8} {:>11,} rows  {:7.2f}s  peak {} MB  ({})".format(
+            result['pathway'], result['output_rows'], result['total_seconds'],
+            'n/a' if peak_rss is None else '{:,.0f}'.format(peak_rss), phases))
+
+    def save_benchmark_results(self):
+        """appends this run to the results file. """
+
+        runs = []
+        if os.path.exists(self.results_filename):
+            with open(self.results_filename) as results_file:
+                runs = json.load(results_file)
+        runs.append({'commit': current_git_commit(),
+                     'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'cpu_count': os.cpu_count(),
+                     'results': self.benchmark_results,
+                     'old_icp_melt_results': self.melt_results,
+                     'database_results': self.database_results,
+                     'projected_read_results': self.projected_read_results})
+        with open(self.results_filename, 'w') as results_file:
+            json.dump(runs, results_file, indent=2)
+
+
+def main(argv=None):
+    """command line entry point for the benchmark. """
+
+    parser = argparse.ArgumentParser(description="Benchmark UnifyMB conversion on synthetic exports.")
+    parser.add_argument('--pathways', default='waters,agilent,old_icp',
+                        help="comma separated pathways to test (waters, agilent, old_icp)")
+    parser.add_argument('--sizes', default='1k,10k,100k,1m',
+                        help="comma separated output row counts, e.g. 1k,10k,100k,1m,10m")
+    parser.add_argument('-o', '--output', default='unify_benchmark_results.json',
+                        help="JSON file to append the results to")
+    parser.add_argument('--keep-files', action='store_true', help="keep the synthetic exports and unified files")
+    parser.add_argument('--old-icp-melt', default='',
+                        help="comma separated SAMPLESxANALYTES shapes to compare the old ICP melt methods on, "
+                             "e.g. 20000x300,50000x500")
+    parser.add_argument('--database-rows', default='',
+                        help="comma separated row counts to time the SQLite database sink on, e.g. 1m")
+    parser.add_argument('--projected-read', default='',
+                        help="comma separated ROWSxEXTRA_COLUMNS Waters export shapes to compare csv.reader and "
+                             "ProjectedCsvReader on, e.g. 1mx60")
+    args = parser.parse_args(argv)
+    old_icp_melt_shapes = [tuple(parse_row_count(part) for part in shape.lower().split('x'))
+                           for shape in args.old_icp_melt.split(',') if shape.strip()]
+    projected_read_shapes = [tuple(parse_row_count(part) for part in shape.lower().split('x'))
+                             for shape in args.projected_read.split(',') if shape.strip()]
+    UnifyBenchmark([pathway.strip() for pathway in args.pathways.split(',') if pathway.strip()],
+                   [parse_row_count(size) for size in args.sizes.split(',') if size.strip()],
+                   args.output,
+                   args.keep_files,
+                   old_icp_melt_shapes,
+                   [parse_row_count(size) for size in args.database_rows.split(',') if size.strip()],
+                   projected_read_shapes
+                   ).unify_benchmark_controller()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import contextlib
+import sqlite3
+import hashlib
+import json
+import time
+import os
+
+
+class UnifyCache:
+    """Content-addressed cache of conversions, so an export that has already been unified isn't done again.
+
+    The key is a hash of the input file's bytes, the pathway it was sent down, that converter's version and the
+    directory the unified files went to, so renaming or re-copying a file still hits, bumping a converter's
+    converter_version re-does everything it made, and converting into another directory writes the files there.
+    The index is a small SQLite file (safe for several worker processes at once). It records every file a
+    conversion wrote (the xlsx, rolled over workbooks, csv...) and a hit only counts if all of them are still there.
+
+    Old entries are evicted by age (max_age_days since last used), by count (max_entries) and by the size of the
+    unified files they point at (max_bytes), least recently used first. Eviction only drops index rows - the unified
+    files themselves are never touched.
+
+    Attributes
+    ----------
+    cache_index_filename : string
+        the SQLite index file.
+    max_entries : int
+        the most entries kept in the index.
+    max_age_days : float
+        entries not used for this long are dropped.
+    max_bytes : int
+        the most bytes of unified files the index keeps entries for, or None for no limit.
+    """
+
+    hash_chunk_size = 1024 * 1024
+
+    def __init__(self, cache_index_filename, max_entries=100000, max_age_days=90, max_bytes=None):
+        """
+        Parameters
+        ----------
+        cache_index_filename : string
+            the SQLite index file. Created if it doesn't exist.
+        max_entries : int
+            the most entries kept in the index.
+        max_age_days : float
+            entries not used for this long are dropped.
+        max_bytes : int
+            the most bytes of unified files the index keeps entries for, or None for no limit.
+        """
+
+        self.cache_index_filename = cache_index_filename
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(cache_index_filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with contextlib.closing(self.connect()) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS unify_cache ("
+                               "cache_key TEXT PRIMARY KEY, "
+                               "input_filename TEXT, "
+                               "output_filename TEXT NOT NULL, "
+                               "created REAL NOT NULL, "
+                               "last_used REAL NOT NULL, "
+                               "output_filenames TEXT, "
+                               "output_bytes INTEGER NOT NULL DEFAULT 0)")
+            # indexes made before every output was recorded only have output_filename - it's all their entries
+            # are checked against
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(unify_cache)")]
+            if 'output_filenames' not in columns:
+                connection.execute("ALTER TABLE unify_cache ADD COLUMN output_filenames TEXT")
+                connection.execute("ALTER TABLE unify_cache ADD COLUMN output_bytes INTEGER NOT NULL DEFAULT 0")
+            connection.execute("CREATE INDEX IF NOT EXISTS unify_cache_last_used ON unify_cache (last_used)")
+
+    def connect(self):
+        """a connection to the index. The timeout lets other workers finish writing instead of erroring.
+
+        Used as `with contextlib.closing(self.connect()) as connection, connection:` - one transaction, then closed.
+        """
+
+        return sqlite3.connect(self.cache_index_filename, timeout=30)
+
+    def cache_key(self, input_filename, pathway, converter_version, unified_files_directory):
+        """the key for this file's bytes going down this pathway with this converter version into this directory.
+
+        Parameters
+        ----------
+        input_filename : string
+            the export to hash.
+        pathway : string
+            the pathway the file was detected as.
+        converter_version : int or string
+            the version of the converter that will handle it.
+        unified_files_directory : string
+            the directory the unified files are written to.
+        """
+
+        file_hash = hashlib.sha256()
+        with open(input_filename, 'rb') as input_file:
+            for chunk in iter(lambda: input_file.read(self.hash_chunk_size), b''):
+                file_hash.update(chunk)
+        return "{}:{}:{}:{}".format(file_hash.hexdigest(), pathway, converter_version,
+                                    os.path.normcase(os.path.abspath(unified_files_directory)))
+
+    def cached_output_filenames(self, cache_key):
+        """the unified files made from this key before, main file first, or None if there aren't any (or any one of
+        them has been deleted).
+
+        Parameters
+        ----------
+        cache_key : string
+            from cache_key().
+        """
+
+        with contextlib.closing(self.connect()) as connection, connection:
+            row = connection.execute("SELECT output_filename, output_filenames FROM unify_cache WHERE cache_key = ?",
+                                     (cache_key,)).fetchone()
+            if row is None:
+                return None
+            output_filenames = [row[0]] if row[1] is None else json.loads(row[1])
+            if not all(os.path.exists(output_filename) for output_filename in output_filenames):
+                connection.execute("DELETE FROM unify_cache WHERE cache_key = ?", (cache_key,))
+                return None
+            connection.execute("UPDATE unify_cache SET last_used = ? WHERE cache_key = ?", (time.time(), cache_key))
+        return output_filenames
+
+    def store(self, cache_key, input_filename, output_filenames):
+        """records a finished conversion, then evicts anything too old, over max_entries or over max_bytes.
+
+        Parameters
+        ----------
+        cache_key : string
+            from cache_key().
+        input_filename : string
+            the export that was converted (kept for reference only).
+        output_filenames : list
+            every unified file it produced, main file first.
+        """
+
+        output_bytes = 0
+        for output_filename in output_filenames:
+            try:
+                output_bytes += os.path.getsize(output_filename)
+            except OSError:
+                # gone already - the entry won't hit anyway
+                pass
+        now = time.time()
+        with contextlib.closing(self.connect()) as connection, connection:
+            connection.execute("INSERT OR REPLACE INTO unify_cache "
+                               "(cache_key, input_filename, output_filename, created, last_used, output_filenames, "
+                               "output_bytes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (cache_key, input_filename, output_filenames[0], now, now, json.dumps(output_filenames),
+                                output_bytes))
+            self.evict(connection, now)
+
+    def evict(self, connection, now):
+        """drops entries unused for max_age_days, then the least recently used ones beyond max_entries, then the
+        least recently used ones whose unified files take the total over max_bytes.
+
+        Parameters
+        ----------
+        connection : sqlite3.Connection
+            open connection to the index, inside the caller's transaction.
+        now : float
+            the current time.
+        """
+
+        connection.execute("DELETE FROM unify_cache WHERE last_used < ?", (now - self.max_age_days * 86400,))
+        connection.execute("DELETE FROM unify_cache WHERE cache_key IN ("
+                           "SELECT cache_key FROM unify_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                           (self.max_entries,))
+        if self.max_bytes is not None:
+            connection.execute("DELETE FROM unify_cache WHERE cache_key IN ("
+                               "SELECT cache_key FROM ("
+                               "SELECT cache_key, SUM(output_bytes) OVER (ORDER BY last_used DESC, cache_key) AS total "
+                               "FROM unify_cache) WHERE total > ?)", (self.max_bytes,))
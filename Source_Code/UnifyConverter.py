@@ -0,0 +1,394 @@
+if __package__:
+    from .UnifyOutputPipeline import UnifyOutputPipeline, ExcelOutputSink, unified_output_filename
+    from .UnifiedParquetWriter import UnifiedParquetWriter
+    from .UnifiedTable import UnifiedTable
+    from .UnifiedSchema import unified_field_names
+    from .UnifyInstrumentation import UnifyInstrumentation
+else:
+    # run as a script from Source_Code
+    from UnifyOutputPipeline import UnifyOutputPipeline, ExcelOutputSink, unified_output_filename
+    from UnifiedParquetWriter import UnifiedParquetWriter
+    from UnifiedTable import UnifiedTable
+    from UnifiedSchema import unified_field_names
+    from UnifyInstrumentation import UnifyInstrumentation
+import csv
+import os.path
+import errno
+import itertools
+
+
+class UnifyConverter:
+    """The parts of a converter that don't depend on the instrument - condensing through a UnifyFieldMapping, and
+    writing the condensed lines out to excel, csv, parquet or a database.
+
+    WatersUnify and AgilentUnify add what's particular to their exports (TargetLynx XML, projected reads, the old
+    ICP's vectorized melt) on top. A csv export that only needs its columns mapped doesn't need a converter of its
+    own at all - register a UnifyFormat for UnifyConverter with its field_mapping, and unify_controller does the rest.
+
+    Attributes
+    ----------
+    csv_file_in_list_of_list_format : list(list)
+        csv file to be converted in a list of lists, or an iterator over its rows if streaming.
+    csv_file_in_list_of_list_format_condensed : list(list)
+        csv file to be converted in a list of lists. Any extra fields not required are removed.
+    required_fields_index_dictionary : dict
+        the columns field_mapping reads by header name, and their indexes. 0's are placeholders, indexes are found
+        when the mapping is compiled.
+    compiled_field_mapping : CompiledFieldMapping
+        field_mapping compiled against this file's header, once it has been read.
+    main_file_name : string
+        the name of the unified files to be generated - the batch name.
+    unified_files_directory : string
+        the directory the unified excel/csv files are written to.
+    output_filename : string
+        the full path of the last unified file written.
+    output_filenames : list
+        every unified file written by the last generate_* call, main file first.
+    unified_table : UnifiedTable
+        the condensed data in columnar form, if it was condensed with columnar=True.
+    unify_instrumentation : UnifyInstrumentation
+        times each phase of the controller. Disabled unless the caller swaps in an enabled one.
+    field_mapping : UnifyFieldMapping
+        how the export's rows become condensed lines. UnifyFormat.convert sets it, for converters without their own.
+    converter_version : int
+        bump this whenever a change alters the unified output, so cached conversions are redone.
+    instrument_name : string
+        the instrument, for error messages.
+    excel_column_a_width : int
+        the width of the excel file's first column.
+    excel_header_cell_formats : tuple
+        the header format (1, 2 or 3) of each unified field - see generate_excel_files.
+    """
+
+    field_mapping = None
+    converter_version = 1
+    instrument_name = 'instrument'
+    excel_column_a_width = 50
+    excel_header_cell_formats = (1, 2, 2, 2, 2, 3, 3, 3, 3)
+
+    def __init__(self, csv_file_in_list_of_list_format,
+                 unified_files_directory=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles'):
+        """
+        Parameters
+        ----------
+        csv_file_in_list_of_list_format : list(list)
+            csv file to be converted in a list of lists.
+        unified_files_directory : string
+            the directory the unified files are written to. Defaults to UnifiedExcelFiles on the T drive.
+        """
+        self.csv_file_in_list_of_list_format = csv_file_in_list_of_list_format
+        self.csv_file_in_list_of_list_format_condensed = [list(unified_field_names)]
+        self.required_fields_index_dictionary = {}
+        if self.field_mapping is not None:
+            self.required_fields_index_dictionary = dict.fromkeys(self.field_mapping.source_column_names(), 0)
+        self.compiled_field_mapping = None
+        self.main_file_name = ""
+        self.unified_files_directory = unified_files_directory
+        self.output_filename = ""
+        self.output_filenames = []
+        self.unified_table = None
+        self.unify_instrumentation = UnifyInstrumentation(enabled=False)
+
+    def unify_controller(self, streaming=False, columnar=False, output_formats=None):
+        """The main controller function for a converter that's just a field mapping.
+
+        Parameters
+        ----------
+        streaming=False
+            True if csv_file_in_list_of_list_format is an iterator of rows (e.g. a csv.reader on an open file) that
+            should be streamed through to the excel file one row at a time, instead of condensed into a list first.
+        columnar=False
+            True to condense into a UnifiedTable (unified_table) instead of a list of lists.
+        output_formats=None
+            the outputs to write in one pass, e.g. ['xlsx', 'csv'] - see generate_output_files. None for just the
+            excel file.
+        """
+
+        with self.unify_instrumentation.profile():
+            self.condense_and_write(streaming, columnar, output_formats)
+
+    def condense_and_write(self, streaming=False, columnar=False, output_formats=None):
+        """condenses the rows through the field mapping and writes the unified files, streamed, columnar or as a list
+        of lists - see unify_controller for the options. Each step is timed as a phase. """
+
+        if streaming:
+            self.stream_condensed_lines_to_excel_file(output_formats)
+        elif columnar:
+            with self.unify_instrumentation.phase('condensing', self.input_row_count()) as unify_phase:
+                self.create_unified_table()
+                unify_phase.rows_out = len(self.unified_table)
+            with self.unify_instrumentation.phase('writing', len(self.unified_table)):
+                self.generate_unified_files(self.unified_table, output_formats)
+        else:
+            with self.unify_instrumentation.phase('index discovery'):
+                self.find_indexes_of_required_fields()
+            with self.unify_instrumentation.phase('condensing', self.input_row_count()) as unify_phase:
+                self.create_condensed_csv_file_with_only_relevant_fields()
+                unify_phase.rows_out = len(self.csv_file_in_list_of_list_format_condensed) - 1
+            with self.unify_instrumentation.phase('writing', unify_phase.rows_out):
+                self.generate_unified_files(output_formats=output_formats)
+
+    def stream_condensed_lines_to_excel_file(self, output_formats=None):
+        """streams rows reader -> condense -> writer, without holding the file or the condensed lines in memory.
+
+        The header is read first to compile the field mapping, then the first condensed line is pulled so we know
+        main_file_name (and so the output filename) before the writer opens the file. Everything after that is
+        passed straight through.
+
+        Parameters
+        ----------
+        output_formats=None
+            the outputs to write in one pass - see generate_output_files. None for just the excel file.
+        """
+
+        # reading, condensing and writing are interleaved, so they're timed as one phase
+        with self.unify_instrumentation.phase('streaming') as unify_phase:
+            csv_file_rows = iter(self.csv_file_in_list_of_list_format)
+            self.find_indexes_of_required_fields(header_row=next(csv_file_rows, []))
+            condensed_lines = unify_phase.count_rows(self.generate_condensed_lines(csv_file_rows))
+            first_condensed_line = next(condensed_lines, None)
+            if first_condensed_line is None:
+                raise ValueError("No sample lines found in the {} csv file.".format(self.instrument_name))
+            self.generate_unified_files(itertools.chain(self.csv_file_in_list_of_list_format_condensed,
+                                                        [first_condensed_line],
+                                                        condensed_lines),
+                                        output_formats)
+
+    def input_row_count(self):
+        """the number of csv rows after the header, or None if they're being streamed from an iterator. """
+
+        if isinstance(self.csv_file_in_list_of_list_format, list):
+            return max(len(self.csv_file_in_list_of_list_format) - 1, 0)
+        return None
+
+    def find_indexes_of_required_fields(self, header_row=None):
+        """compiles field_mapping against the header - finds the indexes of the fields we need to create our unified
+        excel format, and generates the row transformer that uses them. Rows already projected onto just those
+        columns keep the compiled mapping they were projected with.
+
+        Parameters
+        ----------
+        header_row=None
+            the header row of the csv file. Defaults to the first line of csv_file_in_list_of_list_format.
+        """
+
+        if self.compiled_field_mapping is not None and self.compiled_field_mapping.is_projected:
+            return
+        if header_row is None:
+            header_row = self.csv_file_in_list_of_list_format[0]
+        self.required_fields_index_dictionary = self.compile_field_mapping(self.field_mapping, header_row)
+
+    def compile_field_mapping(self, field_mapping, header_row):
+        """compiles a field mapping against the header into compiled_field_mapping. Returns the indexes of the
+        columns it reads by header name.
+
+        Parameters
+        ----------
+        field_mapping : UnifyFieldMapping
+            the mapping.
+        header_row : list
+            the header row of the csv file.
+        """
+
+        self.compiled_field_mapping = field_mapping.compile(header_row)
+        return {column_name: self.compiled_field_mapping.row_index(column_name)
+                for column_name in field_mapping.source_column_names()}
+
+    def create_condensed_csv_file_with_only_relevant_fields(self):
+        """takes only the required fields from the full csv file, and creates a condensed list of lists. """
+
+        self.csv_file_in_list_of_list_format_condensed.extend(
+            self.generate_condensed_lines(self.csv_file_in_list_of_list_format[1:]))
+        if len(self.csv_file_in_list_of_list_format_condensed) == 1:
+            raise ValueError("No sample lines found in the {} csv file.".format(self.instrument_name))
+
+    def create_unified_table(self):
+        """condenses the csv file into a columnar UnifiedTable rather than a list of lists. Much smaller for big
+        batches, because the repeated fields are only stored once. """
+
+        csv_file_rows = iter(self.csv_file_in_list_of_list_format)
+        self.find_indexes_of_required_fields(header_row=next(csv_file_rows, []))
+        self.unified_table = UnifiedTable.from_condensed_lines(self.generate_condensed_lines(csv_file_rows))
+        if len(self.unified_table) == 0:
+            raise ValueError("No sample lines found in the {} csv file.".format(self.instrument_name))
+
+    def generate_condensed_lines(self, csv_file_rows):
+        """yields one condensed line per row converted, through the compiled field mapping. Sets main_file_name
+        from the first row converted.
+
+        Parameters
+        ----------
+        csv_file_rows : iterable(list)
+            the csv rows after the header.
+        """
+
+        if self.compiled_field_mapping is None:
+            self.find_indexes_of_required_fields()
+        return self.compiled_field_mapping.transform_rows(csv_file_rows, self.set_main_file_name)
+
+    def set_main_file_name(self, main_file_name):
+        """sets the name the unified files are written under. Called by the compiled field mapping. """
+
+        self.main_file_name = main_file_name
+
+    def generate_excel_files(self, condensed_lines=None, roll_over_to='sheet'):
+        """generates excel file versions of the unified excel format, using xlsxwriter.
+
+        allows us to add formatting to the file produced, which we can't do with the .csv version. the formats
+        denote shared fields - all rows in the file will have the same values in header_cell_format_1 cells,
+        all rows in a sample will have the same values in header_cell_format_2 cells, and the cells with
+        header_format_3 change each line.
+
+        Parameters
+        ----------
+        condensed_lines=None
+            the condensed lines (header first) to write, or a UnifiedTable. Defaults to
+            csv_file_in_list_of_list_format_condensed.
+        roll_over_to='sheet'
+            where rows go past Excel's 1,048,576 row limit - 'sheet' for a new sheet, 'file' for a new workbook.
+        """
+
+        if condensed_lines is None:
+            condensed_lines = self.csv_file_in_list_of_list_format_condensed
+        # through the pipeline, which types the lines for the excel file
+        unify_output_pipeline = UnifyOutputPipeline(self.unified_files_directory,
+                                                    [self.excel_output_sink(roll_over_to)])
+        self.output_filenames = unify_output_pipeline.write_condensed_lines(self.main_file_name, condensed_lines)
+        self.output_filename = self.output_filenames[0]
+
+    @classmethod
+    def excel_output_sink(cls, roll_over_to='sheet'):
+        """the xlsx output, with this converter's column width and header formats. A class method, so the excel
+        file of a format's unified csv can be written again without a converter (see UnifyTail).
+
+        Parameters
+        ----------
+        roll_over_to='sheet'
+            where rows go past Excel's 1,048,576 row limit - 'sheet' for a new sheet, 'file' for a new workbook.
+        """
+
+        return ExcelOutputSink(column_a_width=cls.excel_column_a_width,
+                               header_cell_formats=cls.excel_header_cell_formats,
+                               roll_over_to=roll_over_to)
+
+    def generate_unified_files(self, condensed_lines=None, output_formats=None):
+        """writes the excel file, or every one of output_formats if given.
+
+        Parameters
+        ----------
+        condensed_lines=None
+            the condensed lines (header first) to write, or a UnifiedTable. Defaults to
+            csv_file_in_list_of_list_format_condensed.
+        output_formats=None
+            passed to generate_output_files. None for just the excel file.
+        """
+
+        if output_formats is None:
+            self.generate_excel_files(condensed_lines)
+        else:
+            self.generate_output_files(output_formats, condensed_lines)
+
+    def generate_output_files(self, output_formats, condensed_lines=None):
+        """writes several outputs at once, going through the condensed lines only once - see UnifyOutputPipeline.
+
+        Parameters
+        ----------
+        output_formats : list
+            'xlsx', 'csv', 'parquet', 'arrow', or sink objects such as DatabaseOutputSink.
+        condensed_lines=None
+            the condensed lines (header first) to write, or a UnifiedTable. Defaults to
+            csv_file_in_list_of_list_format_condensed.
+        """
+
+        if condensed_lines is None:
+            condensed_lines = self.csv_file_in_list_of_list_format_condensed
+        output_sinks = [self.excel_output_sink() if output_format == 'xlsx' else output_format
+                        for output_format in output_formats]
+        unify_output_pipeline = UnifyOutputPipeline(self.unified_files_directory, output_sinks)
+        self.output_filenames = unify_output_pipeline.write_condensed_lines(self.main_file_name, condensed_lines)
+        if self.output_filenames:
+            self.output_filename = self.output_filenames[0]
+
+    def generate_csv_files(self, condensed_lines=None):
+        """generates csv file versions of the unified excel format, using python's built in csv library.
+
+        files generated have no formatting. Can use generate_excel_files, which comes with visual formatting.
+
+        Parameters
+        ----------
+        condensed_lines=None
+            the condensed lines (header first) to write. Defaults to csv_file_in_list_of_list_format_condensed.
+        """
+
+        if condensed_lines is None:
+            condensed_lines = self.csv_file_in_list_of_list_format_condensed
+        try:
+            filename = unified_output_filename(self.unified_files_directory, self.main_file_name, '.csv')
+            self.output_filename = filename
+            self.output_filenames = [filename]
+            with self.safe_open_w(filename) as f:
+                csv_writer = csv.writer(f)
+                for item in condensed_lines:
+                    csv_writer.writerow(item)
+        except OSError:
+            pass
+
+    def generate_parquet_files(self, condensed_lines=None, file_format='parquet'):
+        """generates a parquet (or arrow) version of the unified excel format, with typed date and concentration
+        columns. Needs pyarrow.
+
+        Parameters
+        ----------
+        condensed_lines=None
+            the condensed lines (header first) to write. Defaults to unified_table if the data was condensed with
+            columnar=True, otherwise csv_file_in_list_of_list_format_condensed.
+        file_format='parquet'
+            'parquet', or 'arrow' for an Arrow IPC file.
+        """
+
+        filename = unified_output_filename(self.unified_files_directory, self.main_file_name, '.' + file_format)
+        self.output_filename = filename
+        self.output_filenames = [filename]
+        self.mkdir_p(self.unified_files_directory)
+        parquet_writer = UnifiedParquetWriter(filename, file_format=file_format)
+        if condensed_lines is None and self.unified_table is not None:
+            parquet_writer.write_unified_table(self.unified_table)
+            return
+        if condensed_lines is None:
+            condensed_lines = self.csv_file_in_list_of_list_format_condensed
+        parquet_writer.write_condensed_lines(condensed_lines)
+
+    def load_condensed_lines_into_database(self, database_sink, condensed_lines=None):
+        """upserts the condensed lines into a database table, instead of writing a file to read back in later.
+
+        Parameters
+        ----------
+        database_sink : UnifiedDatabaseSink
+            the table (and connection pool) to load into.
+        condensed_lines=None
+            the condensed lines (header first) to load. Defaults to unified_table if the data was condensed with
+            columnar=True, otherwise csv_file_in_list_of_list_format_condensed.
+        """
+
+        if condensed_lines is None and self.unified_table is not None:
+            condensed_lines = self.unified_table.condensed_lines()
+        if condensed_lines is None:
+            condensed_lines = self.csv_file_in_list_of_list_format_condensed
+        database_sink.write_condensed_lines(condensed_lines)
+
+    def mkdir_p(self, path):
+        """tries to make the directory."""
+
+        try:
+            os.makedirs(path)
+        except OSError as exc:  # Python >2.5
+            if exc.errno == errno.EEXIST and os.path.isdir(path):
+                pass
+            else:
+                raise
+
+    def safe_open_w(self, path):
+        """ Open "path" for writing, creating any parent directories as needed. """
+
+        self.mkdir_p(os.path.dirname(path))
+        return open(path, 'w', newline='')
@@ -0,0 +1,385 @@
+import operator
+
+
+class SourceColumn:
+    """a unified field copied straight from one column of the export.
+
+    Attributes
+    ----------
+    column : string or int
+        the column's header name, or for a column with no fixed name, its position.
+    """
+
+    def __init__(self, column):
+        self.column = column
+
+
+class ConstantField:
+    """a unified field that's the same on every line, e.g. the data source of an instrument with only one.
+
+    Attributes
+    ----------
+    value : string
+        the field's value.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+class DerivedField:
+    """unified fields worked out from one or more columns, e.g. the 'Analyte Mass [tune step]' analyte name.
+
+    Attributes
+    ----------
+    function : callable
+        called with the columns' values, in order. Returns the field's value, or a tuple of field_count values.
+        It's called on every row, so functools.lru_cache is worth it when the values repeat a lot.
+    columns : tuple
+        the columns passed to function - header names, or positions.
+    field_count : int
+        how many unified fields function returns, e.g. 2 for a date and time split out of one column.
+    """
+
+    def __init__(self, function, *columns, field_count=1):
+        self.function = function
+        self.columns = columns
+        self.field_count = field_count
+
+
+class WideColumnName:
+    """for wide exports (one row per sample, one column per analyte), the header name of the analyte column. """
+
+
+class WideColumnValue:
+    """for wide exports, the value in the analyte column. """
+
+
+class UnifyFieldMapping:
+    """A declarative description of how an export's rows become unified lines - which columns go where, which fields
+    are worked out from which columns, and for wide exports, how each row is melted into one line per analyte.
+
+    A mapping is compiled once per file, against the file's header (see compile), into a CompiledFieldMapping whose
+    transform_rows does the whole row -> condensed line step with the column indexes resolved up front - the source
+    columns are picked out of each row by one operator.itemgetter, and the derived fields are plain closures over
+    theirs. So there are no per-field dictionary lookups in the row loop, and supporting a new csv instrument can be
+    just a mapping (see UnifyConverter).
+
+    Attributes
+    ----------
+    fields : list
+        SourceColumn, ConstantField, DerivedField, WideColumnName and WideColumnValue entries, in unified field
+        order. Together they make up the nine unified fields.
+    batch_name : DerivedField
+        the unified file's name, worked out from the first row converted.
+    skip_blank_column : string or int
+        rows with nothing in this column are skipped, e.g. the blank lines at the end of Waters exports. None to
+        convert every row.
+    wide_columns_from : int
+        for wide exports, the position of the first analyte column - every column from here on is an analyte. None
+        for exports with one line per row.
+    """
+
+    def __init__(self, fields, batch_name, skip_blank_column=None, wide_columns_from=None):
+        """
+        Parameters
+        ----------
+        fields : list
+            the field entries, in unified field order.
+        batch_name : DerivedField
+            the unified file's name, from the first row converted.
+        skip_blank_column : string or int
+            rows with nothing in this column are skipped. None to convert every row.
+        wide_columns_from : int
+            the position of the first analyte column, for wide exports. None otherwise.
+        """
+
+        self.fields = list(fields)
+        self.batch_name = batch_name
+        self.skip_blank_column = skip_blank_column
+        self.wide_columns_from = wide_columns_from
+
+    def source_columns(self):
+        """every column the mapping reads, in the order it first reads them. Wide analyte columns aren't included. """
+
+        source_columns = []
+        for field in self.fields + [self.batch_name]:
+            if isinstance(field, SourceColumn):
+                field_columns = [field.column]
+            elif isinstance(field, DerivedField):
+                field_columns = field.columns
+            else:
+                continue
+            source_columns.extend(column for column in field_columns if column not in source_columns)
+        if self.skip_blank_column is not None and self.skip_blank_column not in source_columns:
+            source_columns.append(self.skip_blank_column)
+        return source_columns
+
+    def source_column_names(self):
+        """the columns the mapping reads by header name - the ones an export has to have. """
+
+        return [column for column in self.source_columns() if isinstance(column, str)]
+
+    def minimum_columns(self):
+        """the fewest columns an export can have for the columns read by position. """
+
+        positions = [column for column in self.source_columns() if isinstance(column, int)]
+        if self.wide_columns_from is not None:
+            positions.append(self.wide_columns_from)
+        return max(positions) + 1 if positions else 0
+
+    def compile(self, header_row):
+        """resolves the columns against the file's header, and builds the row transformer.
+
+        Parameters
+        ----------
+        header_row : list
+            the first line of the csv file.
+
+        Raises
+        ------
+        ValueError
+            a column the mapping reads isn't in the header. (UnifyFormatSchema catches this, and more, before a
+            conversion starts.)
+        """
+
+        header_indexes = {}
+        for column_index, column_name in enumerate(header_row):
+            # the first of any repeated names, like the dictionary lookups this replaces
+            header_indexes.setdefault(column_name, column_index)
+        column_indexes = {}
+        missing_columns = []
+        for column in self.source_columns():
+            if isinstance(column, int):
+                column_indexes[column] = column
+            elif column in header_indexes:
+                column_indexes[column] = header_indexes[column]
+            else:
+                missing_columns.append(column)
+        if missing_columns:
+            raise ValueError("the header is missing {}".format(', '.join(map(repr, missing_columns))))
+        wide_column_names = []
+        if self.wide_columns_from is not None:
+            wide_column_names = list(header_row[self.wide_columns_from:])
+        return CompiledFieldMapping(self, column_indexes, wide_column_names)
+
+
+def tuple_getter(indexes):
+    """like operator.itemgetter(*indexes), but always returns a tuple - itemgetter returns the value itself for one
+    index. """
+
+    indexes = list(indexes)
+    if not indexes:
+        return lambda row: ()
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda row: (row[index],)
+    return operator.itemgetter(*indexes)
+
+
+class CompiledFieldMapping:
+    """A UnifyFieldMapping resolved against one file's header, with its row transformer.
+
+    Each line is put together from the row's parts - the source columns' values, picked out by one itemgetter, then
+    each derived field's values, the constants, and for wide exports the analyte column's name and value - and a
+    second itemgetter puts those parts in unified field order.
+
+    Attributes
+    ----------
+    field_mapping : UnifyFieldMapping
+        the mapping compiled.
+    column_indexes : dict
+        source column -> its index in the rows transform_rows is given.
+    source_indexes : list(int)
+        the indexes in the full export row of every column read, for reading only those (see ProjectedCsvReader).
+    wide_column_names : list(string)
+        for wide exports, the analyte column names.
+    is_projected : bool
+        True if the rows are projected onto source_indexes rather than full export rows.
+    """
+
+    def __init__(self, field_mapping, column_indexes, wide_column_names, source_indexes=None):
+        """
+        Parameters
+        ----------
+        field_mapping : UnifyFieldMapping
+            the mapping.
+        column_indexes : dict
+            source column -> its index in the rows transformed.
+        wide_column_names : list(string)
+            the analyte column names, for wide exports.
+        source_indexes : list(int)
+            for projected rows, the full row index of each projected column. None for full rows.
+        """
+
+        self.field_mapping = field_mapping
+        self.column_indexes = column_indexes
+        self.wide_column_names = wide_column_names
+        self.is_projected = source_indexes is not None
+        self.source_indexes = source_indexes if self.is_projected else list(dict.fromkeys(column_indexes.values()))
+        self.row_parts, self.arrange_parts = self.line_builders()
+        batch_name = field_mapping.batch_name
+        batch_name_columns = tuple_getter(self.row_index(column) for column in batch_name.columns)
+        self.row_batch_name = lambda row: batch_name.function(*batch_name_columns(row))
+
+    def projected(self):
+        """the same mapping, for rows projected onto source_indexes - only the columns read, in that order. Wide
+        exports need every analyte column, so they can't be projected. """
+
+        projected_indexes = {source_index: projected_index
+                             for projected_index, source_index in enumerate(self.source_indexes)}
+        return CompiledFieldMapping(self.field_mapping,
+                                    {column: projected_indexes[column_index]
+                                     for column, column_index in self.column_indexes.items()},
+                                    self.wide_column_names, self.source_indexes)
+
+    def row_index(self, column):
+        """the index of a source column in the rows transformed. """
+
+        return self.column_indexes[column]
+
+    def line_builders(self):
+        """the two halves of the row transformer.
+
+        Returns
+        -------
+        tuple
+            row_parts(row), which gives a row's parts as a tuple - source column values, then derived field values,
+            then constants - and arrange_parts(parts), which puts them (with the analyte column's name and value
+            added on the end, for wide exports) in unified field order.
+        """
+
+        source_fields = []
+        derived_fields = []
+        constants = []
+        # where each unified field's value is, as (kind, number) - sorted out into part positions once all are known
+        field_sources = []
+        for field in self.field_mapping.fields:
+            if isinstance(field, SourceColumn):
+                field_sources.append(('source', len(source_fields)))
+                source_fields.append(self.row_index(field.column))
+            elif isinstance(field, DerivedField):
+                derived_start = sum(kind == 'derived' for kind, _ in field_sources)
+                field_sources.extend(('derived', derived_start + value_number)
+                                     for value_number in range(field.field_count))
+                derived_fields.append(self.derived_values(field))
+            elif isinstance(field, ConstantField):
+                field_sources.append(('constant', len(constants)))
+                constants.append(field.value)
+            elif isinstance(field, WideColumnName):
+                field_sources.append(('wide', 0))
+            elif isinstance(field, WideColumnValue):
+                field_sources.append(('wide', 1))
+        derived_count = len(field_sources) - len(source_fields) - len(constants) - sum(
+            kind == 'wide' for kind, _ in field_sources)
+        part_starts = {'source': 0,
+                       'derived': len(source_fields),
+                       'constant': len(source_fields) + derived_count,
+                       'wide': len(source_fields) + derived_count + len(constants)}
+        arrange_parts = tuple_getter(part_starts[kind] + number for kind, number in field_sources)
+        source_values = tuple_getter(source_fields)
+        constants = tuple(constants)
+        # the usual shapes spelled out, rather than looping over the derived fields for every row
+        if not derived_fields:
+            def row_parts(row):
+                return source_values(row) + constants
+        elif len(derived_fields) == 1:
+            derived_values, = derived_fields
+
+            def row_parts(row):
+                return source_values(row) + derived_values(row) + constants
+        elif len(derived_fields) == 2:
+            first_derived_values, second_derived_values = derived_fields
+
+            def row_parts(row):
+                return source_values(row) + first_derived_values(row) + second_derived_values(row) + constants
+        else:
+            def row_parts(row):
+                parts = source_values(row)
+                for derived_values in derived_fields:
+                    parts += derived_values(row)
+                return parts + constants
+        return row_parts, arrange_parts
+
+    def derived_values(self, field):
+        """a closure giving a derived field's values for a row, as a tuple.
+
+        Parameters
+        ----------
+        field : DerivedField
+            the derived field.
+        """
+
+        function = field.function
+        if len(field.columns) == 1:
+            # the usual case - one column, no argument tuple to build and unpack
+            column_index = self.row_index(field.columns[0])
+            if field.field_count == 1:
+                return lambda row: (function(row[column_index]),)
+            return lambda row: tuple(function(row[column_index]))
+        argument_values = tuple_getter(self.row_index(column) for column in field.columns)
+        if field.field_count == 1:
+            return lambda row: (function(*argument_values(row)),)
+        return lambda row: tuple(function(*argument_values(row)))
+
+    def transform_rows(self, csv_file_rows, set_batch_name):
+        """yields the condensed lines for rows after the header. Calls set_batch_name with the batch name, from the
+        first row converted, before yielding the first line.
+
+        Parameters
+        ----------
+        csv_file_rows : iterable(list)
+            the rows after the header.
+        set_batch_name : callable
+            called once with the batch name.
+
+        Raises
+        ------
+        ValueError
+            a row of a wide export is shorter than its header.
+        """
+
+        if self.field_mapping.wide_columns_from is None:
+            return self.transform_long_rows(csv_file_rows, set_batch_name)
+        return self.transform_wide_rows(csv_file_rows, set_batch_name)
+
+    def transform_long_rows(self, csv_file_rows, set_batch_name):
+        """transform_rows for exports with one line per row. """
+
+        row_parts = self.row_parts
+        arrange_parts = self.arrange_parts
+        skip_blank_column = self.field_mapping.skip_blank_column
+        skip_blank_index = None if skip_blank_column is None else self.row_index(skip_blank_column)
+        batch_name_set = False
+        for row in csv_file_rows:
+            if skip_blank_index is not None and not row[skip_blank_index]:
+                continue
+            parts = row_parts(row)
+            if not batch_name_set:
+                set_batch_name(self.row_batch_name(row))
+                batch_name_set = True
+            yield list(arrange_parts(parts))
+
+    def transform_wide_rows(self, csv_file_rows, set_batch_name):
+        """transform_rows for wide exports - the sample's parts are worked out once per row, and shared by its
+        analyte lines. """
+
+        row_parts = self.row_parts
+        arrange_parts = self.arrange_parts
+        wide_column_names = self.wide_column_names
+        wide_columns_from = self.field_mapping.wide_columns_from
+        row_width = wide_columns_from + len(wide_column_names)
+        skip_blank_column = self.field_mapping.skip_blank_column
+        skip_blank_index = None if skip_blank_column is None else self.row_index(skip_blank_column)
+        batch_name_set = False
+        for row_number, row in enumerate(csv_file_rows, 2):
+            if skip_blank_index is not None and not row[skip_blank_index]:
+                continue
+            if len(row) < row_width:
+                raise ValueError("row {} has {} fields, the header has {}".format(row_number, len(row), row_width))
+            sample_parts = row_parts(row)
+            if not batch_name_set:
+                set_batch_name(self.row_batch_name(row))
+                batch_name_set = True
+            for wide_column_name, wide_column_value in zip(wide_column_names, row[wide_columns_from:]):
+                yield list(arrange_parts(sample_parts + (wide_column_name, wide_column_value)))
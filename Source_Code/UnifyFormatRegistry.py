@@ -0,0 +1,390 @@
+if __package__:
+    from .AgilentUnify import AgilentUnify
+    from .WatersUnify import WatersUnify
+    from .UnifyFormatSchema import UnifyFormatSchema, has_date_and_time, has_date_time_and_meridiem
+else:
+    # run as a script from Source_Code
+    from AgilentUnify import AgilentUnify
+    from WatersUnify import WatersUnify
+    from UnifyFormatSchema import UnifyFormatSchema, has_date_and_time, has_date_time_and_meridiem
+import csv
+import io
+
+
+class UnifyFormat:
+    """One instrument export format - how to recognise it from its header, and which converter handles it.
+
+    Attributes
+    ----------
+    name : string
+        the pathway name shown in logs and summaries, and used in cache keys.
+    header_keyword : string
+        the value the header row has at keyword_index for this format.
+    converter_class : class
+        the converter, e.g. WatersUnify. Constructed with (csv rows, unified_files_directory).
+    controller_name : string
+        the converter's controller method, e.g. 'waters_unify_controller'.
+    controller_options : dict
+        extra keyword arguments for the controller, e.g. {'old_icp': True}.
+    keyword_index : int
+        which header field holds the keyword.
+    head_marker : string
+        for formats that aren't csv (e.g. XML), text the head of the file contains instead of a header keyword.
+    file_extension : string
+        the extension the instrument's exports have, e.g. '.csv'. Watched folders look for these.
+    reads_csv : bool
+        False if the converter takes the filename rather than csv rows.
+    reads_projected_csv : bool
+        True if the converter can read the csv itself, given the filename and projected=True, taking only the
+        columns it uses (see ProjectedCsvReader).
+    schema : UnifyFormatSchema
+        the columns and row shape the converter needs, checked before it runs. None to skip the checks.
+    field_mapping : UnifyFieldMapping
+        how the format's rows become condensed lines. Converters without a mapping of their own (UnifyConverter
+        itself) are given this one, so a csv instrument can be supported with just a mapping - see
+        field_mapping_schema for its schema.
+    """
+
+    def __init__(self, name, header_keyword, converter_class, controller_name, controller_options=None,
+                 keyword_index=1, head_marker=None, reads_csv=True, reads_projected_csv=False, schema=None,
+                 field_mapping=None, file_extension='.csv'):
+        """
+        Parameters
+        ----------
+        name : string
+            the pathway name.
+        header_keyword : string
+            the value the header row has at keyword_index for this format.
+        converter_class : class
+            the converter class.
+        controller_name : string
+            the converter's controller method.
+        controller_options : dict
+            extra keyword arguments for the controller.
+        keyword_index : int
+            which header field holds the keyword.
+        head_marker : string
+            text the head of the file contains, for formats recognised that way instead.
+        reads_csv : bool
+            False if the converter takes the filename rather than csv rows.
+        reads_projected_csv : bool
+            True if the converter can read just the columns it uses from the filename, with projected=True.
+        schema : UnifyFormatSchema
+            the columns and row shape the converter needs. None to skip the checks.
+        field_mapping : UnifyFieldMapping
+            how the format's rows become condensed lines, for converters without a mapping of their own.
+        file_extension : string
+            the extension the instrument's exports have.
+        """
+
+        self.name = name
+        self.header_keyword = header_keyword
+        self.converter_class = converter_class
+        self.controller_name = controller_name
+        self.controller_options = dict(controller_options or {})
+        self.keyword_index = keyword_index
+        self.head_marker = head_marker
+        self.reads_csv = reads_csv
+        self.reads_projected_csv = reads_projected_csv
+        self.schema = schema
+        self.field_mapping = field_mapping
+        self.file_extension = file_extension
+
+    def matches(self, header_row, head=''):
+        """True if the header row (or for head_marker formats, the head of the file) is this format's. """
+
+        if self.head_marker is not None:
+            return self.head_marker in head
+        return len(header_row) > self.keyword_index and header_row[self.keyword_index] == self.header_keyword
+
+    def validate(self, csv_file_rows, first_row_number=2):
+        """checks the head of the file against the schema, before anything is condensed. Returns the rows to convert
+        in place of csv_file_rows (see UnifyFormatSchema.validate_csv_file_rows).
+
+        Parameters
+        ----------
+        csv_file_rows : list(list) or iterator(list)
+            the csv file, header first - or its filename.
+        first_row_number=2
+            the file's row number for the first row after the header, for the error message - later for rows
+            appended to a file already converted.
+
+        Raises
+        ------
+        UnifySchemaError
+            the file doesn't match the schema.
+        """
+
+        if self.schema is None or not self.reads_csv:
+            return csv_file_rows
+        if isinstance(csv_file_rows, str):
+            self.schema.validate_csv_file(self.name, csv_file_rows)
+            return csv_file_rows
+        return self.schema.validate_csv_file_rows(self.name, csv_file_rows, first_row_number)
+
+    def convert(self, csv_file_rows, unified_files_directory, unify_instrumentation=None, first_row_number=2,
+                **controller_options):
+        """validates the head of the rows, then runs the converter on them and returns the converter, so the caller
+        can see what it wrote.
+
+        Parameters
+        ----------
+        csv_file_rows : list(list) or iterator(list)
+            the csv file, header first - or the filename, if reads_csv is False.
+        unified_files_directory : string
+            the directory the unified files are written to.
+        unify_instrumentation : UnifyInstrumentation
+            times the converter's phases, if given.
+        first_row_number=2
+            the file's row number for the first row after the header, for schema errors - see validate.
+        controller_options
+            passed on to the controller, e.g. streaming=True.
+
+        Raises
+        ------
+        UnifySchemaError
+            the file doesn't match the format's schema, so nothing was converted.
+        """
+
+        csv_file_rows = self.validate(csv_file_rows, first_row_number)
+        converter = self.converter_class(csv_file_rows, unified_files_directory)
+        if self.field_mapping is not None and converter.field_mapping is None:
+            converter.field_mapping = self.field_mapping
+        if unify_instrumentation is not None:
+            converter.unify_instrumentation = unify_instrumentation
+        getattr(converter, self.controller_name)(**dict(self.controller_options, **controller_options))
+        return converter
+
+
+class UnifyFormatRegistry:
+    """The instrument formats UnifyMB knows about, and detection that only reads the head of each file.
+
+    Detection reads the first head_size characters of a file, which is plenty for the header fields the formats are
+    recognised by. So a scan of thousands of files can sort them into formats, and reject the ones nothing supports,
+    without parsing any of them in full. Supporting a new instrument (GC-MS, CE, UV-Vis...) means writing its
+    converter and registering a UnifyFormat for it.
+
+    Attributes
+    ----------
+    unify_formats : list(UnifyFormat)
+        registered formats, checked in order.
+    head_size : int
+        characters read from the start of a file to detect its format.
+    """
+
+    def __init__(self, head_size=4096):
+        """
+        Parameters
+        ----------
+        head_size : int
+            characters read from the start of a file to detect its format.
+        """
+
+        self.unify_formats = []
+        self.head_size = head_size
+
+    def register_format(self, unify_format):
+        """adds a format. Later registrations are checked after earlier ones.
+
+        Parameters
+        ----------
+        unify_format : UnifyFormat
+            the format to add.
+
+        Raises
+        ------
+        ValueError
+            a format with the same name is already registered.
+        """
+
+        if self.format_named(unify_format.name) is not None:
+            raise ValueError("a format called {!r} is already registered".format(unify_format.name))
+        self.unify_formats.append(unify_format)
+        return unify_format
+
+    def format_named(self, name):
+        """the registered format with this name, or None. """
+
+        for unify_format in self.unify_formats:
+            if unify_format.name == name:
+                return unify_format
+        return None
+
+    def file_patterns(self):
+        """globs for the file names the registered formats' exports have, e.g. ['*.csv', '*.xml']. """
+
+        file_patterns = []
+        for unify_format in self.unify_formats:
+            if '*' + unify_format.file_extension not in file_patterns:
+                file_patterns.append('*' + unify_format.file_extension)
+        return file_patterns
+
+    def detect_format_from_header_row(self, header_row, head=''):
+        """the format a header row belongs to.
+
+        Parameters
+        ----------
+        header_row : list
+            the first line of the csv file.
+        head : string
+            the start of the file, for formats recognised by a head_marker.
+
+        Raises
+        ------
+        ValueError
+            no valid unify pathway was detected for the csv file.
+        """
+
+        for unify_format in self.unify_formats:
+            if unify_format.matches(header_row, head):
+                return unify_format
+        raise ValueError("No valid unify pathway detected for this csv file.")
+
+    def read_head(self, filename):
+        """the first head_size characters of the file.
+
+        Parameters
+        ----------
+        filename : string
+            the csv (or XML) file.
+
+        Raises
+        ------
+        UnicodeDecodeError
+            file is not being recognized as a csv file.
+        """
+
+        with open(filename, newline='') as csv_file:
+            return csv_file.read(self.head_size)
+
+    def read_head_header_row(self, filename):
+        """the header row, parsed from only the first head_size characters of the file.
+
+        Parameters
+        ----------
+        filename : string
+            the csv file.
+
+        Raises
+        ------
+        UnicodeDecodeError
+            file is not being recognized as a csv file.
+        """
+
+        return next(csv.reader(io.StringIO(self.read_head(filename))), [])
+
+    def detect_format(self, filename):
+        """the format of a file, from the head of it only.
+
+        Parameters
+        ----------
+        filename : string
+            the csv file.
+
+        Raises
+        ------
+        ValueError
+            no valid unify pathway was detected for the csv file, or it isn't a text file.
+        """
+
+        try:
+            head = self.read_head(filename)
+        except UnicodeDecodeError:
+            raise ValueError("This file is not being recognized as a csv file.")
+        return self.detect_format_from_header_row(next(csv.reader(io.StringIO(head)), []), head)
+
+    def detect_and_validate_format(self, filename):
+        """the format of a file, from the head of it only, once the head has been checked against its schema.
+
+        Parameters
+        ----------
+        filename : string
+            the csv file.
+
+        Raises
+        ------
+        ValueError
+            no valid unify pathway was detected for the csv file, it isn't a text file, or (UnifySchemaError) it
+            doesn't match its format's schema.
+        """
+
+        unify_format = self.detect_format(filename)
+        try:
+            unify_format.validate(filename)
+        except UnicodeDecodeError:
+            raise ValueError("This file is not being recognized as a csv file.")
+        return unify_format
+
+    def classify_files(self, filenames):
+        """sorts files by format, reading only the head of each. Files that don't match their format's schema are
+        rejected along with the unsupported ones, so a batch reports every bad file before converting any.
+
+        Parameters
+        ----------
+        filenames : iterable(string)
+            the files to classify.
+
+        Returns
+        -------
+        tuple
+            (list of (filename, UnifyFormat) for supported files, list of (filename, reason) for rejected ones).
+        """
+
+        routed_files = []
+        rejected_files = []
+        for filename in filenames:
+            try:
+                routed_files.append((filename, self.detect_and_validate_format(filename)))
+            except (OSError, ValueError) as exc:
+                rejected_files.append((filename, str(exc)))
+        return routed_files, rejected_files
+
+
+def field_mapping_schema(field_mapping, positional_column_description='', value_checks=None, full_width_rows=False):
+    """a UnifyFormatSchema requiring what a field mapping reads - its named columns, and enough columns for the
+    ones it reads by position.
+
+    Parameters
+    ----------
+    field_mapping : UnifyFieldMapping
+        the mapping.
+    positional_column_description : string
+        what the columns read by position are, for the error message.
+    value_checks : dict
+        column name -> (check, expected description), for values the mapping's derived fields need in a form.
+    full_width_rows : bool
+        True if every row needs as many fields as the header.
+    """
+
+    return UnifyFormatSchema(field_mapping.source_column_names(), field_mapping.minimum_columns(),
+                             positional_column_description, value_checks,
+                             skip_blank_column=field_mapping.skip_blank_column, full_width_rows=full_width_rows)
+
+
+unify_format_registry = UnifyFormatRegistry()
+unify_format_registry.register_format(UnifyFormat('Waters', 'version', WatersUnify, 'waters_unify_controller',
+                                                  reads_projected_csv=True,
+                                                  schema=field_mapping_schema(
+                                                      WatersUnify.field_mapping,
+                                                      'method name in column {}'.format(
+                                                          WatersUnify.data_source_index + 1)),
+                                                  field_mapping=WatersUnify.field_mapping))
+unify_format_registry.register_format(UnifyFormat('Waters (TargetLynx XML)', None, WatersUnify,
+                                                  'waters_unify_controller', {'xml': True},
+                                                  head_marker='<QUANDATASET', reads_csv=False, file_extension='.xml'))
+unify_format_registry.register_format(UnifyFormat('Agilent (Melanie ICP/MS)', 'Sample Type', AgilentUnify,
+                                                  'agilent_unify_controller',
+                                                  schema=field_mapping_schema(
+                                                      AgilentUnify.field_mapping,
+                                                      value_checks={'Date and Time Acquired': (
+                                                          has_date_and_time, 'MM/DD/YYYY hh:mm:ss')}),
+                                                  field_mapping=AgilentUnify.field_mapping))
+unify_format_registry.register_format(UnifyFormat('Agilent (Harry ICP/MS)', 'Type', AgilentUnify,
+                                                  'agilent_unify_controller', {'old_icp': True},
+                                                  schema=field_mapping_schema(
+                                                      AgilentUnify.old_icp_field_mapping,
+                                                      'analytes from column 7 on',
+                                                      value_checks={'Date Time': (
+                                                          has_date_time_and_meridiem, 'M/D/YYYY h:mm:ss AM')},
+                                                      full_width_rows=True),
+                                                  field_mapping=AgilentUnify.old_icp_field_mapping))
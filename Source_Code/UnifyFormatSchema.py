@@ -0,0 +1,261 @@
+import itertools
+import csv
+
+
+class UnifySchemaError(ValueError):
+    """a file's header or rows aren't what its format's converter needs. The message lists every problem found.
+
+    Attributes
+    ----------
+    format_name : string
+        the format the file was detected as.
+    problems : list(string)
+        one per problem, e.g. "missing column 'analconc'", "row 3 has 5 fields, expected at least 13" or "no data rows
+        after the header".
+    """
+
+    def __init__(self, format_name, problems):
+        self.format_name = format_name
+        self.problems = list(problems)
+        super().__init__("not a complete {} export - {}".format(format_name, '; '.join(self.problems)))
+
+
+def has_date_and_time(value):
+    """True for the new ICP software's 'Date and Time Acquired' - a 10 character date, a space, then the time. """
+
+    return len(value) >= 16 and value[10] == ' '
+
+
+def has_date_time_and_meridiem(value):
+    """True for the old ICP's 'Date Time' - date, time and AM/PM, separated by spaces. """
+
+    return len(value.split(" ")) >= 3
+
+
+class UnifyFormatSchema:
+    """The columns and row shape a format's converter relies on, checked before anything is condensed or written.
+
+    The converters look their columns up by header name, and a name that isn't there used to leave its index at 0 -
+    so a file with a renamed or missing column came out as a slow, full sized excel file of the wrong data, or
+    failed part way through writing it. A few columns have no fixed name at all and are read by position (the Waters
+    method name, the old ICP analytes), so a file too narrow for them failed the same way. Checking the header and
+    the first sample_row_count rows against the schema catches those files before the converter starts, with every
+    problem named in one error, and costs next to nothing next to the conversion. So does a file with a header and
+    no data rows under it, which would otherwise come out as an empty batch with no name.
+
+    Attributes
+    ----------
+    required_columns : list(string)
+        header names the converter looks up.
+    minimum_columns : int
+        the fewest columns the header can have, for columns read by position.
+    positional_column_description : string
+        what the columns read by position are, for the error message.
+    value_checks : dict
+        column name -> (check, expected), where check(value) is True for a value the converter can read and
+        expected describes one, e.g. 'MM/DD/YYYY hh:mm:ss'.
+    skip_blank_column : string
+        rows with nothing in this column are skipped by the converter, so they're skipped here too. None for none.
+    full_width_rows : bool
+        True if every row needs as many fields as the header (wide formats, where each column is read).
+    sample_row_count : int
+        rows after the header that are checked.
+    """
+
+    def __init__(self, required_columns=(), minimum_columns=0, positional_column_description='', value_checks=None,
+                 skip_blank_column=None, full_width_rows=False, sample_row_count=20):
+        """
+        Parameters
+        ----------
+        required_columns : list(string)
+            header names the converter looks up.
+        minimum_columns : int
+            the fewest columns the header can have, for columns read by position.
+        positional_column_description : string
+            what the columns read by position are, for the error message.
+        value_checks : dict
+            column name -> (check, expected description).
+        skip_blank_column : string
+            rows with nothing in this column aren't checked. None to check every row.
+        full_width_rows : bool
+            True if every row needs as many fields as the header.
+        sample_row_count : int
+            rows after the header that are checked.
+        """
+
+        self.required_columns = list(required_columns)
+        self.minimum_columns = minimum_columns
+        self.positional_column_description = positional_column_description
+        self.value_checks = dict(value_checks or {})
+        self.skip_blank_column = skip_blank_column
+        self.full_width_rows = full_width_rows
+        self.sample_row_count = sample_row_count
+
+    def header_problems(self, header_row):
+        """what's wrong with the header row, as a list of problems - empty if nothing is.
+
+        Parameters
+        ----------
+        header_row : list
+            the first line of the csv file.
+        """
+
+        header_columns = set(header_row)
+        missing_columns = [column_name for column_name in self.required_columns if column_name not in header_columns]
+        problems = []
+        if missing_columns:
+            problems.append("missing column{} {}".format('s' if len(missing_columns) > 1 else '',
+                                                         ', '.join(map(repr, missing_columns))))
+        if len(header_row) < self.minimum_columns:
+            problems.append("the header has {} columns, expected at least {}{}".format(
+                len(header_row), self.minimum_columns,
+                " (for the {})".format(self.positional_column_description) if self.positional_column_description
+                else ''))
+        return problems
+
+    def row_problems(self, header_row, sample_rows, first_row_number=2):
+        """what's wrong with the sample rows, as a list of problems - empty if nothing is. Assumes the header is
+        fine.
+
+        Parameters
+        ----------
+        header_row : list
+            the first line of the csv file.
+        sample_rows : iterable(list)
+            rows after the header.
+        first_row_number=2
+            the file's row number for the first of them, for the messages - later if they're rows appended to a
+            file already converted (see UnifyTail).
+        """
+
+        column_indexes = self.column_indexes(header_row)
+        # the widest row the converter reads from
+        required_width = max([column_indexes[column_name] + 1 for column_name in self.required_columns] +
+                             [self.minimum_columns])
+        if self.full_width_rows:
+            required_width = len(header_row)
+        value_check_indexes = [(column_name, column_indexes[column_name], check, expected)
+                               for column_name, (check, expected) in self.value_checks.items()]
+        sample_rows = list(sample_rows)
+        problems = []
+        rows_checked = 0
+        for row_number, row in self.non_blank_rows(header_row, sample_rows, first_row_number):
+            rows_checked += 1
+            if len(row) < required_width:
+                problems.append("row {} has {} fields, expected at least {}".format(row_number, len(row),
+                                                                                   required_width))
+                continue
+            for column_name, column_index, check, expected in value_check_indexes:
+                if not check(row[column_index]):
+                    problems.append("row {} {!r} is {!r}, expected {}".format(row_number, column_name,
+                                                                             row[column_index], expected))
+        if not rows_checked and len(sample_rows) < self.sample_row_count:
+            # the whole file has been seen, and there's nothing in it to convert. (A full sample of blank rows
+            # might still have data after it - the converter finds out.)
+            problems.append("no data rows after the header")
+        return problems
+
+    def column_indexes(self, header_row):
+        """column name -> index. A repeated name is the first column with it, as in UnifyFieldMapping.compile. """
+
+        column_indexes = {}
+        for column_index, column_name in enumerate(header_row):
+            column_indexes.setdefault(column_name, column_index)
+        return column_indexes
+
+    def non_blank_rows(self, header_row, rows, first_row_number=2):
+        """yields (row number, row) for each row the converter won't skip as blank - an empty line, or nothing in
+        skip_blank_column. Numbered from first_row_number.
+
+        Parameters
+        ----------
+        header_row : list
+            the first line of the csv file.
+        rows : iterable(list)
+            rows after the header.
+        first_row_number=2
+            the file's row number for the first of the rows - 2 is the row after the header.
+        """
+
+        skip_blank_index = self.column_indexes(header_row).get(self.skip_blank_column)
+        for row_number, row in enumerate(rows, first_row_number):
+            if skip_blank_index is not None and (len(row) <= skip_blank_index or not row[skip_blank_index]):
+                continue
+            if not any(row):
+                continue
+            yield row_number, row
+
+    def validate(self, format_name, header_row, sample_rows, first_row_number=2):
+        """checks the header, then the sample rows.
+
+        Parameters
+        ----------
+        format_name : string
+            the format's name, for the error message.
+        header_row : list
+            the first line of the csv file.
+        sample_rows : iterable(list)
+            up to sample_row_count rows after the header.
+        first_row_number=2
+            the file's row number for the first sample row.
+
+        Raises
+        ------
+        UnifySchemaError
+            the file doesn't match the schema.
+        """
+
+        problems = self.header_problems(header_row)
+        if not problems:
+            problems = self.row_problems(header_row, sample_rows, first_row_number)
+        if problems:
+            raise UnifySchemaError(format_name, problems)
+
+    def validate_csv_file_rows(self, format_name, csv_file_rows, first_row_number=2):
+        """checks the head of some csv rows, and returns rows to convert in their place - the same list, or for an
+        iterator, one with the rows that were checked put back on the front.
+
+        Parameters
+        ----------
+        format_name : string
+            the format's name, for the error message.
+        csv_file_rows : list(list) or iterator(list)
+            the csv file, header first.
+        first_row_number=2
+            the file's row number for the first row after the header.
+
+        Raises
+        ------
+        UnifySchemaError
+            the file doesn't match the schema.
+        """
+
+        if isinstance(csv_file_rows, list):
+            self.validate(format_name, csv_file_rows[0] if csv_file_rows else [],
+                          csv_file_rows[1:self.sample_row_count + 1], first_row_number)
+            return csv_file_rows
+        csv_file_rows = iter(csv_file_rows)
+        head_rows = list(itertools.islice(csv_file_rows, self.sample_row_count + 1))
+        self.validate(format_name, head_rows[0] if head_rows else [], head_rows[1:], first_row_number)
+        return itertools.chain(head_rows, csv_file_rows)
+
+    def validate_csv_file(self, format_name, filename):
+        """checks the head of a csv file, reading no further than the rows it checks.
+
+        Parameters
+        ----------
+        format_name : string
+            the format's name, for the error message.
+        filename : string
+            the csv file.
+
+        Raises
+        ------
+        UnifySchemaError
+            the file doesn't match the schema.
+        UnicodeDecodeError
+            file is not being recognized as a csv file.
+        """
+
+        with open(filename, newline='') as csv_file:
+            self.validate_csv_file_rows(format_name, csv.reader(csv_file))
@@ -0,0 +1,447 @@
+if __package__:
+    from .UnifiedSchema import unified_field_names, parse_create_date, parse_float
+    from .UnifyFormatRegistry import unify_format_registry
+    from .UnifyMerge import is_unified_file, generate_unified_file_condensed_lines, find_files_to_merge
+else:
+    # run as a script from Source_Code
+    from UnifiedSchema import unified_field_names, parse_create_date, parse_float
+    from UnifyFormatRegistry import unify_format_registry
+    from UnifyMerge import is_unified_file, generate_unified_file_condensed_lines, find_files_to_merge
+import contextlib
+import itertools
+import argparse
+import datetime
+import sqlite3
+import time
+import csv
+import sys
+import os
+
+
+default_index_filename = '.unify_index.sqlite3'
+
+
+class UnifyIndex:
+    """An index of every converted result, so "every result for sample X" or "every Pb 208 [He] result this month"
+    is one query instead of opening dozens of unified excel files.
+
+    It's a SQLite file, kept up to date as batches are converted: IndexOutputSink goes in the converter's
+    output_formats next to the xlsx, and indexes the same condensed lines in the same pass. Each row keeps the nine
+    unified fields as the instrument wrote them, plus the batch it came from (its unified file, without the
+    extension) and the create date in ISO form for date ranges. Sample, analyte and filename compare case
+    insensitively, and each has an index together with the date, so a sample or analyte over a date range is an
+    index range scan however many years of batches there are.
+
+    Indexing a batch replaces whatever was indexed for it before, so converting a file again doesn't duplicate its
+    results. The rows are staged in a temp table while the conversion runs, then swapped in in one short
+    transaction, so a conversion that fails part way leaves the batch as it was last indexed, queries never see half
+    a batch, and the index is only locked for the swap. Like UnifyCache it only uses SQLite's ordinary file locking,
+    so several worker processes (or PCs) can index into the same file.
+
+    Attributes
+    ----------
+    index_filename : string
+        the SQLite index file.
+    batch_size : int
+        rows per executemany, so a long batch isn't all held in memory at once.
+    """
+
+    result_column_names = ['data_source', 'filename', 'create_date', 'create_time', 'sample_name', 'sample_type',
+                           'analyte_name', 'analyte_concentration', 'percent_recovery']
+
+    def __init__(self, index_filename, batch_size=10000):
+        """
+        Parameters
+        ----------
+        index_filename : string
+            the SQLite index file. Created if it doesn't exist.
+        batch_size : int
+            rows per executemany.
+        """
+
+        self.index_filename = index_filename
+        self.batch_size = batch_size
+        directory = os.path.dirname(index_filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with contextlib.closing(self.connect()) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS unified_results ("
+                               "unified_batch TEXT NOT NULL, "
+                               "data_source TEXT, "
+                               "filename TEXT COLLATE NOCASE, "
+                               "create_date TEXT, "
+                               "create_time TEXT, "
+                               "sample_name TEXT COLLATE NOCASE, "
+                               "sample_type TEXT, "
+                               "analyte_name TEXT COLLATE NOCASE, "
+                               "analyte_concentration TEXT, "
+                               "percent_recovery TEXT, "
+                               "iso_create_date TEXT, "
+                               "concentration REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS unified_results_sample "
+                               "ON unified_results (sample_name, iso_create_date)")
+            connection.execute("CREATE INDEX IF NOT EXISTS unified_results_analyte "
+                               "ON unified_results (analyte_name, iso_create_date)")
+            connection.execute("CREATE INDEX IF NOT EXISTS unified_results_date ON unified_results (iso_create_date)")
+            connection.execute("CREATE INDEX IF NOT EXISTS unified_results_filename "
+                               "ON unified_results (filename, iso_create_date)")
+            connection.execute("CREATE INDEX IF NOT EXISTS unified_results_batch ON unified_results (unified_batch)")
+            connection.execute("CREATE TABLE IF NOT EXISTS unified_batches ("
+                               "unified_batch TEXT PRIMARY KEY, "
+                               "rows INTEGER NOT NULL, "
+                               "first_date TEXT, "
+                               "last_date TEXT, "
+                               "indexed REAL NOT NULL)")
+
+    def connect(self):
+        """a connection to the index. The timeout lets other workers finish writing instead of erroring.
+
+        Used as `with contextlib.closing(self.connect()) as connection, connection:` - one transaction, then closed.
+        """
+
+        return sqlite3.connect(self.index_filename, timeout=30)
+
+    def index_condensed_lines(self, unified_batch, condensed_lines):
+        """indexes a batch's condensed lines, replacing anything indexed for the batch before. Returns the number of
+        rows indexed.
+
+        Parameters
+        ----------
+        unified_batch : string
+            the batch's unified file, without the extension.
+        condensed_lines : iterable(list)
+            the header, followed by the condensed data lines.
+        """
+
+        condensed_lines = iter(condensed_lines)
+        next(condensed_lines, None)
+        rows_indexed = 0
+        first_date = last_date = None
+        with contextlib.closing(self.connect()) as connection:
+            # staged in a temp table first - it's private to this connection and doesn't lock the index, so other
+            # workers can index their batches while this one is still converting. If the lines stop part way (the
+            # converter raised), the staged rows go with the connection and the batch's last good rows are kept.
+            connection.execute("CREATE TEMP TABLE staged_results AS SELECT * FROM unified_results WHERE 0")
+            with connection:
+                for chunk in iter(lambda: list(itertools.islice(condensed_lines, self.batch_size)), []):
+                    index_rows = [self.index_row(unified_batch, condensed_line) for condensed_line in chunk]
+                    connection.executemany("INSERT INTO staged_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                           index_rows)
+                    rows_indexed += len(index_rows)
+                    batch_dates = [index_row[10] for index_row in index_rows if index_row[10] is not None]
+                    if first_date is not None:
+                        batch_dates += [first_date, last_date]
+                    if batch_dates:
+                        first_date, last_date = min(batch_dates), max(batch_dates)
+            # then swapped in, in one transaction that only holds the write lock for the copy
+            with connection:
+                connection.execute("DELETE FROM unified_results WHERE unified_batch = ?", (unified_batch,))
+                connection.execute("DELETE FROM unified_batches WHERE unified_batch = ?", (unified_batch,))
+                connection.execute("INSERT INTO unified_results SELECT * FROM staged_results")
+                connection.execute("INSERT INTO unified_batches VALUES (?, ?, ?, ?, ?)",
+                                   (unified_batch, rows_indexed, first_date, last_date, time.time()))
+        return rows_indexed
+
+    def index_row(self, unified_batch, condensed_line):
+        """the row stored for one condensed line.
+
+        Parameters
+        ----------
+        unified_batch : string
+            the batch's unified file, without the extension.
+        condensed_line : list
+            the nine unified fields.
+        """
+
+        create_date = parse_create_date(str(condensed_line[2]))
+        return ((unified_batch,) +
+                tuple(str(value) for value in condensed_line[:len(unified_field_names)]) +
+                (None if create_date is None else create_date.isoformat(), parse_float(condensed_line[7])))
+
+    def remove_batch(self, unified_batch):
+        """drops a batch from the index. Returns True if it was there.
+
+        Parameters
+        ----------
+        unified_batch : string
+            the batch's unified file, without the extension.
+        """
+
+        with contextlib.closing(self.connect()) as connection, connection:
+            connection.execute("DELETE FROM unified_results WHERE unified_batch = ?", (unified_batch,))
+            return connection.execute("DELETE FROM unified_batches WHERE unified_batch = ?",
+                                      (unified_batch,)).rowcount > 0
+
+    def has_batch(self, unified_batch):
+        """True if the batch is in the index.
+
+        Parameters
+        ----------
+        unified_batch : string
+            the batch's unified file, without the extension.
+        """
+
+        with contextlib.closing(self.connect()) as connection:
+            return connection.execute("SELECT 1 FROM unified_batches WHERE unified_batch = ?",
+                                      (unified_batch,)).fetchone() is not None
+
+    def batches(self):
+        """every indexed batch, oldest results first, as (unified batch, rows, first date, last date) tuples. """
+
+        with contextlib.closing(self.connect()) as connection:
+            return connection.execute("SELECT unified_batch, rows, first_date, last_date FROM unified_batches "
+                                      "ORDER BY first_date, unified_batch").fetchall()
+
+    def query(self, sample_name=None, analyte_name=None, date_from=None, date_to=None, filename=None,
+              unified_batch=None, limit=None):
+        """the indexed results matching every criterion given, in date order, then in the order they are in their
+        batch.
+
+        Names are matched case insensitively, and can have * (anything) and ? (any one character) wildcards in them
+        - a pattern that starts with the literal part still uses the index.
+
+        Parameters
+        ----------
+        sample_name : string
+            the sample name, or a pattern.
+        analyte_name : string
+            the analyte name, e.g. 'Pb 208 [He]', or a pattern.
+        date_from : datetime.date or string
+            the earliest create date, inclusive. Strings can be in any of the instruments' date formats.
+        date_to : datetime.date or string
+            the latest create date, inclusive.
+        filename : string
+            the instrument's data filename, or a pattern.
+        unified_batch : string
+            the batch's unified file, without the extension.
+        limit : int
+            the most results to return. None for all of them.
+
+        Returns
+        -------
+        list(list)
+            the condensed line (the nine unified fields) of each result, followed by its unified batch.
+
+        Raises
+        ------
+        ValueError
+            a date isn't in any of the instruments' date formats.
+        """
+
+        where_clauses = []
+        parameters = []
+        for column_name, value in (('sample_name', sample_name), ('analyte_name', analyte_name),
+                                   ('filename', filename), ('unified_batch', unified_batch)):
+            if value is None:
+                continue
+            if '*' in value or '?' in value:
+                where_clauses.append("{} LIKE ? ESCAPE '\\'".format(column_name))
+                parameters.append(self.like_pattern(value))
+            else:
+                where_clauses.append("{} = ?".format(column_name))
+                parameters.append(value)
+        for comparison, value in (('>=', date_from), ('<=', date_to)):
+            if value is None:
+                continue
+            where_clauses.append("iso_create_date {} ?".format(comparison))
+            parameters.append(self.iso_date(value))
+        statement = "SELECT {}, unified_batch FROM unified_results".format(', '.join(self.result_column_names))
+        if where_clauses:
+            statement += " WHERE " + " AND ".join(where_clauses)
+        statement += " ORDER BY iso_create_date, unified_batch, rowid"
+        if limit is not None:
+            statement += " LIMIT ?"
+            parameters.append(limit)
+        with contextlib.closing(self.connect()) as connection:
+            return [list(row) for row in connection.execute(statement, parameters)]
+
+    def like_pattern(self, pattern):
+        """a * and ? wildcard pattern as a LIKE pattern, with LIKE's own wildcards escaped. """
+
+        pattern = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return pattern.replace('*', '%').replace('?', '_')
+
+    def iso_date(self, value):
+        """a date, or a date string in any of the instruments' formats, in ISO form.
+
+        Raises
+        ------
+        ValueError
+            the string isn't in any of the instruments' date formats.
+        """
+
+        if isinstance(value, datetime.date):
+            return value.isoformat()
+        create_date = parse_create_date(value)
+        if create_date is None:
+            raise ValueError("can't read {!r} as a date".format(value))
+        return create_date.isoformat()
+
+    def index_files(self, filenames, unified_files_directory):
+        """indexes files that were converted before the index was - unified files are read back in, and raw exports
+        are run through their converter with only an IndexOutputSink, so nothing is written but the index.
+
+        Parameters
+        ----------
+        filenames : list
+            unified files (.csv, .xlsx, .parquet, .arrow) and/or raw exports.
+        unified_files_directory : string
+            the directory the raw exports' unified files are in, which their batch names are made from.
+
+        Returns
+        -------
+        list(tuple)
+            (filename, rows indexed, message) for each file - message is '' if it was indexed.
+        """
+
+        index_results = []
+        for filename in filenames:
+            try:
+                if is_unified_file(filename):
+                    rows_indexed = self.index_condensed_lines(
+                        os.path.splitext(filename)[0],
+                        itertools.chain([unified_field_names], generate_unified_file_condensed_lines(filename)))
+                else:
+                    index_output_sink = IndexOutputSink(self)
+                    unify_format = unify_format_registry.detect_format(filename)
+                    if unify_format.reads_csv:
+                        with open(filename, newline='') as csv_file:
+                            unify_format.convert(csv.reader(csv_file), unified_files_directory, streaming=True,
+                                                 output_formats=[index_output_sink])
+                    else:
+                        unify_format.convert(filename, unified_files_directory, output_formats=[index_output_sink])
+                    if index_output_sink.error is not None:
+                        raise index_output_sink.error
+                    rows_indexed = index_output_sink.rows_indexed
+                index_results.append((filename, rows_indexed, ''))
+            except UnicodeDecodeError:
+                index_results.append((filename, 0, "This file is not being recognized as a csv file."))
+            except (OSError, ValueError, ImportError, sqlite3.Error) as exc:
+                index_results.append((filename, 0, "{}: {}".format(type(exc).__name__, exc)))
+        return index_results
+
+    def index_unified_file_if_missing(self, unified_filename):
+        """indexes a unified file that was already written - a cache hit - if its batch isn't in the index, e.g.
+        because it was converted before there was an index. Returns '' if it's indexed, or why it couldn't be.
+
+        Parameters
+        ----------
+        unified_filename : string
+            the unified file (.csv, .xlsx, .parquet, .arrow).
+        """
+
+        try:
+            if self.has_batch(os.path.splitext(unified_filename)[0]):
+                return ''
+        except sqlite3.Error as exc:
+            return "{}: {}".format(type(exc).__name__, exc)
+        return self.index_files([unified_filename], os.path.dirname(unified_filename))[0][2]
+
+
+class IndexOutputSink:
+    """an output sink that indexes the condensed lines into a UnifyIndex instead of writing a file. Goes in a
+    converter's output_formats next to the files, e.g. ['xlsx', IndexOutputSink(unify_index)].
+
+    The index is a convenience, so failing to update it (the file is locked for longer than the timeout, say) doesn't
+    fail the conversion - the error is kept in error, and the rest of the lines are let through.
+
+    Attributes
+    ----------
+    extension : None
+        no file, so the pipeline passes the batch's path without an extension.
+    unify_index : UnifyIndex
+        the index to update.
+    batch_directory : string
+        the directory the batch's unified files end up in, if that's not where they're written (UnifyPrefetch writes
+        locally, then uploads). None to index them where they're written.
+    rows_indexed : int
+        rows indexed by the last write.
+    error : Exception
+        why the last write failed to update the index, or None.
+    """
+
+    extension = None
+
+    def __init__(self, unify_index, batch_directory=None):
+        self.unify_index = unify_index
+        self.batch_directory = batch_directory
+        self.rows_indexed = 0
+        self.error = None
+
+    def write_condensed_lines(self, filename, condensed_lines):
+        """indexes the condensed lines (header first) as the batch filename. """
+
+        self.error = None
+        if self.batch_directory is not None:
+            filename = os.path.join(self.batch_directory, os.path.basename(filename))
+        try:
+            self.rows_indexed = self.unify_index.index_condensed_lines(filename, condensed_lines)
+        except sqlite3.Error as exc:
+            self.error = exc
+
+
+def indexed_output_formats(output_formats, index_filename, batch_directory=None):
+    """output_formats with an IndexOutputSink for index_filename added, and the sink.
+
+    Parameters
+    ----------
+    output_formats : list
+        the outputs to write, or None for just the excel file.
+    index_filename : string
+        the UnifyIndex file.
+    batch_directory : string
+        where the unified files end up, if not where they're written. See IndexOutputSink.
+    """
+
+    index_output_sink = IndexOutputSink(UnifyIndex(index_filename), batch_directory)
+    return list(output_formats or ['xlsx']) + [index_output_sink], index_output_sink
+
+
+def main(argv=None):
+    """command line entry point for querying (and filling) the index. """
+
+    parser = argparse.ArgumentParser(description="Find converted results across every indexed batch.")
+    parser.add_argument('-o', '--output-directory',
+                        default=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                        help="directory the unified files are written to")
+    parser.add_argument('-i', '--index', default=None,
+                        help="index file (default: " + default_index_filename + " in the output directory)")
+    parser.add_argument('-s', '--sample', default=None, help="sample name - * and ? wildcards are allowed")
+    parser.add_argument('-a', '--analyte', default=None, help="analyte name, e.g. 'Pb 208 [He]' - wildcards allowed")
+    parser.add_argument('--file', default=None, help="instrument data filename - wildcards allowed")
+    parser.add_argument('--from', dest='date_from', default=None, help="earliest create date, e.g. 2021-06-01")
+    parser.add_argument('--to', dest='date_to', default=None, help="latest create date")
+    parser.add_argument('-n', '--limit', type=int, default=None, help="most results to show")
+    parser.add_argument('--csv', default=None, help="write the results to this csv file instead of printing them")
+    parser.add_argument('--add', nargs='+', default=None, metavar='PATH',
+                        help="index unified files or exports converted before the index was (files, directories "
+                             "or glob patterns)")
+    parser.add_argument('--batches', action='store_true', help="list the indexed batches")
+    args = parser.parse_args(argv)
+    unify_index = UnifyIndex(args.index or os.path.join(args.output_directory, default_index_filename))
+    if args.add:
+        index_results = unify_index.index_files(find_files_to_merge(args.add), args.output_directory)
+        for filename, rows_indexed, message in index_results:
+            print("{} {} ({})".format('FAILED' if message else 'ok    ', filename, message or rows_indexed))
+        return 1 if any(message for _, _, message in index_results) else 0
+    if args.batches:
+        for unified_batch, rows, first_date, last_date in unify_index.batches():
+            print("{} {} rows, {} to {}".format(unified_batch, rows, first_date, last_date))
+        return 0
+    start_time = time.perf_counter()
+    try:
+        results = unify_index.query(args.sample, args.analyte, args.date_from, args.date_to, args.file,
+                                    limit=args.limit)
+    except ValueError as exc:
+        parser.error(str(exc))
+    if args.csv:
+        with open(args.csv, 'w', newline='') as csv_file:
+            csv.writer(csv_file).writerows([unified_field_names + ['unified batch']] + results)
+    else:
+        csv.writer(sys.stdout).writerows([unified_field_names + ['unified batch']] + results)
+    print("{} results ({:.1f} ms)".format(len(results), (time.perf_counter() - start_time) * 1000), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
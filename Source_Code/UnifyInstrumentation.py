@@ -0,0 +1,259 @@
+import contextlib
+import tracemalloc
+import datetime
+import cProfile
+import json
+import time
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    # not on Windows
+    resource = None
+
+
+class UnifyPhase:
+    """The numbers for one phase of a conversion - filled in by UnifyInstrumentation.phase.
+
+    Attributes
+    ----------
+    name : string
+        the phase, e.g. 'condensing'.
+    seconds : float
+        wall time.
+    rows_in : int
+        rows the phase was given, if known.
+    rows_out : int
+        rows the phase produced, if known. Set it inside the with block, or count it with count_rows.
+    peak_memory_megabytes : float
+        the most memory allocated during the phase (tracemalloc), or the process's peak RSS so far if memory
+        tracing is off.
+    """
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.seconds = 0.0
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.peak_memory_megabytes = None
+
+    def count_rows(self, rows):
+        """passes rows through, counting them into rows_out - for streamed phases where the count isn't known
+        up front.
+
+        Parameters
+        ----------
+        rows : iterable
+            the rows the phase produces.
+        """
+
+        self.rows_out = self.rows_out or 0
+        for row in rows:
+            self.rows_out += 1
+            yield row
+
+    def rows_per_second(self):
+        """rows out (or in, if out isn't known) per second of wall time, or None. """
+
+        rows = self.rows_out if self.rows_out is not None else self.rows_in
+        if rows is None or self.seconds <= 0:
+            return None
+        return rows / self.seconds
+
+    def as_dict(self):
+        """the phase as a JSON friendly dict. """
+
+        return {'phase': self.name,
+                'seconds': self.seconds,
+                'rows_in': self.rows_in,
+                'rows_out': self.rows_out,
+                'rows_per_second': self.rows_per_second(),
+                'peak_memory_megabytes': self.peak_memory_megabytes}
+
+
+class UnifyInstrumentation:
+    """Times each phase of a conversion - wall time, rows in and out, rows/s and peak memory - and exports the numbers.
+
+    The converters wrap each of their phases (reading, index discovery, condensing, writing) in phase(), and an
+    optional cProfile of the whole run can be dumped with profile(). The numbers go out as JSON (write_json, which
+    appends a run to a list so throughput can be followed over time) or as a Prometheus text file
+    (write_prometheus, for node_exporter's textfile collector).
+
+    A disabled instance (the converters' default) hands out phases without timing anything, so the hooks cost
+    nothing when nobody is looking. Memory tracing with tracemalloc gives per-phase peaks but slows python code down
+    noticeably - with trace_memory off, the process's peak RSS is recorded instead.
+
+    Attributes
+    ----------
+    enabled : bool
+        False to record nothing.
+    trace_memory : bool
+        True to measure each phase's peak memory with tracemalloc.
+    profile_filename : string
+        where profile() dumps its cProfile stats. None for no profiling.
+    labels : dict
+        extra labels for the exported numbers, e.g. {'pathway': 'Waters'}.
+    phases : list(UnifyPhase)
+        the phases recorded, in order.
+    """
+
+    def __init__(self, enabled=True, trace_memory=False, profile_filename=None, labels=None):
+        """
+        Parameters
+        ----------
+        enabled : bool
+            False to record nothing.
+        trace_memory : bool
+            True to measure each phase's peak memory with tracemalloc.
+        profile_filename : string
+            where profile() dumps its cProfile stats. None for no profiling.
+        labels : dict
+            extra labels for the exported numbers.
+        """
+
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.profile_filename = profile_filename
+        self.labels = dict(labels or {})
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name, rows_in=None):
+        """times the with block as one phase, and yields its UnifyPhase so rows_out can be filled in.
+
+        Parameters
+        ----------
+        name : string
+            the phase, e.g. 'condensing'.
+        rows_in : int
+            rows the phase was given, if known.
+        """
+
+        unify_phase = UnifyPhase(name, rows_in)
+        if not self.enabled:
+            yield unify_phase
+            return
+        started_tracing = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        try:
+            yield unify_phase
+        finally:
+            unify_phase.seconds = time.perf_counter() - start_time
+            if self.trace_memory:
+                unify_phase.peak_memory_megabytes = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                if started_tracing:
+                    tracemalloc.stop()
+            else:
+                unify_phase.peak_memory_megabytes = peak_rss_in_megabytes()
+            self.phases.append(unify_phase)
+
+    @contextlib.contextmanager
+    def profile(self):
+        """runs the with block under cProfile and dumps the stats to profile_filename (if there is one). """
+
+        if not self.enabled or self.profile_filename is None:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            directory = os.path.dirname(self.profile_filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(self.profile_filename)
+
+    def phase_dicts(self):
+        """every phase recorded, as dicts, with the labels added. """
+
+        return [dict(self.labels, **unify_phase.as_dict()) for unify_phase in self.phases]
+
+    def summary(self):
+        """one line per phase, for logs. """
+
+        return '\n'.join("{:<20} {:8.3f}s  {:>12} rows/s".format(
+            unify_phase.name, unify_phase.seconds,
+            'n/a' if unify_phase.rows_per_second() is None else '{:,.0f}'.format(unify_phase.rows_per_second()))
+            for unify_phase in self.phases)
+
+    def write_json(self, filename, phase_dicts=None):
+        """appends this run's phases to a JSON file (a list of runs), creating it if needed.
+
+        Parameters
+        ----------
+        filename : string
+            the JSON file.
+        phase_dicts : list(dict)
+            the phases to write. Defaults to phase_dicts() - a batch passes in the phases of all its files.
+        """
+
+        runs = []
+        if os.path.exists(filename):
+            with open(filename) as json_file:
+                runs = json.load(json_file)
+        runs.append({'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                     'phases': self.phase_dicts() if phase_dicts is None else phase_dicts})
+        write_file_atomically(filename, json.dumps(runs, indent=2))
+
+    def write_prometheus(self, filename, phase_dicts=None):
+        """writes the phases as a Prometheus text file, replacing the last one (node_exporter reads it whole).
+
+        Parameters
+        ----------
+        filename : string
+            the .prom file.
+        phase_dicts : list(dict)
+            the phases to write. Defaults to phase_dicts().
+        """
+
+        phase_dicts = self.phase_dicts() if phase_dicts is None else phase_dicts
+        metrics = [('unify_phase_seconds', 'seconds', 'Wall time of a conversion phase.'),
+                   ('unify_phase_rows_in', 'rows_in', 'Rows a conversion phase was given.'),
+                   ('unify_phase_rows_out', 'rows_out', 'Rows a conversion phase produced.'),
+                   ('unify_phase_rows_per_second', 'rows_per_second', 'Throughput of a conversion phase.'),
+                   ('unify_phase_peak_memory_megabytes', 'peak_memory_megabytes', 'Peak memory of a conversion phase.')]
+        numeric_keys = {key for _, key, _ in metrics}
+        lines = []
+        for metric_name, key, help_text in metrics:
+            lines.append("# HELP {} {}".format(metric_name, help_text))
+            lines.append("# TYPE {} gauge".format(metric_name))
+            for phase_dict in phase_dicts:
+                if phase_dict.get(key) is None:
+                    continue
+                labels = ','.join('{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for label, value in sorted(phase_dict.items()) if label not in numeric_keys)
+                lines.append("{}{{{}}} {}".format(metric_name, labels, phase_dict[key]))
+        write_file_atomically(filename, '\n'.join(lines) + '\n')
+
+
+def peak_rss_in_megabytes():
+    """the peak resident memory of this process so far, in MB, or None where the resource module isn't available. """
+
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS reports bytes
+    if sys.platform == 'darwin':
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+
+def write_file_atomically(filename, text):
+    """writes text to a temporary file and swaps it in, so a reader never sees half a file. """
+
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_filename = filename + '.tmp'
+    with open(temporary_filename, 'w') as text_file:
+        text_file.write(text)
+    os.replace(temporary_filename, filename)
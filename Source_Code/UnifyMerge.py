@@ -0,0 +1,539 @@
+if __package__:
+    from .UnifyFormatRegistry import unify_format_registry
+    from .UnifyOutputPipeline import UnifyOutputPipeline
+    from .UnifyInstrumentation import UnifyInstrumentation
+    from .UnifiedParquetWriter import load_pyarrow
+    from .UnifiedSchema import unified_field_names, unified_column_names, parse_create_date, parse_create_time
+else:
+    # run as a script from Source_Code
+    from UnifyFormatRegistry import unify_format_registry
+    from UnifyOutputPipeline import UnifyOutputPipeline
+    from UnifyInstrumentation import UnifyInstrumentation
+    from UnifiedParquetWriter import load_pyarrow
+    from UnifiedSchema import unified_field_names, unified_column_names, parse_create_date, parse_create_time
+import itertools
+import argparse
+import operator
+import tempfile
+import datetime
+import heapq
+import glob
+import csv
+import os
+
+
+def merge_key(condensed_line):
+    """the key the merge sorts on - (create date, create time, sample name), then filename and analyte name, so
+    that two lines with the same key are the same result.
+
+    Dates and times are compared parsed, so 22-Jun-21 from a Waters csv and 2021-06-22 from a parquet file are the
+    same day, and 1:05 PM sorts after 10:32 AM. Ones that can't be parsed sort first, by their text.
+
+    Parameters
+    ----------
+    condensed_line : list
+        a condensed line (the nine unified fields).
+    """
+
+    create_date = parse_create_date(condensed_line[2])
+    create_time = parse_create_time(condensed_line[3])
+    return (create_date.toordinal() if create_date is not None else 0,
+            create_time if create_time is not None else datetime.time.min,
+            condensed_line[4],
+            condensed_line[1],
+            condensed_line[6],
+            '' if create_date is not None else condensed_line[2],
+            '' if create_time is not None else condensed_line[3])
+
+
+def generate_csv_condensed_lines(csv_filename):
+    """yields the condensed lines of a unified csv file, without its header.
+
+    Parameters
+    ----------
+    csv_filename : string
+        the unified csv file.
+    """
+
+    with open(csv_filename, newline='') as csv_file:
+        csv_file_rows = csv.reader(csv_file)
+        next(csv_file_rows, None)
+        for item in csv_file_rows:
+            if item:
+                yield item
+
+
+def generate_excel_condensed_lines(excel_filename):
+    """yields the condensed lines of a unified excel file, from every sheet, without the headers.
+
+    Parameters
+    ----------
+    excel_filename : string
+        the unified .xlsx file.
+
+    Raises
+    ------
+    ImportError
+        openpyxl isn't installed.
+    """
+
+    try:
+        # only needed for reading unified excel files back in
+        import openpyxl
+    except ImportError:
+        raise ImportError("openpyxl is needed to read unified .xlsx files - pip install openpyxl")
+    workbook = openpyxl.load_workbook(excel_filename, read_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            for row in worksheet.iter_rows(min_row=2, values_only=True):
+                if any(value is not None for value in row):
+                    yield [excel_cell_text(value) for value in row[:len(unified_field_names)]]
+    finally:
+        workbook.close()
+
+
+def excel_cell_text(value):
+    """a cell value read back from a unified excel file, as condensed line text. Create dates and times are real
+    excel dates and times, which come back as datetimes - they're written in ISO form, which parse_create_date and
+    parse_create_time read.
+
+    Parameters
+    ----------
+    value : object
+        the cell's value, from openpyxl.
+    """
+
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        # openpyxl reads date cells as midnight datetimes
+        return value.date().isoformat() if value.time() == datetime.time.min else value.isoformat(' ')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def typed_value_text(value, text):
+    """a value read back from a typed column of a unified parquet/arrow file, as condensed line text - the text the
+    file kept for it (see UnifiedParquetWriter), or failing that the value as the converters would write it: dates
+    in ISO form, numbers as repr writes them.
+
+    Parameters
+    ----------
+    value : object
+        the typed value, from pyarrow.
+    text : string
+        the value's text column, or None.
+    """
+
+    if text is not None:
+        return text
+    if value is None:
+        return ''
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# the typed columns of a unified parquet/arrow file, and the text column kept alongside each
+typed_text_column_names = {'create_date': 'create_date_text',
+                           'analyte_concentration': 'analyte_concentration_text',
+                           'percent_recovery': 'percent_recovery_text'}
+
+
+def generate_parquet_condensed_lines(parquet_filename, file_format='parquet'):
+    """yields the condensed lines of a unified parquet/arrow file, a record batch at a time. The typed columns
+    come back as the text they were written from - dates as the instrument wrote them, ' ' for no percent recovery
+    and '0.050' as '0.050' - so they match the same lines from a csv file. Files written before the date and percent
+    recovery text was kept give dates in ISO form and blanks for percent recoveries that weren't numbers.
+
+    Parameters
+    ----------
+    parquet_filename : string
+        the unified .parquet or .arrow file.
+    file_format : string
+        'parquet' or 'arrow'.
+
+    Raises
+    ------
+    ImportError
+        pyarrow isn't installed.
+    """
+
+    pyarrow = load_pyarrow()
+    if file_format == 'arrow':
+        ipc_reader = pyarrow.ipc.open_file(parquet_filename)
+        record_batches = (ipc_reader.get_batch(batch_number)
+                          for batch_number in range(ipc_reader.num_record_batches))
+    else:
+        record_batches = pyarrow.parquet.ParquetFile(parquet_filename).iter_batches()
+    for record_batch in record_batches:
+        columns = record_batch.to_pydict()
+        for column_name, text_column_name in typed_text_column_names.items():
+            texts = columns.get(text_column_name) or itertools.repeat(None)
+            columns[column_name] = list(map(typed_value_text, columns[column_name], texts))
+        for values in zip(*(columns[column_name] for column_name in unified_column_names)):
+            yield ['' if value is None else value for value in values]
+
+
+def is_unified_file(filename):
+    """True if the file is a unified file (parquet, arrow, xlsx, or a csv with the unified header) rather than a raw
+    export.
+
+    Parameters
+    ----------
+    filename : string
+        the file.
+    """
+
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in ('.parquet', '.arrow', '.xlsx'):
+        return True
+    return extension == '.csv' and unify_format_registry.read_head_header_row(filename) == unified_field_names
+
+
+def generate_unified_file_condensed_lines(unified_filename):
+    """yields the condensed lines of any unified file, without the header.
+
+    Parameters
+    ----------
+    unified_filename : string
+        the unified .csv, .xlsx, .parquet or .arrow file.
+
+    Raises
+    ------
+    ImportError
+        the file needs pyarrow or openpyxl to read, and it isn't installed.
+    """
+
+    extension = os.path.splitext(unified_filename)[1].lower()
+    if extension in ('.parquet', '.arrow'):
+        return generate_parquet_condensed_lines(unified_filename, extension[1:])
+    if extension == '.xlsx':
+        return generate_excel_condensed_lines(unified_filename)
+    return generate_csv_condensed_lines(unified_filename)
+
+
+class SortedRunOutputSink:
+    """an output sink that, instead of writing a unified file, hands the condensed lines to UnifyMerge to be cut
+    into sorted runs. Lets a raw export go through its own converter's controller, unchanged, on the way into a merge.
+
+    Attributes
+    ----------
+    extension : None
+        no unified file, so no filename.
+    unify_merge : UnifyMerge
+        the merge the runs are for.
+    input_number : int
+        which input the lines came from.
+    """
+
+    extension = None
+
+    def __init__(self, unify_merge, input_number):
+        self.unify_merge = unify_merge
+        self.input_number = input_number
+
+    def write_condensed_lines(self, filename, condensed_lines):
+        """cuts the condensed lines (header first) into sorted runs. filename isn't used. """
+
+        condensed_lines = iter(condensed_lines)
+        next(condensed_lines, None)
+        self.unify_merge.write_sorted_runs(condensed_lines, self.input_number)
+
+
+class UnifyMerge:
+    """Merges many unified files and raw exports (a week of Waters and ICP batches, say) into one deduplicated
+    unified dataset, ordered by create date, create time and sample name.
+
+    It's an external merge sort, so memory is bounded by the number of inputs rather than their size. Each input is
+    read once, run_size lines at a time: each chunk is sorted and written to a temporary csv "run" - a chunk that
+    sorts after the end of the previous one is added to that run instead of starting a new one, so an input that's
+    already in order (most batches are) ends up as a single run. The runs are then k-way merged with heapq.merge,
+    which only holds one line per run. If there are more than max_open_runs runs, groups of them are merged into
+    bigger runs first, so the number of files open at once stays under the OS limit.
+
+    Lines with the same merge_key are the same result - kept once, with the values from the input listed last, so
+    adding a re-exported batch after the original replaces it. The merged lines go out through UnifyOutputPipeline,
+    in any of its formats.
+
+    Inputs can be unified files (.csv, .xlsx, .parquet, .arrow) or anything unify_format_registry recognises, which
+    is converted with its own converter on the way in. Reading a unified .xlsx needs the optional openpyxl package.
+
+    Attributes
+    ----------
+    input_filenames : list
+        the files to merge, in order of precedence (later ones win on duplicates).
+    unified_files_directory : string
+        the directory the merged file(s) are written to.
+    batch_name : string
+        the merged file's name, without an extension.
+    output_formats : list
+        the outputs to write, e.g. ['xlsx', 'csv']. None for just the excel file.
+    run_size : int
+        condensed lines sorted in memory at a time.
+    max_open_runs : int
+        the most runs merged at once.
+    run_directory : string
+        the temporary directory the runs are written to while a merge is going.
+    run_filenames : list(list)
+        the runs written for each input.
+    rows_in : int
+        condensed lines read from all the inputs.
+    rows_out : int
+        condensed lines in the merged dataset.
+    output_filenames : list
+        the merged files written.
+    unify_instrumentation : UnifyInstrumentation
+        times the sorting and merging phases. Disabled unless the caller swaps in an enabled one.
+    """
+
+    unified_file_extensions = ('.csv', '.xlsx', '.parquet', '.arrow', '.xml')
+
+    def __init__(self, input_filenames,
+                 unified_files_directory=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                 batch_name='unified_merge', output_formats=None, run_size=100000, max_open_runs=256):
+        """
+        Parameters
+        ----------
+        input_filenames : list
+            the files to merge. Later ones win on duplicates.
+        unified_files_directory : string
+            the directory the merged file(s) are written to.
+        batch_name : string
+            the merged file's name, without an extension.
+        output_formats : list
+            the outputs to write. None for just the excel file.
+        run_size : int
+            condensed lines sorted in memory at a time.
+        max_open_runs : int
+            the most runs merged at once.
+        """
+
+        self.input_filenames = list(input_filenames)
+        self.unified_files_directory = unified_files_directory
+        self.batch_name = batch_name
+        self.output_formats = output_formats
+        self.run_size = run_size
+        self.max_open_runs = max_open_runs
+        self.run_directory = None
+        self.run_filenames = []
+        self.rows_in = 0
+        self.rows_out = 0
+        self.output_filenames = []
+        self.unify_instrumentation = UnifyInstrumentation(enabled=False)
+
+    def unify_merge_controller(self):
+        """main function for the class. Sorts every input into runs, then merges them into the output file(s).
+
+        Returns
+        -------
+        list
+            the merged files written.
+
+        Raises
+        ------
+        ValueError
+            an input isn't a unified file or a supported export.
+        """
+
+        with tempfile.TemporaryDirectory(prefix='unify_merge_') as self.run_directory:
+            self.run_filenames = []
+            self.rows_in = 0
+            with self.unify_instrumentation.phase('sorting runs') as unify_phase:
+                for input_number, input_filename in enumerate(self.input_filenames):
+                    self.run_filenames.append([])
+                    try:
+                        self.read_input_into_sorted_runs(input_filename, input_number)
+                    except ValueError as exc:
+                        raise ValueError("{}: {}".format(input_filename, exc)) from exc
+                unify_phase.rows_out = self.rows_in
+            with self.unify_instrumentation.phase('merging', self.rows_in) as unify_phase:
+                run_filenames = self.reduce_run_filenames([run_filename for input_run_filenames in self.run_filenames
+                                                           for run_filename in input_run_filenames])
+                merged_lines = unify_phase.count_rows(self.generate_merged_lines(run_filenames))
+                unify_output_pipeline = UnifyOutputPipeline(self.unified_files_directory,
+                                                            self.output_formats or ['xlsx'])
+                self.output_filenames = unify_output_pipeline.write_condensed_lines(
+                    self.batch_name, itertools.chain([unified_field_names], merged_lines))
+                self.rows_out = unify_phase.rows_out
+        self.run_directory = None
+        return self.output_filenames
+
+    def read_input_into_sorted_runs(self, input_filename, input_number):
+        """reads one input, a unified file or a raw export, into sorted runs.
+
+        Parameters
+        ----------
+        input_filename : string
+            the file.
+        input_number : int
+            its position in input_filenames.
+        """
+
+        if is_unified_file(input_filename):
+            self.write_sorted_runs(generate_unified_file_condensed_lines(input_filename), input_number)
+        else:
+            # a raw export - its converter streams the condensed lines to a SortedRunOutputSink
+            unify_format = unify_format_registry.detect_format(input_filename)
+            if unify_format.reads_csv:
+                with open(input_filename, newline='') as csv_file:
+                    unify_format.convert(csv.reader(csv_file), self.run_directory, streaming=True,
+                                         output_formats=[SortedRunOutputSink(self, input_number)])
+            else:
+                unify_format.convert(input_filename, self.run_directory,
+                                     output_formats=[SortedRunOutputSink(self, input_number)])
+
+    def write_sorted_runs(self, condensed_lines, input_number):
+        """cuts condensed lines into chunks of run_size, sorts each and writes it out as a run, appending to the
+        input's last run when the chunk carries on where it left off.
+
+        Parameters
+        ----------
+        condensed_lines : iterable(list)
+            the input's condensed lines, no header.
+        input_number : int
+            which input they came from.
+        """
+
+        input_run_filenames = self.run_filenames[input_number]
+        last_key = None
+        condensed_lines = iter(condensed_lines)
+        for chunk in iter(lambda: list(itertools.islice(condensed_lines, self.run_size)), []):
+            self.rows_in += len(chunk)
+            # sorted() is stable, so duplicates inside an input keep their order and the last one still wins
+            chunk.sort(key=merge_key)
+            if last_key is None or merge_key(chunk[0]) < last_key:
+                input_run_filenames.append(os.path.join(self.run_directory, 'run_{}_{}.csv'.format(
+                    input_number, len(input_run_filenames))))
+            with open(input_run_filenames[-1], 'a', newline='') as run_file:
+                csv.writer(run_file).writerows(chunk)
+            last_key = merge_key(chunk[-1])
+
+    def reduce_run_filenames(self, run_filenames):
+        """merges neighbouring runs together until there are at most max_open_runs. Neighbours only, so the order
+        duplicates come out in (and so which one wins) doesn't change.
+
+        Parameters
+        ----------
+        run_filenames : list
+            every run, in input order.
+        """
+
+        merge_pass = 0
+        while len(run_filenames) > self.max_open_runs:
+            reduced_run_filenames = []
+            for group_number, group_start in enumerate(range(0, len(run_filenames), self.max_open_runs)):
+                group = run_filenames[group_start:group_start + self.max_open_runs]
+                if len(group) == 1:
+                    reduced_run_filenames.extend(group)
+                    continue
+                reduced_run_filename = os.path.join(self.run_directory,
+                                                    'pass_{}_{}.csv'.format(merge_pass, group_number))
+                with open(reduced_run_filename, 'w', newline='') as run_file:
+                    csv.writer(run_file).writerows(self.generate_merged_lines(group, deduplicate=False))
+                for run_filename in group:
+                    os.remove(run_filename)
+                reduced_run_filenames.append(reduced_run_filename)
+            run_filenames = reduced_run_filenames
+            merge_pass += 1
+        return run_filenames
+
+    def generate_merged_lines(self, run_filenames, deduplicate=True):
+        """k-way merges the runs, yielding the condensed lines in merge_key order.
+
+        heapq.merge takes equal lines from earlier runs first, so of a set of duplicates the last one out is from
+        the latest input - that's the one kept.
+
+        Parameters
+        ----------
+        run_filenames : list
+            the runs, in input order.
+        deduplicate : bool
+            False to keep duplicates (for the intermediate merges in reduce_run_filenames).
+        """
+
+        run_files = [open(run_filename, newline='') for run_filename in run_filenames]
+        try:
+            # each line's key is worked out once, and carried alongside it through the merge and the dedup
+            keyed_runs = [((merge_key(condensed_line), condensed_line) for condensed_line in csv.reader(run_file))
+                          for run_file in run_files]
+            previous_key = previous_line = None
+            for line_key, condensed_line in heapq.merge(*keyed_runs, key=operator.itemgetter(0)):
+                if not deduplicate:
+                    yield condensed_line
+                elif line_key != previous_key:
+                    if previous_line is not None:
+                        yield previous_line
+                    previous_key = line_key
+                previous_line = condensed_line
+            if deduplicate and previous_line is not None:
+                yield previous_line
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+
+def find_files_to_merge(input_paths):
+    """the files at each input path - a directory means every unified file and export in it, anything else is a
+    glob. Kept in the order given (and name order within each), since that decides which duplicate wins.
+
+    Parameters
+    ----------
+    input_paths : list
+        directories, files or glob patterns.
+    """
+
+    input_filenames = []
+    for input_path in input_paths:
+        if os.path.isdir(input_path):
+            input_filenames.extend(sorted(filename for filename in glob.glob(os.path.join(input_path, '*'))
+                                          if filename.lower().endswith(UnifyMerge.unified_file_extensions)))
+        else:
+            input_filenames.extend(sorted(filename for filename in glob.glob(input_path) if os.path.isfile(filename)))
+    return input_filenames
+
+
+def main(argv=None):
+    """command line entry point for merging. """
+
+    parser = argparse.ArgumentParser(description="Merge unified files and exports into one deduplicated unified "
+                                                 "dataset, ordered by create date, create time and sample name.")
+    parser.add_argument('input_paths', nargs='+',
+                        help="unified files, exports, directories of them or glob patterns - later ones win on "
+                             "duplicates")
+    parser.add_argument('-o', '--output-directory',
+                        default=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                        help="directory to write the merged file(s) to")
+    parser.add_argument('-n', '--name', default='unified_merge',
+                        help="name of the merged file, without an extension (default: unified_merge)")
+    parser.add_argument('-f', '--formats', default=None,
+                        help="comma separated outputs to write: xlsx, csv, parquet, arrow (default: xlsx)")
+    parser.add_argument('--run-size', type=int, default=100000,
+                        help="lines sorted in memory at a time (default: 100000)")
+    args = parser.parse_args(argv)
+    output_formats = None
+    if args.formats:
+        output_formats = [output_format.strip() for output_format in args.formats.split(',') if output_format.strip()]
+        for output_format in output_formats:
+            if output_format not in UnifyOutputPipeline.output_sink_formats:
+                parser.error("unknown output format {!r}, expected one of {}".format(
+                    output_format, ', '.join(UnifyOutputPipeline.output_sink_formats)))
+    input_filenames = find_files_to_merge(args.input_paths)
+    if not input_filenames:
+        parser.error("no files found to merge")
+    unify_merge = UnifyMerge(input_filenames, args.output_directory, args.name, output_formats, args.run_size)
+    try:
+        output_filenames = unify_merge.unify_merge_controller()
+    except (OSError, ValueError, ImportError) as exc:
+        print("merge failed: {}".format(exc))
+        return 1
+    print("{} files, {} lines merged into {} ({} duplicates dropped).".format(
+        len(input_filenames), unify_merge.rows_in, unify_merge.rows_out, unify_merge.rows_in - unify_merge.rows_out))
+    for output_filename in output_filenames:
+        print("  -> {}".format(output_filename))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
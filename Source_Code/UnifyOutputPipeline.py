@@ -0,0 +1,439 @@
+if __package__:
+    from .UnifiedExcelWriter import UnifiedExcelWriter
+    from .UnifiedParquetWriter import UnifiedParquetWriter
+    from .UnifiedTable import UnifiedTable
+    from .UnifiedSchema import typed_condensed_line
+else:
+    # run as a script from Source_Code
+    from UnifiedExcelWriter import UnifiedExcelWriter
+    from UnifiedParquetWriter import UnifiedParquetWriter
+    from UnifiedTable import UnifiedTable
+    from UnifiedSchema import typed_condensed_line
+import concurrent.futures
+import contextlib
+import itertools
+import queue
+import csv
+import os
+
+
+def unified_output_filename(unified_files_directory, batch_name, extension):
+    """the path of a unified file - the batch name in the output directory, with / swapped out so it stays one file.
+
+    Parameters
+    ----------
+    unified_files_directory : string
+        the directory the unified files are written to.
+    batch_name : string
+        the converter's main_file_name.
+    extension : string
+        e.g. '.xlsx'.
+    """
+
+    return os.path.join(unified_files_directory, str(batch_name).replace('/', '-') + extension)
+
+
+partial_filename_prefix = '.partial-'
+
+
+def partial_output_filename(filename):
+    """the name a sink writes filename under until it's finished, e.g. out/batch.xlsx -> out/.partial-batch.xlsx. """
+
+    directory, basename = os.path.split(filename)
+    return os.path.join(directory, partial_filename_prefix + basename)
+
+
+def finished_output_filename(partial_filename):
+    """the name a finished partial file is swapped in as - the reverse of partial_output_filename. """
+
+    directory, basename = os.path.split(partial_filename)
+    return os.path.join(directory, basename[len(partial_filename_prefix):])
+
+
+def remove_partial_files(partial_filenames):
+    """removes the partial files of a sink that didn't finish, leaving any earlier unified files alone. """
+
+    for partial_filename in partial_filenames:
+        if os.path.exists(partial_filename):
+            os.remove(partial_filename)
+
+
+@contextlib.contextmanager
+def replaced_when_finished(filename):
+    """for a with block writing filename - yields the partial name to write, and swaps it in over filename with
+    os.replace only if the block finishes. If it raises (the condensed lines stopped part way), the partial file is
+    removed and the last good filename is left as it was. Nothing is swapped in if nothing was written.
+
+    Parameters
+    ----------
+    filename : string
+        the unified file being written.
+    """
+
+    partial_filename = partial_output_filename(filename)
+    try:
+        yield partial_filename
+    except BaseException:
+        remove_partial_files([partial_filename])
+        raise
+    if os.path.exists(partial_filename):
+        os.replace(partial_filename, filename)
+
+
+class UnifyOutputAborted(Exception):
+    """the condensed lines stopped part way - the conversion producing them failed, or another sink did. Raised to
+    a sink in place of the rest of the lines, so it doesn't finish its output as if the batch was complete. """
+
+
+class ExcelOutputSink:
+    """xlsx output, through UnifiedExcelWriter. Takes typed condensed lines (see typed_lines).
+
+    Attributes
+    ----------
+    extension : string
+        added to the batch name to make the filename.
+    typed_lines : bool
+        True - the pipeline hands this sink its lines typed (see typed_condensed_line), not as text.
+    column_a_width : int
+        width of the data source column.
+    header_cell_formats : tuple
+        which header format (1, 2 or 3) each of the nine header cells gets.
+    roll_over_to : string
+        'sheet' or 'file' - where rows go once a sheet is full.
+    filenames_written : list
+        the workbooks the last write_condensed_lines swapped in - more than one if it rolled over to new files.
+    """
+
+    extension = '.xlsx'
+    typed_lines = True
+
+    def __init__(self, column_a_width=50, header_cell_formats=(1, 2, 2, 2, 2, 3, 3, 3, 3), roll_over_to='sheet'):
+        self.column_a_width = column_a_width
+        self.header_cell_formats = header_cell_formats
+        self.roll_over_to = roll_over_to
+        self.filenames_written = []
+
+    def write_condensed_lines(self, filename, condensed_lines):
+        """writes the condensed lines (header first) to filename. Each workbook is written under its partial name,
+        and only swapped in once every line has been written. """
+
+        unified_excel_writer = UnifiedExcelWriter(partial_output_filename(filename),
+                                                  column_a_width=self.column_a_width,
+                                                  header_cell_formats=self.header_cell_formats,
+                                                  roll_over_to=self.roll_over_to)
+        try:
+            unified_excel_writer.write_condensed_lines(condensed_lines)
+        except BaseException:
+            remove_partial_files(unified_excel_writer.filenames_written)
+            raise
+        # rolled over workbooks too - batch.xlsx, batch_2.xlsx...
+        self.filenames_written = []
+        for partial_filename in unified_excel_writer.filenames_written:
+            os.replace(partial_filename, finished_output_filename(partial_filename))
+            self.filenames_written.append(finished_output_filename(partial_filename))
+
+
+class CsvOutputSink:
+    """unformatted csv output, with python's built in csv library.
+
+    Attributes
+    ----------
+    extension : string
+        added to the batch name to make the filename.
+    """
+
+    extension = '.csv'
+
+    def write_condensed_lines(self, filename, condensed_lines):
+        """writes the condensed lines (header first) to filename, swapping it in once they're all written. """
+
+        with replaced_when_finished(filename) as partial_filename:
+            with open(partial_filename, 'w', newline='') as csv_file:
+                csv.writer(csv_file).writerows(condensed_lines)
+
+
+class ParquetOutputSink:
+    """typed parquet (or arrow) output, through UnifiedParquetWriter. Needs pyarrow.
+
+    Attributes
+    ----------
+    file_format : string
+        'parquet' or 'arrow'.
+    extension : string
+        added to the batch name to make the filename.
+    """
+
+    def __init__(self, file_format='parquet'):
+        self.file_format = file_format
+        self.extension = '.' + file_format
+
+    def write_condensed_lines(self, filename, condensed_lines):
+        """writes the condensed lines (header first) to filename, swapping it in once they're all written. """
+
+        with replaced_when_finished(filename) as partial_filename:
+            UnifiedParquetWriter(partial_filename, file_format=self.file_format).write_condensed_lines(condensed_lines)
+
+
+class DatabaseOutputSink:
+    """upserts into a database table through a UnifiedDatabaseSink. No file is written.
+
+    Attributes
+    ----------
+    database_sink : UnifiedDatabaseSink
+        the table (and connection pool) to load into.
+    extension : None
+        no file, so no filename.
+    """
+
+    extension = None
+
+    def __init__(self, database_sink):
+        self.database_sink = database_sink
+
+    def write_condensed_lines(self, filename, condensed_lines):
+        """upserts the condensed lines (header first). filename isn't used. """
+
+        self.database_sink.write_condensed_lines(condensed_lines)
+
+
+class UnifyOutputPipeline:
+    """Feeds the condensed lines to several outputs (xlsx, csv, parquet, a database...) in a single pass.
+
+    The condensed lines are only iterated once, so a streaming conversion can go to every output without being held
+    in memory. Lines are handed out chunk_size at a time: each sink runs on its own thread, reading chunks off its own
+    queue, which holds at most queue_chunks chunks - a slow sink holds the producer back rather than letting the
+    queue grow. Sinks that spend their time waiting on I/O (the T drive, a database server) then overlap, so several
+    outputs take about as long as the slowest one. With a single sink no threads are used at all.
+
+    Sinks with typed_lines set (the xlsx one) are handed the lines typed rather than as text - dates as dates,
+    numbers as floats. They're typed here, once per chunk however many sinks take them, or for a UnifiedTable by the
+    table itself, once per distinct value. The other sinks get the text the converter produced, so the csv file keeps
+    the values exactly as the instrument exported them.
+
+    File sinks write under a partial name (see replaced_when_finished), and only swap their file in once every line
+    has been written. If the condensed lines stop part way - the converter producing them raises, or a sink fails -
+    the other sinks are sent aborted_lines instead of end_of_lines, so they give up rather than finishing a truncated
+    file over the last good one. The error (the converter's, or the failed sink's) is raised once every thread has
+    finished.
+
+    Attributes
+    ----------
+    unified_files_directory : string
+        the directory the unified files are written to.
+    output_sinks : list
+        the sinks - anything with an extension attribute and a write_condensed_lines(filename, lines) method. Sinks
+        with no extension don't write a file, and are passed the batch's path without one. Sinks with a true
+        typed_lines attribute are passed typed lines.
+    chunk_size : int
+        condensed lines per chunk handed to the sinks.
+    queue_chunks : int
+        the most chunks waiting for any one sink.
+    """
+
+    output_sink_formats = {'xlsx': ExcelOutputSink,
+                           'csv': CsvOutputSink,
+                           'parquet': lambda: ParquetOutputSink('parquet'),
+                           'arrow': lambda: ParquetOutputSink('arrow')}
+    end_of_lines = None
+    aborted_lines = object()
+
+    def __init__(self, unified_files_directory, output_sinks, chunk_size=1000, queue_chunks=8):
+        """
+        Parameters
+        ----------
+        unified_files_directory : string
+            the directory the unified files are written to.
+        output_sinks : list
+            sink objects, or the names in output_sink_formats ('xlsx', 'csv', 'parquet', 'arrow').
+        chunk_size : int
+            condensed lines per chunk handed to the sinks.
+        queue_chunks : int
+            the most chunks waiting for any one sink.
+
+        Raises
+        ------
+        ValueError
+            no sinks were given, or one of the names isn't in output_sink_formats.
+        """
+
+        if not output_sinks:
+            raise ValueError("at least one output sink is needed")
+        self.unified_files_directory = unified_files_directory
+        self.output_sinks = [self.output_sink_for_format(output_sink) for output_sink in output_sinks]
+        self.chunk_size = chunk_size
+        self.queue_chunks = queue_chunks
+
+    @classmethod
+    def output_sink_for_format(cls, output_format):
+        """the sink for a format name, or the sink itself if it already is one.
+
+        Raises
+        ------
+        ValueError
+            the name isn't in output_sink_formats.
+        """
+
+        if not isinstance(output_format, str):
+            return output_format
+        if output_format not in cls.output_sink_formats:
+            raise ValueError("unknown output format {!r}, expected one of {}".format(
+                output_format, ', '.join(cls.output_sink_formats)))
+        return cls.output_sink_formats[output_format]()
+
+    def write_condensed_lines(self, batch_name, condensed_lines):
+        """writes the condensed lines (header first) to every sink, in one pass.
+
+        Parameters
+        ----------
+        batch_name : string
+            the converter's main_file_name, which the filenames are made from.
+        condensed_lines : iterable(list) or UnifiedTable
+            the header, followed by the condensed data lines - or a table, which gives its own (and types them).
+
+        Returns
+        -------
+        list
+            the files written, in sink order (sinks that don't write a file are left out). A workbook that rolled
+            over to new files is followed by the rest of them.
+        """
+
+        os.makedirs(self.unified_files_directory, exist_ok=True)
+        # sinks that don't write a file get the batch's path without an extension, so they can still tell which
+        # batch the lines are from
+        filenames = [unified_output_filename(self.unified_files_directory, batch_name, output_sink.extension or '')
+                     for output_sink in self.output_sinks]
+        if len(self.output_sinks) == 1:
+            self.output_sinks[0].write_condensed_lines(filenames[0],
+                                                       self.sink_condensed_lines(self.output_sinks[0], condensed_lines))
+        else:
+            self.fan_out_condensed_lines(filenames, condensed_lines)
+        return [written_filename for filename, output_sink in zip(filenames, self.output_sinks)
+                if output_sink.extension is not None
+                for written_filename in getattr(output_sink, 'filenames_written', None) or [filename]]
+
+    @staticmethod
+    def sink_condensed_lines(output_sink, condensed_lines):
+        """the lines for one sink - typed if it takes typed lines, text otherwise.
+
+        Parameters
+        ----------
+        output_sink : object
+            the sink.
+        condensed_lines : iterable(list) or UnifiedTable
+            the header, followed by the condensed data lines.
+        """
+
+        typed_lines = getattr(output_sink, 'typed_lines', False)
+        if isinstance(condensed_lines, UnifiedTable):
+            return condensed_lines.typed_condensed_lines() if typed_lines else condensed_lines.condensed_lines()
+        return map(typed_condensed_line, condensed_lines) if typed_lines else condensed_lines
+
+    def condensed_line_chunks(self, condensed_lines):
+        """yields the lines chunk_size at a time, as (text chunk, typed chunk). A chunk no sink takes is None - so
+        each chunk is typed once, and only if a sink wants it typed.
+
+        Parameters
+        ----------
+        condensed_lines : iterable(list) or UnifiedTable
+            the header, followed by the condensed data lines.
+        """
+
+        typed_sinks = [getattr(output_sink, 'typed_lines', False) for output_sink in self.output_sinks]
+        text_lines = typed_lines = None
+        if isinstance(condensed_lines, UnifiedTable):
+            if not all(typed_sinks):
+                text_lines = condensed_lines.condensed_lines()
+            if any(typed_sinks):
+                typed_lines = condensed_lines.typed_condensed_lines()
+        else:
+            text_lines = iter(condensed_lines)
+        while True:
+            text_chunk = typed_chunk = None
+            if text_lines is not None:
+                text_chunk = list(itertools.islice(text_lines, self.chunk_size))
+            if typed_lines is not None:
+                typed_chunk = list(itertools.islice(typed_lines, self.chunk_size))
+            elif any(typed_sinks):
+                typed_chunk = [typed_condensed_line(condensed_line) for condensed_line in text_chunk]
+            if not text_chunk and not typed_chunk:
+                return
+            yield text_chunk if not all(typed_sinks) else None, typed_chunk
+
+    def fan_out_condensed_lines(self, filenames, condensed_lines):
+        """runs every sink on its own thread, and feeds them all chunks of the condensed lines.
+
+        Parameters
+        ----------
+        filenames : list
+            the file each sink writes, in sink order.
+        condensed_lines : iterable(list) or UnifiedTable
+            the header, followed by the condensed data lines.
+        """
+
+        sink_queues = [queue.Queue(self.queue_chunks) for _ in self.output_sinks]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.output_sinks)) as executor:
+            sink_futures = [executor.submit(self.run_output_sink, output_sink, filename, sink_queue)
+                            for output_sink, filename, sink_queue in zip(self.output_sinks, filenames, sink_queues)]
+            typed_sinks = [getattr(output_sink, 'typed_lines', False) for output_sink in self.output_sinks]
+            last_chunk = self.aborted_lines
+            try:
+                for text_chunk, typed_chunk in self.condensed_line_chunks(condensed_lines):
+                    if any(sink_future.done() for sink_future in sink_futures):
+                        # a sink has failed - no point making the rest wait for lines that won't be used
+                        break
+                    for sink_queue, typed_sink in zip(sink_queues, typed_sinks):
+                        sink_queue.put(typed_chunk if typed_sink else text_chunk)
+                else:
+                    last_chunk = self.end_of_lines
+            finally:
+                # raising here (the converter failed) waits for the sinks to give up before the error carries on
+                for sink_queue in sink_queues:
+                    sink_queue.put(last_chunk)
+        # the failed sink's own error, rather than the aborts it caused in the others
+        sink_errors = [sink_future.exception() for sink_future in sink_futures]
+        for sink_error in sink_errors:
+            if sink_error is not None and not isinstance(sink_error, UnifyOutputAborted):
+                raise sink_error
+        for sink_error in sink_errors:
+            if sink_error is not None:
+                raise sink_error
+
+    def run_output_sink(self, output_sink, filename, sink_queue):
+        """one sink's thread - writes the chunks off its queue, then keeps draining it if the sink fails, so the
+        producer is never left blocked on a full queue.
+
+        Parameters
+        ----------
+        output_sink : object
+            the sink.
+        filename : string
+            the file it writes.
+        sink_queue : queue.Queue
+            its chunks, ending with end_of_lines, or aborted_lines if the lines stopped part way.
+
+        Raises
+        ------
+        UnifyOutputAborted
+            the lines stopped part way.
+        """
+
+        def queued_condensed_lines():
+            while True:
+                chunk = sink_queue.get()
+                if chunk is self.end_of_lines:
+                    return
+                if chunk is self.aborted_lines:
+                    raise UnifyOutputAborted("the condensed lines for {} stopped part way".format(filename))
+                yield from chunk
+
+        condensed_lines = queued_condensed_lines()
+        try:
+            output_sink.write_condensed_lines(filename, condensed_lines)
+        finally:
+            # the sink may stop early (an error, or an empty batch) - the producer still needs its puts to go through
+            try:
+                for _ in condensed_lines:
+                    pass
+            except UnifyOutputAborted:
+                # the sink's own error, if it had one, is the one to raise
+                pass
@@ -0,0 +1,390 @@
+if __package__:
+    from .UnifyBatch import UnifyBatch, unify_single_file, conversion_cache_key, default_cache_index_filename
+    from .UnifyFormatRegistry import unify_format_registry
+    from .UnifyOutputPipeline import UnifyOutputPipeline
+    from .UnifyCache import UnifyCache
+    from .UnifyIndex import UnifyIndex, indexed_output_formats, default_index_filename
+else:
+    # run as a script from Source_Code
+    from UnifyBatch import UnifyBatch, unify_single_file, conversion_cache_key, default_cache_index_filename
+    from UnifyFormatRegistry import unify_format_registry
+    from UnifyOutputPipeline import UnifyOutputPipeline
+    from UnifyCache import UnifyCache
+    from UnifyIndex import UnifyIndex, indexed_output_formats, default_index_filename
+import concurrent.futures
+import collections
+import threading
+import argparse
+import tempfile
+import sqlite3
+import shutil
+import time
+import os
+
+
+class UnifyPrefetch(UnifyBatch):
+    """Unifies a batch of exports on the network share with the share's latency hidden behind the conversions.
+
+    Converting straight off the T drive means every file waits on the share twice - reading the export, then writing
+    the unified files - while the CPU sits idle, and then the CPU works while the share does. Here the three overlap:
+
+    - reader threads copy the next prefetch_count exports to local temp space while the current one is converted
+    - each file is converted from its local copy into its own local output directory, with unify_single_file, so
+      every pathway (projected csv reads, XML, the output pipeline) runs exactly as it does from the share
+    - upload threads copy the finished unified files to the share and swap each one in with os.replace, so the
+      share never has a half-written file under its real name
+
+    so a batch takes about as long as the slower of the I/O and the conversions, rather than the two added up. Files
+    are converted one at a time, in order - when the share isn't the bottleneck, UnifyBatch's process pool is still
+    the faster way to do a big batch.
+
+    The cache and index behave as they do in UnifyBatch, against the files' final places on the share. For testing,
+    simulated_latency and simulated_bandwidth slow every copy to and from the share down, so a local directory can
+    stand in for a slow one.
+
+    Attributes
+    ----------
+    prefetch_count : int
+        exports copied ahead of the one being converted. 0 reads, converts and uploads each file in turn.
+    upload_workers : int
+        threads uploading finished files. 0 uploads each file before the next conversion starts.
+    local_directory : string
+        where the local copies and outputs go. None for the system temp directory.
+    simulated_latency : float
+        seconds added to every copy to or from the share.
+    simulated_bandwidth : float
+        bytes per second every copy to or from the share is held to. None for no limit.
+    download_seconds : float
+        time spent copying exports from the share, summed over the reader threads.
+    convert_seconds : float
+        time spent converting.
+    upload_seconds : float
+        time spent copying unified files to the share, summed over the upload threads.
+    wall_seconds : float
+        how long the whole batch took.
+    """
+
+    def __init__(self, input_path,
+                 unified_files_directory=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                 prefetch_count=4, upload_workers=2, streaming=False, cache_index_filename=None, output_formats=None,
+                 index_filename=None, local_directory=None, simulated_latency=0.0, simulated_bandwidth=None):
+        """
+        Parameters
+        ----------
+        input_path : string
+            a directory of files to unify, or a glob pattern matching them.
+        unified_files_directory : string
+            the directory the unified files are written to.
+        prefetch_count : int
+            exports copied ahead of the one being converted. 0 for none.
+        upload_workers : int
+            threads uploading finished files. 0 to upload each file before converting the next.
+        streaming : bool
+            True to stream each file through its converter a row at a time.
+        cache_index_filename : string
+            the UnifyCache index to use, or None for no cache.
+        output_formats : list
+            the outputs written for each file. None for just the excel file.
+        index_filename : string
+            the UnifyIndex to add the converted results to, or None for no index.
+        local_directory : string
+            where the local copies and outputs go. None for the system temp directory.
+        simulated_latency : float
+            seconds added to every copy to or from the share.
+        simulated_bandwidth : float
+            bytes per second every copy to or from the share is held to. None for no limit.
+        """
+
+        super().__init__(input_path, unified_files_directory, 1, streaming, cache_index_filename, output_formats,
+                         index_filename=index_filename)
+        self.prefetch_count = prefetch_count
+        self.upload_workers = upload_workers
+        self.local_directory = local_directory
+        self.simulated_latency = simulated_latency
+        self.simulated_bandwidth = simulated_bandwidth
+        self.download_seconds = 0.0
+        self.convert_seconds = 0.0
+        self.upload_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.timings_lock = threading.Lock()
+
+    def unify_prefetch_controller(self):
+        """main function for the class. Returns True if every file was unified. """
+
+        start_time = time.perf_counter()
+        self.find_files_to_unify()
+        self.run_prefetch_pipeline()
+        self.wall_seconds = time.perf_counter() - start_time
+        self.print_batch_summary()
+        self.write_batch_metrics()
+        print("{:.2f}s wall - {:.2f}s reading from the share, {:.2f}s converting, {:.2f}s writing to the share".format(
+            self.wall_seconds, self.download_seconds, self.convert_seconds, self.upload_seconds))
+        return all(result['success'] for result in self.batch_results)
+
+    def run_prefetch_pipeline(self):
+        """reads ahead, converts and uploads every file, overlapping the three. Fills in batch_results. """
+
+        self.batch_results = []
+        os.makedirs(self.unified_files_directory, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix='unify_prefetch_', dir=self.local_directory) as local_directory, \
+                concurrent.futures.ThreadPoolExecutor(max(self.prefetch_count, 1)) as download_executor, \
+                concurrent.futures.ThreadPoolExecutor(max(self.upload_workers, 1)) as upload_executor:
+            files_to_download = iter(enumerate(self.files_to_unify))
+            downloads = collections.deque()
+            upload_futures = []
+            while True:
+                # keep prefetch_count files reading ahead of the one about to be converted
+                while len(downloads) <= self.prefetch_count:
+                    file_number, filename = next(files_to_download, (None, None))
+                    if filename is None:
+                        break
+                    file_directory = os.path.join(local_directory, str(file_number))
+                    downloads.append((filename, file_directory,
+                                      download_executor.submit(self.download_input, filename, file_directory)))
+                if not downloads:
+                    break
+                filename, file_directory, download_future = downloads.popleft()
+                try:
+                    local_input_filename = download_future.result()
+                except OSError as exc:
+                    self.finish_result(self.failed_result(filename, "couldn't read it: {}".format(exc)))
+                    continue
+                result, cache_key = self.convert_local_copy(filename, local_input_filename,
+                                                            os.path.join(file_directory, 'unified'))
+                if not result['success'] or result['cached']:
+                    self.finish_result(result)
+                    shutil.rmtree(file_directory, ignore_errors=True)
+                elif self.upload_workers:
+                    upload_futures.append(upload_executor.submit(self.upload_outputs, result, cache_key,
+                                                                 file_directory))
+                else:
+                    self.upload_outputs(result, cache_key, file_directory)
+            for upload_future in upload_futures:
+                # upload_outputs reports its own failures, so this only raises for a bug - which shouldn't go unseen
+                upload_future.result()
+        # finished in upload order, the summary reads better in file order
+        self.batch_results.sort(key=lambda result: result['filename'])
+
+    def download_input(self, filename, file_directory):
+        """copies an export from the share to local temp space. Runs on a reader thread. Returns the local copy.
+
+        Parameters
+        ----------
+        filename : string
+            the export on the share.
+        file_directory : string
+            the local directory for this file.
+        """
+
+        start_time = time.perf_counter()
+        os.makedirs(file_directory, exist_ok=True)
+        local_input_filename = os.path.join(file_directory, os.path.basename(filename))
+        self.simulate_share_delay(os.path.getsize(filename))
+        shutil.copyfile(filename, local_input_filename)
+        self.add_seconds('download_seconds', time.perf_counter() - start_time)
+        return local_input_filename
+
+    def convert_local_copy(self, filename, local_input_filename, local_output_directory):
+        """converts the local copy of an export into local_output_directory, unless the cache already has it.
+
+        Parameters
+        ----------
+        filename : string
+            the export on the share, which the result is reported under.
+        local_input_filename : string
+            its local copy.
+        local_output_directory : string
+            where the unified files are written before they're uploaded.
+
+        Returns
+        -------
+        tuple
+            the result (as from unify_single_file, with output_filename where it will be on the share), and the
+            cache key to store once it's uploaded, or None.
+        """
+
+        start_time = time.perf_counter()
+        try:
+            unify_format = unify_format_registry.detect_format(local_input_filename)
+        except (ValueError, OSError) as exc:
+            return self.failed_result(filename, str(exc)), None
+        cache_key = None
+        if self.cache_index_filename is not None:
+            # the key is a hash of the bytes, so the local copy gives the same one as the share's
+            unify_cache = UnifyCache(self.cache_index_filename)
+            cache_key = conversion_cache_key(unify_cache, local_input_filename, self.unified_files_directory,
+                                             unify_format, self.output_formats)
+            cached_output_filenames = unify_cache.cached_output_filenames(cache_key)
+            if cached_output_filenames is not None:
+                result = self.failed_result(filename, '')
+                result.update(success=True, cached=True, pathway=unify_format.name,
+                              output_filename=cached_output_filenames[0], output_filenames=cached_output_filenames)
+                if self.index_filename is not None:
+                    index_message = UnifyIndex(self.index_filename).index_unified_file_if_missing(
+                        result['output_filename'])
+                    if index_message:
+                        result['message'] = "cached, but not indexed: {}".format(index_message)
+                result['seconds'] = time.perf_counter() - start_time
+                return result, None
+        output_formats = self.output_formats
+        index_output_sink = None
+        if self.index_filename is not None:
+            # indexed under where the files will be on the share, not the local directory they're written to
+            output_formats, index_output_sink = indexed_output_formats(output_formats, self.index_filename,
+                                                                       self.unified_files_directory)
+        result = unify_single_file(local_input_filename, local_output_directory, self.streaming, None,
+                                   unify_format.name, output_formats, self.instrumented(), self.profile_directory)
+        result['filename'] = filename
+        if result['success']:
+            result['output_filename'] = os.path.join(self.unified_files_directory,
+                                                     os.path.basename(result['output_filename']))
+            result['output_filenames'] = [os.path.join(self.unified_files_directory, os.path.basename(output_filename))
+                                          for output_filename in result['output_filenames']]
+            if index_output_sink is not None and index_output_sink.error is not None:
+                result['message'] = "converted, but not indexed: {}".format(index_output_sink.error)
+        self.add_seconds('convert_seconds', time.perf_counter() - start_time)
+        return result, cache_key
+
+    def upload_outputs(self, result, cache_key, file_directory):
+        """copies every unified file a conversion wrote to the share, each under a temporary name that's then swapped
+        for the real one, and removes the local copies. Runs on an upload thread, or inline with no upload workers.
+
+        Parameters
+        ----------
+        result : dict
+            the conversion's result.
+        cache_key : string
+            stored in the cache once the files are there, or None.
+        file_directory : string
+            the local directory for this file - its unified files are in the 'unified' directory under it.
+        """
+
+        start_time = time.perf_counter()
+        local_output_directory = os.path.join(file_directory, 'unified')
+        try:
+            for output_basename in sorted(os.listdir(local_output_directory)):
+                local_output_filename = os.path.join(local_output_directory, output_basename)
+                output_filename = os.path.join(self.unified_files_directory, output_basename)
+                self.simulate_share_delay(os.path.getsize(local_output_filename))
+                # named for this file, so two uploads of the same batch name can't write over each other's copy
+                uploading_filename = '{}.{}.uploading'.format(output_filename, os.path.basename(file_directory))
+                shutil.copyfile(local_output_filename, uploading_filename)
+                os.replace(uploading_filename, output_filename)
+            if cache_key is not None:
+                UnifyCache(self.cache_index_filename).store(cache_key, result['filename'], result['output_filenames'])
+        except Exception as exc:
+            # anything at all - on an upload thread, an exception that got past here would never be seen
+            result.update(success=False, message="converted, but couldn't be written to the share: {}".format(exc))
+            self.remove_unuploaded_batch_from_index(result)
+        finally:
+            shutil.rmtree(file_directory, ignore_errors=True)
+        self.add_seconds('upload_seconds', time.perf_counter() - start_time)
+        self.finish_result(result)
+
+    def remove_unuploaded_batch_from_index(self, result):
+        """takes a batch back out of the index when its files didn't make it to the share. It was indexed under
+        its place on the share while it was converted, so otherwise the index would point at files that were never
+        written.
+
+        Parameters
+        ----------
+        result : dict
+            the conversion's result, with output_filename where it would have been on the share.
+        """
+
+        if self.index_filename is None or not result['output_filename']:
+            return
+        try:
+            UnifyIndex(self.index_filename).remove_batch(os.path.splitext(result['output_filename'])[0])
+        except sqlite3.Error as exc:
+            result['message'] += " (and couldn't be taken out of the index: {})".format(exc)
+
+    def failed_result(self, filename, message):
+        """a result for a file that wasn't converted, shaped like unify_single_file's. """
+
+        return {'filename': filename, 'success': False, 'cached': False, 'pathway': '', 'output_filename': '',
+                'output_filenames': [], 'message': message, 'seconds': 0.0, 'phases': []}
+
+    def finish_result(self, result):
+        """adds a file's result to batch_results and prints its line. Called from any of the threads. """
+
+        with self.timings_lock:
+            self.batch_results.append(result)
+        status = 'cached' if result['cached'] else 'ok    ' if result['success'] else 'FAILED'
+        print("{} {} ({:.2f}s)".format(status, result['filename'], result['seconds']))
+
+    def add_seconds(self, timing_name, seconds):
+        """adds to one of the summed timings. Called from any of the threads. """
+
+        with self.timings_lock:
+            setattr(self, timing_name, getattr(self, timing_name) + seconds)
+
+    def simulate_share_delay(self, byte_count):
+        """sleeps as long as simulated_latency and simulated_bandwidth say a copy of byte_count bytes would take.
+
+        Parameters
+        ----------
+        byte_count : int
+            the size of the file being copied.
+        """
+
+        delay = self.simulated_latency
+        if self.simulated_bandwidth:
+            delay += byte_count / self.simulated_bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+
+def main(argv=None):
+    """command line entry point for unifying a batch off the network share. """
+
+    parser = argparse.ArgumentParser(description="Unify a directory (or glob) of exports on a slow share, reading "
+                                                 "ahead and uploading in the background.")
+    parser.add_argument('input_path',
+                        help="directory of .csv/.xml files to unify, or a glob pattern such as 'exports/*.csv'")
+    parser.add_argument('-o', '--output-directory',
+                        default=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                        help="directory to write the unified files to")
+    parser.add_argument('-n', '--prefetch', type=int, default=4,
+                        help="exports to read ahead of the one being converted (default 4, 0 for none)")
+    parser.add_argument('-u', '--upload-workers', type=int, default=2,
+                        help="threads writing unified files to the share (default 2, 0 to write each one before "
+                             "converting the next)")
+    parser.add_argument('-s', '--streaming', action='store_true',
+                        help="stream rows through the converters instead of reading each file into memory first")
+    parser.add_argument('-f', '--formats', default=None,
+                        help="comma separated outputs to write in one pass: xlsx, csv, parquet, arrow (default: xlsx)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="convert every file, even ones already converted with the same contents")
+    parser.add_argument('--no-index', action='store_true',
+                        help="don't add the converted results to the index UnifyIndex.py queries")
+    parser.add_argument('--local-directory', default=None,
+                        help="fast local directory for the copies and outputs (default: the system temp directory)")
+    parser.add_argument('--simulate-latency', type=float, default=0.0,
+                        help="seconds to add to every copy to or from the share, for testing")
+    parser.add_argument('--simulate-bandwidth', type=float, default=None,
+                        help="MB/s to hold every copy to or from the share to, for testing")
+    args = parser.parse_args(argv)
+    output_formats = None
+    if args.formats:
+        output_formats = [output_format.strip() for output_format in args.formats.split(',') if output_format.strip()]
+        for output_format in output_formats:
+            if output_format not in UnifyOutputPipeline.output_sink_formats:
+                parser.error("unknown output format {!r}, expected one of {}".format(
+                    output_format, ', '.join(UnifyOutputPipeline.output_sink_formats)))
+    cache_index_filename = None
+    if not args.no_cache:
+        cache_index_filename = os.path.join(args.output_directory, default_cache_index_filename)
+    index_filename = None
+    if not args.no_index:
+        index_filename = os.path.join(args.output_directory, default_index_filename)
+    simulated_bandwidth = args.simulate_bandwidth * 1024 * 1024 if args.simulate_bandwidth else None
+    all_succeeded = UnifyPrefetch(args.input_path, args.output_directory, args.prefetch, args.upload_workers,
+                                  args.streaming, cache_index_filename, output_formats, index_filename,
+                                  args.local_directory, args.simulate_latency,
+                                  simulated_bandwidth).unify_prefetch_controller()
+    return 0 if all_succeeded else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,25 +1,203 @@
-from AgilentUnify import AgilentUnify
-from WatersUnify import WatersUnify
+if __package__:
+    from .UnifyBatch import unify_pathway_decider
+    from .UnifyFormatRegistry import unify_format_registry
+    from .UnifyInstrumentation import UnifyInstrumentation
+    from .UnifyIndex import indexed_output_formats, default_index_filename
+else:
+    # run as a script from Source_Code
+    from UnifyBatch import unify_pathway_decider
+    from UnifyFormatRegistry import unify_format_registry
+    from UnifyInstrumentation import UnifyInstrumentation
+    from UnifyIndex import indexed_output_formats, default_index_filename
 import tkinter as Tk
 from tkinter import filedialog
+import threading
+import queue
+import time
 import csv
+import os
+
+
+class UnifyCancelled(Exception):
+    """raised inside the worker thread when the cancel button is pressed. """
+
+
+class UnifyProgress:
+    """Wraps the rows going into a converter, so the worker thread can report progress and notice a cancel.
+
+    Attributes
+    ----------
+    csv_file_rows : iterable(list)
+        the rows being converted.
+    total_rows : int
+        how many rows there are, for the ETA.
+    post_progress : function
+        called with a progress message every report_interval seconds. Must be thread-safe.
+    cancel_event : threading.Event
+        set by the cancel button.
+    report_interval : float
+        seconds between progress messages.
+    """
+
+    def __init__(self, csv_file_rows, total_rows, post_progress, cancel_event, report_interval=0.5):
+        """
+        Parameters
+        ----------
+        csv_file_rows : iterable(list)
+            the rows being converted.
+        total_rows : int
+            how many rows there are, for the ETA.
+        post_progress : function
+            called with a progress message every report_interval seconds.
+        cancel_event : threading.Event
+            set by the cancel button.
+        report_interval : float
+            seconds between progress messages.
+        """
+
+        self.csv_file_rows = csv_file_rows
+        self.total_rows = total_rows
+        self.post_progress = post_progress
+        self.cancel_event = cancel_event
+        self.report_interval = report_interval
+
+    def __iter__(self):
+        start_time = last_report_time = time.monotonic()
+        rows_processed = 0
+        for item in self.csv_file_rows:
+            yield item
+            rows_processed += 1
+            # checking the clock every row costs more than the rest of this loop, so only every 256th
+            if rows_processed % 256 == 0:
+                if self.cancel_event.is_set():
+                    raise UnifyCancelled()
+                now = time.monotonic()
+                if now - last_report_time >= self.report_interval:
+                    last_report_time = now
+                    self.post_progress(self.progress_message(rows_processed, now - start_time))
+        self.post_progress(self.progress_message(rows_processed, time.monotonic() - start_time))
+
+    def progress_message(self, rows_processed, elapsed_seconds):
+        """rows processed, rows/s and ETA as one line of text. """
+
+        rows_per_second = rows_processed / elapsed_seconds if elapsed_seconds > 0 else 0
+        if rows_per_second and self.total_rows > rows_processed:
+            eta = "ETA {:.0f}s".format((self.total_rows - rows_processed) / rows_per_second)
+        else:
+            eta = "done"
+        return "{:,} / {:,} rows, {:,.0f} rows/s, {}\n".format(rows_processed, self.total_rows, rows_per_second, eta)
+
+
+class UnifyProgressFile:
+    """Wraps an export read straight from the file (the TargetLynx XML) the way UnifyProgress wraps csv rows - the
+    converter reads it through read(), so progress is reported in bytes read and a cancel is noticed between reads.
+
+    Attributes
+    ----------
+    binary_file : file object
+        the export, opened in binary mode.
+    total_bytes : int
+        the size of the file, for the ETA.
+    post_progress : function
+        called with a progress message every report_interval seconds. Must be thread-safe.
+    cancel_event : threading.Event
+        set by the cancel button.
+    report_interval : float
+        seconds between progress messages.
+    """
+
+    def __init__(self, binary_file, total_bytes, post_progress, cancel_event, report_interval=0.5):
+        """
+        Parameters
+        ----------
+        binary_file : file object
+            the export, opened in binary mode.
+        total_bytes : int
+            the size of the file, for the ETA.
+        post_progress : function
+            called with a progress message every report_interval seconds.
+        cancel_event : threading.Event
+            set by the cancel button.
+        report_interval : float
+            seconds between progress messages.
+        """
+
+        self.binary_file = binary_file
+        self.total_bytes = total_bytes
+        self.post_progress = post_progress
+        self.cancel_event = cancel_event
+        self.report_interval = report_interval
+        self.bytes_read = 0
+        self.start_time = self.last_report_time = time.monotonic()
+
+    def read(self, size=-1):
+        """reads from the file, posting progress as it goes. iterparse reads 16KB at a time.
+
+        Raises
+        ------
+        UnifyCancelled
+            the cancel button has been pressed.
+        """
+
+        if self.cancel_event.is_set():
+            raise UnifyCancelled()
+        data = self.binary_file.read(size)
+        self.bytes_read += len(data)
+        now = time.monotonic()
+        if not data or now - self.last_report_time >= self.report_interval:
+            self.last_report_time = now
+            self.post_progress(self.progress_message(now - self.start_time))
+        return data
+
+    def progress_message(self, elapsed_seconds):
+        """MB read, MB/s and ETA as one line of text. """
+
+        megabytes_read = self.bytes_read / (1024 * 1024)
+        megabytes_per_second = megabytes_read / elapsed_seconds if elapsed_seconds > 0 else 0
+        if megabytes_per_second and self.total_bytes > self.bytes_read:
+            eta = "ETA {:.0f}s".format((self.total_bytes - self.bytes_read) / (1024 * 1024) / megabytes_per_second)
+        else:
+            eta = "done"
+        return "{:,.1f} / {:,.1f} MB, {:,.1f} MB/s, {}\n".format(megabytes_read, self.total_bytes / (1024 * 1024),
+                                                                megabytes_per_second, eta)
 
 
 class UnifyTK(Tk.Frame):
     """Runs the tk window that allows the user to interact with UnifyMB.
 
+    Conversion happens on a worker thread so the window stays responsive. The worker never touches Tk - it puts
+    messages on log_queue, and the Tk main loop drains that queue into the console log view every 100ms.
+
     Attributes
     ----------
     filename : string
-        the filename of the file to unify.
+        the filename of the file being unified.
     csv_file_in_list_format : list
         the csv file to unify, as a list of lists, produced by csv.reader
     files_to_unify_directory : string
         the directory that the files to unify are in.
     browse_directory_button : Tk.Button
-        opens up to the directory the files to unify are in.
+        opens up to the directory the files to unify are in. Several files can be picked at once.
+    cancel_button : Tk.Button
+        cancels the file being unified, and any still queued.
     unify_tk_console_log_view : Tk.text
         text box for displaying error messages and log messages in the GUI.
+    files_to_unify_queue : queue.Queue
+        files picked but not unified yet.
+    log_queue : queue.Queue
+        (message type, text, with_delete) from the worker thread, waiting to be shown.
+    cancel_event : threading.Event
+        the current run's - set by the cancel button, checked by the worker thread. Files picked after a cancel are
+        a new run, with a new event, so a cancelled run still finishing can't cancel them too.
+    worker_thread : threading.Thread
+        the thread unifying files, or None.
+    worker_lock : threading.Lock
+        held while files are queued and while the worker decides whether to stop, so files picked just as it stops
+        are never left in the queue.
+    unify_instrumentation : UnifyInstrumentation
+        the phase timings of the file being unified. Summarised in the log once it's done.
+    metrics_json_filename : string
+        a JSON file to append each file's phase timings to, or None.
     """
 
     def __init__(self, parent, **kwargs):
@@ -36,29 +214,115 @@ class UnifyTK(Tk.Frame):
         self.filename = ""
         self.csv_file_in_list_format = []
         self.files_to_unify_directory = r"T:\ANALYST WORK FILES\Peter\CrystalMB\CSVFilesToUnify"
+        self.unified_files_directory = r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles'
+        self.files_to_unify_queue = queue.Queue()
+        self.log_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.worker_thread = None
+        self.worker_lock = threading.Lock()
+        self.unify_instrumentation = UnifyInstrumentation()
+        self.metrics_json_filename = None
+        self.progress_line_shown = False
         self.browse_directory_button = Tk.Button(self,
-                                                 text='Select File',
+                                                 text='Select Files',
                                                  command=lambda: self.unify_tk_controller())
+        self.cancel_button = Tk.Button(self,
+                                       text='Cancel',
+                                       command=lambda: self.cancel_unify())
         self.unify_tk_console_log_view = Tk.Text(self, height=25, width=60)
         # Tk layout
         self.browse_directory_button.grid(row=0, column=0, sticky=Tk.W, padx=5, pady=5)
-        self.unify_tk_console_log_view.grid(row=1, column=0, sticky=Tk.W, padx=5)
+        self.cancel_button.grid(row=0, column=1, sticky=Tk.E, padx=5, pady=5)
+        self.unify_tk_console_log_view.grid(row=1, column=0, columnspan=2, sticky=Tk.W, padx=5)
         self.unify_tk_console_log_view.config(state=Tk.DISABLED)
+        self.after(100, self.process_log_queue)
 
     def unify_tk_controller(self):
-        """main function for the class. """
+        """main function for the class. Queues the picked files and starts the worker if it isn't running. """
 
-        self.browse_file_directory()
-        self.open_and_read_in_csv_file()
-        self.unify_pathway_decider()
-        # clearing the parameters so the button can be used again with a new file
-        self.filename = ''
-        self.csv_file_in_list_format = []
+        filenames = self.browse_file_directory()
+        if not filenames:
+            return
+        with self.worker_lock:
+            if self.cancel_event.is_set():
+                # the last run was cancelled, and its worker may still be finishing - these files are a new run
+                self.cancel_event = threading.Event()
+            for filename in filenames:
+                self.files_to_unify_queue.put(filename)
+            if self.worker_thread is None:
+                self.worker_thread = threading.Thread(target=self.unify_queued_files, daemon=True)
+                self.worker_thread.start()
+        self.write_log_to_text_box("{} file(s) queued.\n\n".format(len(filenames)))
 
     def browse_file_directory(self):
-        """opens up to the directory the files to unify are in. """
+        """opens up to the directory the files to unify are in. Returns the files picked. """
+
+        return filedialog.askopenfilenames(initialdir=self.files_to_unify_directory)
 
-        self.filename = filedialog.askopenfilename(initialdir=self.files_to_unify_directory)
+    def cancel_unify(self):
+        """cancels the file being unified, and empties the queue. """
+
+        self.cancel_event.set()
+        while True:
+            try:
+                self.files_to_unify_queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def unify_queued_files(self):
+        """worker thread - unifies files off the queue until it is empty. If files are picked while a cancelled run
+        is still finishing, the same thread carries on with them once it has. """
+
+        with self.worker_lock:
+            cancel_event = self.cancel_event
+        while True:
+            self.unify_queued_files_until_cancelled(cancel_event)
+            with self.worker_lock:
+                if self.cancel_event is cancel_event and (cancel_event.is_set() or self.files_to_unify_queue.empty()):
+                    self.worker_thread = None
+                    return
+                # a new run was started (or more files picked) while this one was finishing
+                cancel_event = self.cancel_event
+
+    def unify_queued_files_until_cancelled(self, cancel_event):
+        """unifies files off the queue until it is empty, or the run is cancelled. Only talks to Tk through
+        log_queue.
+
+        Parameters
+        ----------
+        cancel_event : threading.Event
+            the run's cancel event.
+        """
+
+        while not cancel_event.is_set():
+            try:
+                self.filename = self.files_to_unify_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.post_log("{}\n".format(self.filename))
+            self.unify_instrumentation = UnifyInstrumentation(labels={'filename': self.filename})
+            try:
+                if self.filename.lower().endswith('.xml'):
+                    self.unify_xml_file(cancel_event)
+                else:
+                    self.open_and_read_in_csv_file()
+                    self.unify_pathway_decider(cancel_event)
+            except UnifyCancelled:
+                self.post_log("cancelled.\n\n")
+            except UnicodeDecodeError:
+                # already logged by open_and_read_in_csv_file
+                pass
+            except Exception as exc:
+                self.post_log("could not unify this file - {}: {}\n\n".format(type(exc).__name__, exc))
+            if self.unify_instrumentation.phases:
+                self.post_log(self.unify_instrumentation.summary() + "\n\n")
+                if self.metrics_json_filename:
+                    self.unify_instrumentation.write_json(self.metrics_json_filename)
+            # clearing the parameters so the next file starts fresh
+            self.filename = ''
+            self.csv_file_in_list_format = []
+        if cancel_event.is_set():
+            self.post_log("remaining files cancelled.\n\n")
 
     def open_and_read_in_csv_file(self):
         """Opens the csv file at the filename, reads it line by line, appends to self.csv_file_in_list_format.
@@ -70,50 +334,143 @@ class UnifyTK(Tk.Frame):
         """
 
         try:
-            with open(self.filename, newline='') as csv_file:
-                csv_file_reader = csv.reader(csv_file)
-                for item in csv_file_reader:
-                    self.csv_file_in_list_format.append(item)
-            self.write_log_to_text_box("csv file successfully read. \n\n", True)
+            with self.unify_instrumentation.phase('read') as unify_phase:
+                with open(self.filename, newline='') as csv_file:
+                    csv_file_reader = csv.reader(csv_file)
+                    for item in csv_file_reader:
+                        self.csv_file_in_list_format.append(item)
+                unify_phase.rows_out = max(len(self.csv_file_in_list_format) - 1, 0)
+            self.post_log("csv file successfully read. \n")
         except UnicodeDecodeError:
-            self.write_log_to_text_box("This file is not being recognized as a csv file. \n\n", True)
+            self.post_log("This file is not being recognized as a csv file. \n\n")
+            raise
 
-    def unify_pathway_decider(self):
-        """Decides which of the two pathways to send the csv down - Waters, or Agilent.
+    def unify_pathway_decider(self, cancel_event=None):
+        """Decides which of the pathways to send the csv down - Waters, or Agilent - and converts it.
 
         There are two different software packages controlling agilent ICP/MS instruments in the lab, so we have
         an optional keyword argument if we are taking data from the older of the two ICP/MS systems. The fields
-        and data format provided are slightly different, and need separate but similar handling. """
-
-        keyword_check = self.csv_file_in_list_format[0][1]
-        if keyword_check == 'version':
-            WatersUnify(self.csv_file_in_list_format).waters_unify_controller()
-            self.write_log_to_text_box("Waters csv file detected.\n" +
-                                       "sending down WatersUnify pathway. \n")
-        elif keyword_check == 'Sample Type':
-            AgilentUnify(self.csv_file_in_list_format).agilent_unify_controller()
-            self.write_log_to_text_box("Agilent csv file detected (Melanie ICP/MS)\n" +
-                                       "sending down AgilentUnify pathway. \n")
-        elif keyword_check == 'Type':
-            AgilentUnify(self.csv_file_in_list_format).agilent_unify_controller(old_icp=True)
-            self.write_log_to_text_box("Agilent csv file detected (Harry ICP/MS)\n" +
-                                       "sending down AgilentUnify pathway. \n")
-        else:
-            self.write_log_to_text_box("No valid unify pathway detected for this csv file. \n")
+        and data format provided are slightly different, and need separate but similar handling. The rows go through
+        UnifyProgress on the way in, so progress is reported and the cancel button is noticed between rows.
+
+        Parameters
+        ----------
+        cancel_event=None
+            the run's cancel event. Defaults to cancel_event. """
+
+        header_row = self.csv_file_in_list_format[0] if self.csv_file_in_list_format else []
+        try:
+            unify_format = unify_format_registry.detect_format_from_header_row(header_row)
+        except ValueError:
+            self.post_log("No valid unify pathway detected for this csv file. \n\n")
+            return
+        self.post_log("{} csv file detected.\n".format(unify_format.name) +
+                      "sending down {} pathway. \n".format(unify_format.converter_class.__name__))
+        csv_file_rows = UnifyProgress(self.csv_file_in_list_format, len(self.csv_file_in_list_format),
+                                      self.post_progress, cancel_event or self.cancel_event)
+        output_formats, index_output_sink = self.indexed_output_formats()
+        output_filename = unify_pathway_decider(iter(csv_file_rows), self.unified_files_directory, True,
+                                                unify_format, output_formats, self.unify_instrumentation)[1]
+        self.post_log("unified file written to {}\n\n".format(output_filename))
+        self.post_index_error(index_output_sink)
+
+    def unify_xml_file(self, cancel_event=None):
+        """converts an XML export (TargetLynx) straight from the file - the converter streams it, so there is no
+        csv to read in first. The converter reads it through UnifyProgressFile, so progress is reported and the
+        cancel button is noticed as it goes.
+
+        Parameters
+        ----------
+        cancel_event=None
+            the run's cancel event. Defaults to cancel_event.
+        """
+
+        try:
+            unify_format = unify_format_registry.detect_format(self.filename)
+        except ValueError:
+            self.post_log("No valid unify pathway detected for this xml file. \n\n")
+            return
+        self.post_log("{} file detected.\n".format(unify_format.name) +
+                      "sending down {} pathway. \n".format(unify_format.converter_class.__name__))
+        output_formats, index_output_sink = self.indexed_output_formats()
+        with open(self.filename, 'rb') as xml_file:
+            xml_progress_file = UnifyProgressFile(xml_file, os.fstat(xml_file.fileno()).st_size, self.post_progress,
+                                                  cancel_event or self.cancel_event)
+            output_filename = unify_format.convert(xml_progress_file, self.unified_files_directory,
+                                                   self.unify_instrumentation,
+                                                   output_formats=output_formats).output_filename
+        self.post_log("unified file written to {}\n\n".format(output_filename))
+        self.post_index_error(index_output_sink)
+
+    def indexed_output_formats(self):
+        """the excel file, plus an IndexOutputSink so the results can be found with UnifyIndex.py later. """
+
+        return indexed_output_formats(None, os.path.join(self.unified_files_directory, default_index_filename))
+
+    def post_index_error(self, index_output_sink):
+        """logs it if the results couldn't be added to the index - the unified file is written either way. """
+
+        if index_output_sink.error is not None:
+            self.post_log("results not indexed: {}\n\n".format(index_output_sink.error))
+
+    def post_log(self, passed_text, with_delete=False):
+        """thread-safe - queues text for the log view. """
+
+        self.log_queue.put(('log', passed_text, with_delete))
+
+    def post_progress(self, passed_text):
+        """thread-safe - queues a progress line for the log view. """
+
+        self.log_queue.put(('progress', passed_text, False))
+
+    def process_log_queue(self):
+        """runs on the Tk main loop - writes any queued messages to the log view, then checks again in 100ms. """
+
+        while True:
+            try:
+                message_type, passed_text, with_delete = self.log_queue.get_nowait()
+            except queue.Empty:
+                break
+            if message_type == 'progress':
+                self.write_progress_to_text_box(passed_text)
+            else:
+                self.write_log_to_text_box(passed_text, with_delete)
+        self.after(100, self.process_log_queue)
 
     def write_log_to_text_box(self, passed_text, with_delete=False):
         """clears any text in EasyTraxMakerLog, and then writes the passed text to the Text box."""
 
+        self.progress_line_shown = False
         self.unify_tk_console_log_view.config(state=Tk.NORMAL)
         if with_delete:
             self.unify_tk_console_log_view.delete('1.0', Tk.END)
         self.unify_tk_console_log_view.insert(Tk.END, passed_text)
+        self.unify_tk_console_log_view.see(Tk.END)
         self.unify_tk_console_log_view.config(state=Tk.DISABLED)
 
+    def write_progress_to_text_box(self, passed_text):
+        """writes a progress line, replacing the previous one if nothing else has been written since. """
+
+        self.unify_tk_console_log_view.config(state=Tk.NORMAL)
+        if self.progress_line_shown:
+            self.unify_tk_console_log_view.delete('progress_start', Tk.END)
+        else:
+            self.unify_tk_console_log_view.mark_set('progress_start', 'end-1c')
+            self.unify_tk_console_log_view.mark_gravity('progress_start', Tk.LEFT)
+            self.progress_line_shown = True
+        self.unify_tk_console_log_view.insert(Tk.END, passed_text)
+        self.unify_tk_console_log_view.see(Tk.END)
+        self.unify_tk_console_log_view.config(state=Tk.DISABLED)
+
+
+def main():
+    """starts the GUI. Importing this module doesn't - so UnifyTK can be imported without a display. """
 
-root = Tk.Tk()
-root.geometry('495x450')
-UnifyTK(root, height=450, width=495).grid()
-root.mainloop()
+    root = Tk.Tk()
+    root.geometry('495x450')
+    UnifyTK(root, height=450, width=495).grid()
+    root.mainloop()
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+if __package__:
+    from .UnifyFormatRegistry import unify_format_registry
+    from .UnifyInstrumentation import write_file_atomically
+    from .UnifiedSchema import typed_condensed_line
+else:
+    # run as a script from Source_Code
+    from UnifyFormatRegistry import unify_format_registry
+    from UnifyInstrumentation import write_file_atomically
+    from UnifiedSchema import typed_condensed_line
+import itertools
+import threading
+import argparse
+import datetime
+import json
+import time
+import csv
+import io
+import os
+
+
+default_tail_state_filename = '.unify_tail_state.json'
+
+
+class TailCsvOutputSink:
+    """a csv output sink that appends to the input's unified csv instead of replacing it.
+
+    The first update of an input writes the csv (header and all) under the name the converter gives it; after
+    that the same file is appended to, whatever the converter would call it - the batch name comes from the first
+    row each update converts, and nothing makes that the same every update (the old ICP's placeholder name is the
+    first character of the row's date, say).
+
+    Attributes
+    ----------
+    extension : string
+        added to the batch name to make the filename, the first time.
+    csv_filename : string
+        the unified csv, once there is one.
+    append : bool
+        False to start the csv over.
+    rows_written : int
+        condensed lines written this update, or None if the converter never got as far as writing.
+    """
+
+    extension = '.csv'
+
+    def __init__(self, csv_filename=None, append=True):
+        self.csv_filename = csv_filename
+        self.append = append
+        self.rows_written = None
+
+    def write_condensed_lines(self, filename, condensed_lines):
+        """appends the condensed lines to csv_filename, or writes them (header first) to filename if it's new. """
+
+        if self.csv_filename is None or not self.append:
+            self.csv_filename = filename
+        condensed_lines = iter(condensed_lines)
+        header_line = next(condensed_lines, None)
+        self.rows_written = 0
+        append = self.append and os.path.exists(self.csv_filename)
+        with open(self.csv_filename, 'a' if append else 'w', newline='') as csv_file:
+            csv_file_writer = csv.writer(csv_file)
+            if not append:
+                csv_file_writer.writerow(header_line)
+            for condensed_line in condensed_lines:
+                csv_file_writer.writerow(condensed_line)
+                self.rows_written += 1
+
+
+class UnifyTail:
+    """Converts exports that are still being written, a bit at a time - the rows added since the last update.
+
+    Long ICP sequences write their export as they go. For each input the byte offset it has been read up to and the
+    number of rows converted so far are kept in a small JSON state file, so each update only reads what's been
+    appended since: complete lines only, so a row the instrument is half way through writing waits for the next
+    update (unless the file has stopped changing for settle_seconds - the last line doesn't always get a newline).
+    The new rows go through the input's own converter and are appended to its unified csv, so partial results are
+    there to look at during the run, and an update costs the new rows rather than the whole file.
+
+    An xlsx can't be appended to, so the excel file is regenerated from the unified csv - at most every
+    excel_interval seconds while rows keep coming, and once more at the end. If an input shrinks or its header
+    changes it's been replaced, and is converted again from the start.
+
+    Only csv exports can be tailed - the TargetLynx XML isn't complete until its closing tag.
+
+    Attributes
+    ----------
+    input_filenames : list
+        the exports to follow.
+    unified_files_directory : string
+        the directory the unified files are written to.
+    state_filename : string
+        the JSON file the offsets are kept in.
+    regenerate_excel : bool
+        False for just the csv.
+    excel_interval : float
+        the fewest seconds between regenerations of the same excel file.
+    settle_seconds : float
+        how long a file has to go unchanged before a last line without a newline counts as complete.
+    poll_interval : float
+        seconds between updates when following.
+    input_states : dict
+        absolute input path -> its state: offset, rows, header_row, pathway, csv_filename, updated.
+    stale_excel_files : dict
+        unified csv -> (its pathway, the time its excel file was last regenerated), for csvs with rows the excel
+        doesn't have yet. The pathway's converter has the excel file's column widths and header formats.
+    """
+
+    def __init__(self, input_filenames,
+                 unified_files_directory=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                 state_filename=None, regenerate_excel=True, excel_interval=30.0, settle_seconds=3.0,
+                 poll_interval=2.0):
+        """
+        Parameters
+        ----------
+        input_filenames : list
+            the exports to follow.
+        unified_files_directory : string
+            the directory the unified files are written to.
+        state_filename : string
+            the JSON state file. Defaults to default_tail_state_filename in the unified files directory.
+        regenerate_excel : bool
+            False for just the csv.
+        excel_interval : float
+            the fewest seconds between regenerations of the same excel file.
+        settle_seconds : float
+            how long a file has to go unchanged before a last line without a newline counts as complete.
+        poll_interval : float
+            seconds between updates when following.
+        """
+
+        self.input_filenames = list(input_filenames)
+        self.unified_files_directory = unified_files_directory
+        self.state_filename = state_filename or os.path.join(unified_files_directory, default_tail_state_filename)
+        self.regenerate_excel = regenerate_excel
+        self.excel_interval = excel_interval
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.input_states = {}
+        self.stale_excel_files = {}
+        self.stop_event = threading.Event()
+
+    def unify_tail_controller(self, follow=False):
+        """main function for the class. Updates every input once, or keeps updating them until stop() or ctrl-c if
+        following. Returns the number of rows converted.
+
+        Parameters
+        ----------
+        follow=False
+            True to keep polling the inputs for new rows.
+        """
+
+        self.load_input_states()
+        rows_converted = 0
+        try:
+            while True:
+                for input_filename in self.input_filenames:
+                    rows_added = self.update_input(input_filename)
+                    if rows_added:
+                        print("{} +{} rows ({} total)".format(input_filename, rows_added,
+                                                              self.input_state(input_filename)['rows']))
+                    rows_converted += rows_added
+                self.save_input_states()
+                self.regenerate_stale_excel_files()
+                if not follow or self.stop_event.wait(self.poll_interval):
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.save_input_states()
+            self.regenerate_stale_excel_files(force=True)
+        return rows_converted
+
+    def stop(self):
+        """stops following after the current update. Safe to call from another thread. """
+
+        self.stop_event.set()
+
+    def load_input_states(self):
+        """reads the state file, if there is one. """
+
+        self.input_states = {}
+        if os.path.exists(self.state_filename):
+            with open(self.state_filename) as state_file:
+                self.input_states = json.load(state_file)
+
+    def save_input_states(self):
+        """writes the state file, atomically so a crash mid-write can't lose the offsets. """
+
+        write_file_atomically(self.state_filename, json.dumps(self.input_states, indent=2))
+
+    def input_state(self, input_filename):
+        """the state kept for an input, or None if it hasn't been read before. """
+
+        return self.input_states.get(os.path.abspath(input_filename))
+
+    def update_input(self, input_filename):
+        """converts the rows appended to an input since its last update, and appends them to its unified csv.
+
+        Parameters
+        ----------
+        input_filename : string
+            the export.
+
+        Returns
+        -------
+        int
+            the number of new export rows read.
+
+        Raises
+        ------
+        ValueError
+            the export isn't a supported csv format.
+        """
+
+        input_state = self.input_state(input_filename)
+        header_line, appended_text, offset = self.read_appended_text(input_filename, input_state)
+        if header_line is None:
+            # the header isn't all there yet
+            return 0
+        header_row = next(csv.reader([header_line]), [])
+        if input_state is not None and (input_state['header_row'] != header_row or offset < input_state['offset']):
+            # a different export under the same name - start over
+            input_state = None
+            header_line, appended_text, offset = self.read_appended_text(input_filename, input_state)
+        if input_state is None:
+            unify_format = unify_format_registry.detect_format_from_header_row(header_row)
+            input_state = {'offset': 0, 'rows': 0, 'header_row': header_row, 'pathway': unify_format.name,
+                           'csv_filename': None}
+        else:
+            unify_format = unify_format_registry.format_named(input_state['pathway'])
+        if not appended_text:
+            return 0
+        appended_rows = list(csv.reader(io.StringIO(appended_text, newline='')))
+        if unify_format.schema is not None and next(unify_format.schema.non_blank_rows(header_row, appended_rows),
+                                                    None) is None:
+            # nothing but blank lines since the last update - the schema would reject them as a file with no data
+            self.update_input_state(input_filename, input_state, offset, len(appended_rows), None)
+            return len(appended_rows)
+        tail_csv_output_sink = TailCsvOutputSink(input_state['csv_filename'], append=input_state['rows'] > 0)
+        csv_size = None
+        if tail_csv_output_sink.append and os.path.exists(tail_csv_output_sink.csv_filename):
+            csv_size = os.path.getsize(tail_csv_output_sink.csv_filename)
+        try:
+            # numbered as rows of the whole export, so a schema error points at the right line of it
+            unify_format.convert(itertools.chain([header_row], appended_rows), self.unified_files_directory,
+                                 first_row_number=input_state['rows'] + 2, streaming=True,
+                                 output_formats=[tail_csv_output_sink])
+        except BaseException:
+            # the state isn't moved on, so the rows are tried again next update - once whatever this wrote is gone
+            self.discard_appended_rows(tail_csv_output_sink, csv_size)
+            raise
+        self.update_input_state(input_filename, input_state, offset, len(appended_rows),
+                                tail_csv_output_sink.csv_filename)
+        if tail_csv_output_sink.rows_written and self.regenerate_excel:
+            self.stale_excel_files.setdefault(tail_csv_output_sink.csv_filename, (input_state['pathway'], 0.0))
+        return len(appended_rows)
+
+    def update_input_state(self, input_filename, input_state, offset, rows_read, csv_filename):
+        """moves an input's state on past the rows an update has read.
+
+        Parameters
+        ----------
+        input_filename : string
+            the export.
+        input_state : dict
+            its state.
+        offset : int
+            the byte offset the update read up to.
+        rows_read : int
+            the export rows it read.
+        csv_filename : string
+            the unified csv, or None if the update didn't write one.
+        """
+
+        input_state.update(offset=offset, rows=input_state['rows'] + rows_read,
+                           csv_filename=csv_filename or input_state['csv_filename'],
+                           updated=datetime.datetime.now().isoformat(timespec='seconds'))
+        self.input_states[os.path.abspath(input_filename)] = input_state
+
+    def discard_appended_rows(self, tail_csv_output_sink, csv_size):
+        """undoes an update that failed part way, so the rows it did write aren't appended again by the next one -
+        the offset in the state only moves on once an update succeeds.
+
+        Parameters
+        ----------
+        tail_csv_output_sink : TailCsvOutputSink
+            the update's sink.
+        csv_size : int
+            the unified csv's size before the update, or None if the update was starting it.
+        """
+
+        if tail_csv_output_sink.rows_written is None or tail_csv_output_sink.csv_filename is None:
+            # the converter failed before writing anything
+            return
+        if csv_size is None:
+            if os.path.exists(tail_csv_output_sink.csv_filename):
+                os.remove(tail_csv_output_sink.csv_filename)
+            return
+        with open(tail_csv_output_sink.csv_filename, 'r+b') as csv_file:
+            csv_file.truncate(csv_size)
+
+    def read_appended_text(self, input_filename, input_state):
+        """reads the header line, and the complete lines after the input's offset.
+
+        Parameters
+        ----------
+        input_filename : string
+            the export.
+        input_state : dict
+            its state, or None to read from the start.
+
+        Returns
+        -------
+        tuple
+            (header line or None if it isn't complete yet, the appended lines as text, the offset after them).
+        """
+
+        with open(input_filename, 'rb') as input_file:
+            header_bytes = input_file.readline()
+            offset = max(input_state['offset'], len(header_bytes)) if input_state is not None else len(header_bytes)
+            input_file.seek(offset)
+            appended_bytes = input_file.read()
+            file_stat = os.fstat(input_file.fileno())
+        settled = time.time() - file_stat.st_mtime >= self.settle_seconds
+        if not header_bytes.endswith(b'\n') and not settled:
+            return None, '', 0
+        if input_state is not None and file_stat.st_size < input_state['offset']:
+            # shrunk, so it's been replaced - an offset past the end tells update_input to start over
+            return self.decode_bytes(header_bytes), '', file_stat.st_size
+        if not settled:
+            # a line without its newline is still being written
+            appended_bytes = appended_bytes[:appended_bytes.rfind(b'\n') + 1]
+        return self.decode_bytes(header_bytes), self.decode_bytes(appended_bytes), offset + len(appended_bytes)
+
+    def decode_bytes(self, text_bytes):
+        """decodes file bytes the way open() does, so the rows come out the same as reading the whole file. """
+
+        return io.TextIOWrapper(io.BytesIO(text_bytes), newline='').read()
+
+    def regenerate_stale_excel_files(self, force=False):
+        """rewrites the excel file of each unified csv with rows it doesn't have yet, if excel_interval has passed.
+
+        Parameters
+        ----------
+        force=False
+            True to regenerate every stale one regardless.
+        """
+
+        now = time.monotonic()
+        for csv_filename, (pathway, last_regenerated) in list(self.stale_excel_files.items()):
+            if not force and last_regenerated and now - last_regenerated < self.excel_interval:
+                continue
+            excel_output_sink = unify_format_registry.format_named(pathway).converter_class.excel_output_sink()
+            with open(csv_filename, newline='') as csv_file:
+                # the excel sink takes typed lines - the csv file has them as text
+                excel_output_sink.write_condensed_lines(os.path.splitext(csv_filename)[0] + excel_output_sink.extension,
+                                                        map(typed_condensed_line, csv.reader(csv_file)))
+            if force:
+                del self.stale_excel_files[csv_filename]
+            else:
+                self.stale_excel_files[csv_filename] = (pathway, now)
+
+
+def main(argv=None):
+    """command line entry point for tailing exports. """
+
+    parser = argparse.ArgumentParser(description="Convert the rows appended to exports that are still being written.")
+    parser.add_argument('input_filenames', nargs='+', help="the .csv exports to follow")
+    parser.add_argument('-o', '--output-directory',
+                        default=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                        help="directory to write the unified files to")
+    parser.add_argument('--state', default=None,
+                        help="JSON file the read offsets are kept in (default: " + default_tail_state_filename +
+                             " in the output directory)")
+    parser.add_argument('--follow', action='store_true', help="keep checking for new rows until ctrl-c")
+    parser.add_argument('--poll-interval', type=float, default=2.0,
+                        help="seconds between checks when following (default 2)")
+    parser.add_argument('--excel-interval', type=float, default=30.0,
+                        help="fewest seconds between regenerating the same excel file (default 30)")
+    parser.add_argument('--no-excel', action='store_true', help="only append to the unified csv")
+    args = parser.parse_args(argv)
+    unify_tail = UnifyTail(args.input_filenames, args.output_directory, args.state,
+                           regenerate_excel=not args.no_excel, excel_interval=args.excel_interval,
+                           poll_interval=args.poll_interval)
+    try:
+        unify_tail.unify_tail_controller(args.follow)
+    except (OSError, ValueError) as exc:
+        print("tail failed: {}".format(exc))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
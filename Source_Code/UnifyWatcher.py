@@ -0,0 +1,358 @@
+if __package__:
+    from .UnifyBatch import unify_single_file, default_cache_index_filename
+    from .UnifyIndex import default_index_filename
+    from .UnifyFormatRegistry import unify_format_registry
+else:
+    # run as a script from Source_Code
+    from UnifyBatch import unify_single_file, default_cache_index_filename
+    from UnifyIndex import default_index_filename
+    from UnifyFormatRegistry import unify_format_registry
+import concurrent.futures
+import threading
+import argparse
+import fnmatch
+import queue
+import time
+import os
+
+try:
+    # watchdog uses inotify on linux and ReadDirectoryChangesW on windows. Optional - we poll without it.
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class UnifyWatcherEventHandler(FileSystemEventHandler):
+    """passes watchdog file events on to the watcher's queue. Runs on watchdog's thread, so it only queues paths. """
+
+    def __init__(self, changed_paths_queue):
+        """
+        Parameters
+        ----------
+        changed_paths_queue : queue.Queue
+            thread-safe queue the changed paths are put on.
+        """
+
+        super().__init__()
+        self.changed_paths_queue = changed_paths_queue
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.changed_paths_queue.put(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.changed_paths_queue.put(event.src_path)
+
+    def on_moved(self, event):
+        # instruments that write to a temp name and rename at the end show up here
+        if not event.is_directory:
+            self.changed_paths_queue.put(event.dest_path)
+
+
+class UnifyWatcher:
+    """Watches CSVFilesToUnify and converts each new export once it has finished being written.
+
+    File events come from watchdog (inotify etc.) when it is installed. Otherwise the directory is polled, comparing
+    every file's size and modification time with the version last converted on each tick - a file written over in
+    place doesn't change the directory's modification time, so that can't be relied on to skip a tick.
+
+    A file is converted once its size and modification time have stayed the same for settle_seconds, so half-written
+    exports are left alone. Conversions run on a process pool, with at most max_workers files in flight - anything
+    else that is ready waits its turn as pending. A file only counts as converted once its conversion succeeds - a
+    failed one is tried again, up to max_attempts times for the same version of the file.
+
+    Attributes
+    ----------
+    watch_directory : string
+        the directory the instruments export into.
+    unified_files_directory : string
+        the directory the unified files are written to.
+    max_workers : int
+        worker processes, and the most conversions in flight at once.
+    settle_seconds : float
+        how long a file has to stay unchanged before it is converted.
+    poll_interval : float
+        seconds between ticks.
+    file_patterns : list
+        only file names matching one of these globs are converted.
+    cache_index_filename : string
+        the UnifyCache index, so a file re-saved with the same contents isn't converted twice. None for no cache.
+    index_filename : string
+        the UnifyIndex the converted results are added to, or None for no index.
+    max_attempts : int
+        conversions a version of a file gets before it's left alone until it changes again.
+    pending_files : dict
+        path -> (size, mtime, time it was last seen changing) for files waiting to settle.
+    converted_files : dict
+        path -> (size, mtime) of the version of each file that was converted successfully.
+    failed_files : dict
+        path -> ((size, mtime), attempts) for the version of each file whose conversions have failed.
+    """
+
+    def __init__(self, watch_directory=r"T:\ANALYST WORK FILES\Peter\CrystalMB\CSVFilesToUnify",
+                 unified_files_directory=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                 max_workers=2, settle_seconds=3.0, poll_interval=1.0, file_pattern=None, convert_existing_files=False,
+                 cache_index_filename=None, index_filename=None, max_attempts=3):
+        """
+        Parameters
+        ----------
+        watch_directory : string
+            the directory the instruments export into.
+        unified_files_directory : string
+            the directory the unified files are written to.
+        max_workers : int
+            worker processes, and the most conversions in flight at once.
+        settle_seconds : float
+            how long a file has to stay unchanged before it is converted.
+        poll_interval : float
+            seconds between ticks.
+        file_pattern : string or list
+            only file names matching this glob (or one of these globs) are converted. None for every extension a
+            registered format has - .csv and .xml.
+        convert_existing_files : bool
+            True to also convert the files already in the directory at start up.
+        cache_index_filename : string
+            the UnifyCache index to use, or None for no cache.
+        index_filename : string
+            the UnifyIndex to add the converted results to, or None for no index.
+        max_attempts : int
+            conversions a version of a file gets before it's left alone until it changes again.
+        """
+
+        self.watch_directory = watch_directory
+        self.unified_files_directory = unified_files_directory
+        self.max_workers = max_workers
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        if file_pattern is None:
+            file_pattern = unify_format_registry.file_patterns()
+        self.file_patterns = [file_pattern] if isinstance(file_pattern, str) else list(file_pattern)
+        self.convert_existing_files = convert_existing_files
+        self.cache_index_filename = cache_index_filename
+        self.index_filename = index_filename
+        self.max_attempts = max_attempts
+        self.pending_files = {}
+        self.converted_files = {}
+        self.failed_files = {}
+        self.conversions_in_flight = {}
+        self.paths_in_flight = set()
+        self.changed_paths_queue = queue.Queue()
+        self.finished_conversions_queue = queue.Queue()
+        self.stop_event = threading.Event()
+
+    def unify_watcher_controller(self):
+        """main function for the class. Runs until stop() is called or ctrl-c. """
+
+        observer = None
+        if Observer is not None:
+            observer = Observer()
+            observer.schedule(UnifyWatcherEventHandler(self.changed_paths_queue), self.watch_directory)
+            observer.start()
+        print("watching {} ({})".format(self.watch_directory, 'file events' if observer else 'polling'))
+        self.find_existing_files()
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                while not self.stop_event.is_set():
+                    if observer is None:
+                        self.poll_watch_directory()
+                    self.drain_finished_conversions_queue()
+                    self.drain_changed_paths_queue()
+                    self.submit_settled_files(executor)
+                    self.stop_event.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def stop(self):
+        """stops the watcher after the current tick. Safe to call from another thread. """
+
+        self.stop_event.set()
+
+    def find_existing_files(self):
+        """either queues up the files already in the directory, or marks them as done so only new ones convert. """
+
+        for path in self.list_watch_directory():
+            if self.convert_existing_files:
+                self.changed_paths_queue.put(path)
+            else:
+                file_signature = self.file_signature(path)
+                if file_signature is not None:
+                    self.converted_files[path] = file_signature
+
+    def matches_file_patterns(self, path):
+        """True if the file's name matches one of file_patterns. """
+
+        name = os.path.basename(path)
+        return any(fnmatch.fnmatch(name, file_pattern) for file_pattern in self.file_patterns)
+
+    def list_watch_directory(self):
+        """every file in the watch directory that matches file_patterns. """
+
+        return list(self.scan_watch_directory())
+
+    def scan_watch_directory(self):
+        """path -> (size, mtime) for every file in the watch directory that matches file_patterns. The sizes and
+        times come from the listing itself where the OS gives them (Windows does), so it's one call for the lot. """
+
+        file_signatures = {}
+        try:
+            with os.scandir(self.watch_directory) as directory_entries:
+                for entry in directory_entries:
+                    if not self.matches_file_patterns(entry.name):
+                        continue
+                    try:
+                        if entry.is_file():
+                            file_stat = entry.stat()
+                            file_signatures[entry.path] = file_stat.st_size, file_stat.st_mtime_ns
+                    except OSError:
+                        # deleted since the listing
+                        pass
+        except OSError:
+            # share dropped out - try again next tick
+            pass
+        return file_signatures
+
+    def poll_watch_directory(self):
+        """queues every file whose size or modification time differs from the version last converted. """
+
+        for path, file_signature in self.scan_watch_directory().items():
+            if path not in self.pending_files and self.converted_files.get(path) != file_signature:
+                self.changed_paths_queue.put(path)
+
+    def drain_changed_paths_queue(self):
+        """moves changed paths off the queue into pending_files, unless that version was already converted, is
+        being converted, or has failed max_attempts times. """
+
+        while True:
+            try:
+                path = self.changed_paths_queue.get_nowait()
+            except queue.Empty:
+                return
+            if not self.matches_file_patterns(path) or path in self.pending_files or path in self.paths_in_flight:
+                continue
+            file_signature = self.file_signature(path)
+            if file_signature is None or self.converted_files.get(path) == file_signature:
+                continue
+            failed_signature, attempts = self.failed_files.get(path, (None, 0))
+            if failed_signature == file_signature and attempts >= self.max_attempts:
+                continue
+            self.pending_files[path] = file_signature + (time.monotonic(),)
+
+    def drain_finished_conversions_queue(self):
+        """records the conversions that have finished since the last tick - a success as converted, a failure
+        against max_attempts, putting the file back on the changed paths queue if it has attempts left. """
+
+        while True:
+            try:
+                path, file_signature, success = self.finished_conversions_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.paths_in_flight.discard(path)
+            if success:
+                self.converted_files[path] = file_signature
+                self.failed_files.pop(path, None)
+                continue
+            failed_signature, attempts = self.failed_files.get(path, (None, 0))
+            attempts = attempts + 1 if failed_signature == file_signature else 1
+            self.failed_files[path] = file_signature, attempts
+            if attempts < self.max_attempts:
+                self.changed_paths_queue.put(path)
+            else:
+                print("giving up on {} after {} attempt(s), until it changes".format(path, attempts))
+
+    def submit_settled_files(self, executor):
+        """sends pending files that have stopped changing to the pool, while there is room in it.
+
+        Parameters
+        ----------
+        executor : concurrent.futures.ProcessPoolExecutor
+            the worker pool.
+        """
+
+        now = time.monotonic()
+        for path, (size, mtime, last_changed) in list(self.pending_files.items()):
+            file_signature = self.file_signature(path)
+            if file_signature is None:
+                # deleted or moved away before it settled
+                del self.pending_files[path]
+                continue
+            if file_signature != (size, mtime):
+                # still being written
+                self.pending_files[path] = file_signature + (now,)
+                continue
+            if now - last_changed < self.settle_seconds or len(self.conversions_in_flight) >= self.max_workers:
+                continue
+            del self.pending_files[path]
+            future = executor.submit(unify_single_file, path, self.unified_files_directory, True,
+                                     self.cache_index_filename, index_filename=self.index_filename)
+            self.conversions_in_flight[future] = path, file_signature
+            self.paths_in_flight.add(path)
+            future.add_done_callback(self.conversion_finished)
+
+    def conversion_finished(self, future):
+        """logs the result of a conversion, and queues it for drain_finished_conversions_queue to record. Called
+        from the executor's thread when a file is done. """
+
+        path, file_signature = self.conversions_in_flight.pop(future)
+        try:
+            result = future.result()
+        except Exception as exc:
+            # worker process died
+            print("FAILED {}: {}".format(path, exc))
+            self.finished_conversions_queue.put((path, file_signature, False))
+            return
+        self.finished_conversions_queue.put((path, file_signature, result['success']))
+        if result['cached']:
+            print("cached {} -> {} (unchanged)".format(result['filename'], result['output_filename']))
+        elif result['success']:
+            print("ok     {} -> {} ({:.2f}s)".format(result['filename'], result['output_filename'], result['seconds']))
+        else:
+            print("FAILED {}: {}".format(result['filename'], result['message']))
+
+    def file_signature(self, path):
+        """(size, mtime) of the file, or None if it isn't there any more. """
+
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return None
+        return file_stat.st_size, file_stat.st_mtime_ns
+
+
+def main(argv=None):
+    """command line entry point for the watch-folder service. """
+
+    parser = argparse.ArgumentParser(description="Convert exports as they land in the CSVFilesToUnify directory.")
+    parser.add_argument('watch_directory', nargs='?',
+                        default=r"T:\ANALYST WORK FILES\Peter\CrystalMB\CSVFilesToUnify")
+    parser.add_argument('-o', '--output-directory',
+                        default=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles')
+    parser.add_argument('-w', '--workers', type=int, default=2, help="worker processes (default 2)")
+    parser.add_argument('--settle-seconds', type=float, default=3.0,
+                        help="how long a file must stay unchanged before it is converted (default 3)")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="seconds between checks (default 1)")
+    parser.add_argument('--existing', action='store_true', help="also convert files already in the directory")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="convert every file, even ones already converted with the same contents")
+    parser.add_argument('--no-index', action='store_true',
+                        help="don't add the converted results to the index UnifyIndex.py queries")
+    args = parser.parse_args(argv)
+    cache_index_filename = None
+    if not args.no_cache:
+        cache_index_filename = os.path.join(args.output_directory, default_cache_index_filename)
+    index_filename = None
+    if not args.no_index:
+        index_filename = os.path.join(args.output_directory, default_index_filename)
+    UnifyWatcher(args.watch_directory, args.output_directory, args.workers, args.settle_seconds, args.poll_interval,
+                 convert_existing_files=args.existing, cache_index_filename=cache_index_filename,
+                 index_filename=index_filename).unify_watcher_controller()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,551 @@
+if __package__:
+    from .UnifyBatch import unify_single_file, find_files_to_unify, default_cache_index_filename
+    from .UnifyIndex import default_index_filename
+    from .UnifyOutputPipeline import UnifyOutputPipeline
+else:
+    # run as a script from Source_Code
+    from UnifyBatch import unify_single_file, find_files_to_unify, default_cache_index_filename
+    from UnifyIndex import default_index_filename
+    from UnifyOutputPipeline import UnifyOutputPipeline
+import multiprocessing
+import contextlib
+import threading
+import argparse
+import sqlite3
+import glob
+import socket
+import time
+import os
+
+
+default_work_queue_filename = '.unify_work_queue.sqlite3'
+
+
+class UnifyWorkQueue:
+    """A queue of files to convert, kept in a SQLite file that several workstations share, so each file is converted
+    by exactly one of them.
+
+    A worker claims a job in a single write transaction (BEGIN IMMEDIATE), so two workers can never claim the same
+    one. A claim is a lease: the worker has to renew it every so often while it converts, and a job whose lease runs
+    out - the worker crashed, or its PC was switched off - goes back to being claimable. After max_attempts claims
+    without finishing, it's marked failed rather than taking workers down with it forever.
+
+    Each job is keyed on the file's path relative to input_directory, along with its size and modification time, so
+    a file that's exported again after being converted is queued again, and one that hasn't changed isn't. Keying on
+    the relative path means PCs that map the share under different drive letters (or reach it by its UNC path) all
+    name a file the same way, and don't each queue and convert it.
+
+    The queue file can live on the share (it only uses SQLite's ordinary file locking - WAL mode needs shared memory
+    and doesn't work across machines, so it isn't used). Leases are timed with each PC's own clock, so lease_seconds
+    should be well over any clock difference between them.
+
+    Attributes
+    ----------
+    queue_filename : string
+        the SQLite queue file.
+    lease_seconds : float
+        how long a claim lasts without being renewed.
+    max_attempts : int
+        claims a job gets before it's marked failed.
+    input_directory : string
+        the directory being watched for exports, as this PC sees it, or None to key jobs on absolute paths.
+    """
+
+    def __init__(self, queue_filename, lease_seconds=300.0, max_attempts=3, input_directory=None):
+        """
+        Parameters
+        ----------
+        queue_filename : string
+            the SQLite queue file. Created if it doesn't exist.
+        lease_seconds : float
+            how long a claim lasts without being renewed.
+        max_attempts : int
+            claims a job gets before it's marked failed.
+        input_directory : string
+            the directory being watched for exports, as this PC sees it, or None to key jobs on absolute paths.
+        """
+
+        self.queue_filename = queue_filename
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.input_directory = None if input_directory is None else os.path.abspath(input_directory)
+        directory = os.path.dirname(queue_filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with contextlib.closing(self.connect()) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS unify_jobs ("
+                               "filename TEXT PRIMARY KEY, "
+                               "file_signature TEXT NOT NULL, "
+                               "status TEXT NOT NULL, "
+                               "worker TEXT, "
+                               "lease_expires REAL, "
+                               "attempts INTEGER NOT NULL DEFAULT 0, "
+                               "queued REAL NOT NULL, "
+                               "finished REAL, "
+                               "output_filename TEXT, "
+                               "message TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS unify_jobs_status ON unify_jobs (status, queued)")
+
+    def connect(self):
+        """a connection to the queue. The timeout lets other workers finish writing instead of erroring.
+
+        Used as `with contextlib.closing(self.connect()) as connection, connection:` - one transaction, then closed.
+        """
+
+        return sqlite3.connect(self.queue_filename, timeout=30)
+
+    def enqueue_files(self, filenames):
+        """queues files that aren't queued yet, or have changed since they were. Returns how many were queued.
+
+        Parameters
+        ----------
+        filenames : iterable(string)
+            the files to convert.
+        """
+
+        now = time.time()
+        jobs = []
+        for filename in filenames:
+            file_signature = self.file_signature(filename)
+            if file_signature is not None:
+                jobs.append((self.job_name(filename), file_signature, now))
+        with contextlib.closing(self.connect()) as connection, connection:
+            queued_before = connection.total_changes
+            connection.executemany("INSERT INTO unify_jobs (filename, file_signature, status, queued) "
+                                   "VALUES (?, ?, 'queued', ?) "
+                                   "ON CONFLICT (filename) DO UPDATE SET "
+                                   "file_signature = excluded.file_signature, status = 'queued', worker = NULL, "
+                                   "lease_expires = NULL, attempts = 0, queued = excluded.queued, finished = NULL, "
+                                   "output_filename = NULL, message = NULL "
+                                   "WHERE file_signature != excluded.file_signature", jobs)
+            return connection.total_changes - queued_before
+
+    def claim_job(self, worker_name):
+        """claims the oldest queued job, or one whose worker's lease has run out. Returns the job's name (see
+        job_filename for the file it's for), or None if there's nothing to do.
+
+        Parameters
+        ----------
+        worker_name : string
+            the worker claiming it, e.g. 'LAB-PC-3:5120'.
+        """
+
+        now = time.time()
+        with contextlib.closing(self.connect()) as connection:
+            # manual transactions - BEGIN IMMEDIATE takes the write lock before reading, so no one else can claim
+            # the job between our SELECT and UPDATE
+            connection.isolation_level = None
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # workers that keep dying on a job don't get to keep trying it
+                connection.execute("UPDATE unify_jobs SET status = 'failed', finished = ?, worker = NULL, "
+                                   "message = 'gave up after ' || attempts || ' attempt(s) - the lease ran out' "
+                                   "WHERE status = 'claimed' AND lease_expires < ? AND attempts >= ?",
+                                   (now, now, self.max_attempts))
+                row = connection.execute("SELECT filename FROM unify_jobs "
+                                         "WHERE status = 'queued' OR (status = 'claimed' AND lease_expires < ?) "
+                                         "ORDER BY queued LIMIT 1", (now,)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE unify_jobs SET status = 'claimed', worker = ?, lease_expires = ?, "
+                                       "attempts = attempts + 1 WHERE filename = ?",
+                                       (worker_name, now + self.lease_seconds, row[0]))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return None if row is None else row[0]
+
+    def renew_lease(self, filename, worker_name):
+        """extends the worker's lease on a job. Returns False if the job isn't the worker's any more (its lease ran
+        out and someone else took it).
+
+        Parameters
+        ----------
+        filename : string
+            the job, as returned by claim_job.
+        worker_name : string
+            the worker holding it.
+        """
+
+        with contextlib.closing(self.connect()) as connection, connection:
+            return connection.execute("UPDATE unify_jobs SET lease_expires = ? "
+                                      "WHERE filename = ? AND worker = ? AND status = 'claimed'",
+                                      (time.time() + self.lease_seconds, filename, worker_name)).rowcount == 1
+
+    def complete_job(self, filename, worker_name, result):
+        """records a finished job as done or failed. Returns False (and records nothing) if the job isn't the
+        worker's any more.
+
+        Parameters
+        ----------
+        filename : string
+            the job, as returned by claim_job.
+        worker_name : string
+            the worker holding it.
+        result : dict
+            what unify_single_file returned.
+        """
+
+        with contextlib.closing(self.connect()) as connection, connection:
+            return connection.execute("UPDATE unify_jobs SET status = ?, finished = ?, lease_expires = NULL, "
+                                      "output_filename = ?, message = ? "
+                                      "WHERE filename = ? AND worker = ? AND status = 'claimed'",
+                                      ('done' if result['success'] else 'failed', time.time(),
+                                       result['output_filename'], result['message'], filename,
+                                       worker_name)).rowcount == 1
+
+    def job_counts(self):
+        """the number of jobs in each status - queued, claimed, done and failed. """
+
+        job_counts = dict.fromkeys(('queued', 'claimed', 'done', 'failed'), 0)
+        with contextlib.closing(self.connect()) as connection, connection:
+            for status, count in connection.execute("SELECT status, COUNT(*) FROM unify_jobs GROUP BY status"):
+                job_counts[status] = count
+        return job_counts
+
+    def jobs(self, status=None):
+        """every job (or every job with this status), as dicts, oldest first. """
+
+        with contextlib.closing(self.connect()) as connection, connection:
+            connection.row_factory = sqlite3.Row
+            if status is None:
+                rows = connection.execute("SELECT * FROM unify_jobs ORDER BY queued").fetchall()
+            else:
+                rows = connection.execute("SELECT * FROM unify_jobs WHERE status = ? ORDER BY queued",
+                                          (status,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def job_name(self, filename):
+        """the name a file is queued under - its path relative to input_directory, with / separators, or its
+        absolute path if it's outside input_directory (or there isn't one).
+
+        Parameters
+        ----------
+        filename : string
+            the file, as this PC sees it.
+        """
+
+        filename = os.path.abspath(filename)
+        if self.input_directory is None:
+            return filename
+        try:
+            relative_filename = os.path.relpath(filename, self.input_directory)
+        except ValueError:
+            # on another drive
+            return filename
+        if relative_filename == os.pardir or relative_filename.startswith(os.pardir + os.sep):
+            return filename
+        return relative_filename.replace(os.sep, '/')
+
+    def job_filename(self, job_name):
+        """the file a job is for, as this PC sees it - the other half of job_name.
+
+        Parameters
+        ----------
+        job_name : string
+            the job, as returned by claim_job.
+        """
+
+        if self.input_directory is None or os.path.isabs(job_name):
+            return job_name
+        return os.path.join(self.input_directory, *job_name.split('/'))
+
+    def file_signature(self, filename):
+        """'size:mtime' of the file, or None if it isn't there. """
+
+        try:
+            file_stat = os.stat(filename)
+        except OSError:
+            return None
+        return "{}:{}".format(file_stat.st_size, file_stat.st_mtime_ns)
+
+
+class UnifyWorker:
+    """One worker on one PC - claims jobs off a UnifyWorkQueue and converts them until there are none left (or
+    forever, picking up new exports as they arrive).
+
+    While a file converts, a background thread renews its lease every lease_seconds / 3, so a long conversion
+    isn't mistaken for a crashed one. When there's nothing to claim, the worker scans input_path (if it has one)
+    and queues any new or changed files - every worker does this, so there's no one PC the others depend on.
+
+    Attributes
+    ----------
+    unify_work_queue : UnifyWorkQueue
+        the shared queue.
+    unified_files_directory : string
+        the directory the unified files are written to.
+    input_path : string
+        the directory (or glob) to scan for new files, or None to only work through what's queued.
+    worker_name : string
+        identifies the worker in the queue. Defaults to hostname:pid.
+    streaming : bool
+        True to stream each file through its converter.
+    cache_index_filename : string
+        the UnifyCache index, or None for no cache.
+    output_formats : list
+        the outputs written for each file. None for just the excel file.
+    poll_interval : float
+        seconds to wait when there's nothing to claim.
+    settle_seconds : float
+        how long a file has to be unchanged before it's queued, so half-written exports are left alone.
+    exit_when_empty : bool
+        True to stop once nothing is queued or claimed, rather than waiting for more.
+    index_filename : string
+        the UnifyIndex the converted results are added to, or None for no index.
+    jobs_done : int
+        files this worker has converted (or failed to).
+    """
+
+    def __init__(self, unify_work_queue,
+                 unified_files_directory=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                 input_path=None, worker_name=None, streaming=True, cache_index_filename=None, output_formats=None,
+                 poll_interval=5.0, settle_seconds=3.0, exit_when_empty=False, index_filename=None):
+        """
+        Parameters
+        ----------
+        unify_work_queue : UnifyWorkQueue
+            the shared queue.
+        unified_files_directory : string
+            the directory the unified files are written to.
+        input_path : string
+            the directory (or glob) to scan for new files, or None.
+        worker_name : string
+            identifies the worker in the queue. Defaults to hostname:pid.
+        streaming : bool
+            True to stream each file through its converter.
+        cache_index_filename : string
+            the UnifyCache index, or None for no cache.
+        output_formats : list
+            the outputs written for each file. None for just the excel file.
+        poll_interval : float
+            seconds to wait when there's nothing to claim.
+        settle_seconds : float
+            how long a file has to be unchanged before it's queued.
+        exit_when_empty : bool
+            True to stop once nothing is queued or claimed.
+        index_filename : string
+            the UnifyIndex to add the converted results to, or None for no index.
+        """
+
+        self.unify_work_queue = unify_work_queue
+        self.unified_files_directory = unified_files_directory
+        self.input_path = input_path
+        self.worker_name = worker_name or "{}:{}".format(socket.gethostname(), os.getpid())
+        self.streaming = streaming
+        self.cache_index_filename = cache_index_filename
+        self.output_formats = output_formats
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.exit_when_empty = exit_when_empty
+        self.index_filename = index_filename
+        self.jobs_done = 0
+        self.stop_event = threading.Event()
+
+    def unify_worker_controller(self):
+        """main function for the class. Claims and converts jobs until stop(), ctrl-c, or (with exit_when_empty)
+        the queue is finished. Returns the number of jobs done. """
+
+        try:
+            while not self.stop_event.is_set():
+                job_name = self.unify_work_queue.claim_job(self.worker_name)
+                if job_name is None and self.input_path is not None and self.enqueue_settled_files():
+                    job_name = self.unify_work_queue.claim_job(self.worker_name)
+                if job_name is not None:
+                    self.run_job(job_name)
+                    continue
+                if self.exit_when_empty and self.unify_work_queue.job_counts()['claimed'] == 0:
+                    break
+                # nothing to do, or only jobs other workers hold - their leases may yet run out
+                self.stop_event.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        return self.jobs_done
+
+    def stop(self):
+        """stops the worker once its current job is finished. Safe to call from another thread. """
+
+        self.stop_event.set()
+
+    def enqueue_settled_files(self):
+        """queues the files at input_path that haven't changed for settle_seconds. Returns how many were new. """
+
+        now = time.time()
+        settled_filenames = []
+        for filename in find_files_to_unify(self.input_path):
+            try:
+                if now - os.path.getmtime(filename) >= self.settle_seconds:
+                    settled_filenames.append(filename)
+            except OSError:
+                # moved away since the listing
+                pass
+        return self.unify_work_queue.enqueue_files(settled_filenames)
+
+    def run_job(self, job_name):
+        """converts a claimed file, renewing its lease in the background, and records the result.
+
+        Parameters
+        ----------
+        job_name : string
+            the job, as returned by claim_job.
+        """
+
+        filename = self.unify_work_queue.job_filename(job_name)
+        lease_renewed = threading.Event()
+        heartbeat = threading.Thread(target=self.renew_lease_until_set, args=(job_name, lease_renewed), daemon=True)
+        heartbeat.start()
+        try:
+            result = unify_single_file(filename, self.unified_files_directory, self.streaming,
+                                       self.cache_index_filename, output_formats=self.output_formats,
+                                       index_filename=self.index_filename)
+        finally:
+            lease_renewed.set()
+            heartbeat.join()
+        self.jobs_done += 1
+        if not self.unify_work_queue.complete_job(job_name, self.worker_name, result):
+            print("{} lost its lease on {} - another worker has taken it".format(self.worker_name, filename))
+            return
+        status = 'cached' if result['cached'] else 'ok    ' if result['success'] else 'FAILED'
+        print("{} {} ({:.2f}s) [{}]{}".format(status, filename, result['seconds'], self.worker_name,
+                                             '' if result['success'] else ' ' + result['message']))
+
+    def renew_lease_until_set(self, job_name, finished_event):
+        """the heartbeat - renews the lease every lease_seconds / 3 until finished_event is set.
+
+        Parameters
+        ----------
+        job_name : string
+            the job.
+        finished_event : threading.Event
+            set when the conversion is done.
+        """
+
+        while not finished_event.wait(self.unify_work_queue.lease_seconds / 3):
+            try:
+                if not self.unify_work_queue.renew_lease(job_name, self.worker_name):
+                    return
+            except sqlite3.OperationalError:
+                # the share is busy or dropped out - try again next beat, there's time left on the lease
+                pass
+
+
+def watched_directory(input_path):
+    """the directory the files at input_path are in - input_path itself, or the part of a glob before its first
+    wildcard. Jobs are named relative to it.
+
+    Parameters
+    ----------
+    input_path : string
+        a directory of files to unify, or a glob pattern matching them.
+    """
+
+    if os.path.isdir(input_path):
+        return input_path
+    directory = os.path.dirname(input_path)
+    while glob.has_magic(directory):
+        directory = os.path.dirname(directory)
+    return directory or os.curdir
+
+
+def run_local_worker(queue_filename, lease_seconds, max_attempts, worker_options, input_directory=None):
+    """runs one worker in its own process - for several workers on one PC, or standing in for several PCs.
+
+    Parameters
+    ----------
+    queue_filename : string
+        the SQLite queue file.
+    lease_seconds : float
+        how long a claim lasts without being renewed.
+    max_attempts : int
+        claims a job gets before it's marked failed.
+    worker_options : dict
+        keyword arguments for UnifyWorker.
+    input_directory : string
+        the directory jobs are named relative to. Defaults to the one worker_options['input_path'] is in.
+    """
+
+    if input_directory is None and worker_options.get('input_path') is not None:
+        input_directory = watched_directory(worker_options['input_path'])
+    unify_work_queue = UnifyWorkQueue(queue_filename, lease_seconds, max_attempts, input_directory)
+    return UnifyWorker(unify_work_queue, **worker_options).unify_worker_controller()
+
+
+def main(argv=None):
+    """command line entry point for a work queue worker. Run the same command on every PC. """
+
+    parser = argparse.ArgumentParser(description="Convert exports from a work queue shared between several PCs.")
+    parser.add_argument('input_path', nargs='?', default=r"T:\ANALYST WORK FILES\Peter\CrystalMB\CSVFilesToUnify",
+                        help="directory (or glob) of .csv/.xml files to queue and convert")
+    parser.add_argument('-o', '--output-directory',
+                        default=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles',
+                        help="directory to write the unified files to")
+    parser.add_argument('-q', '--queue', default=None,
+                        help="the shared SQLite queue file (default: " + default_work_queue_filename +
+                             " in the output directory)")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="worker processes to run on this PC (default 1)")
+    parser.add_argument('-f', '--formats', default=None,
+                        help="comma separated outputs to write in one pass: xlsx, csv, parquet, arrow (default: xlsx)")
+    parser.add_argument('--lease-seconds', type=float, default=300.0,
+                        help="how long a claimed file is held without the worker checking in (default 300)")
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help="claims a file gets before it is marked failed (default 3)")
+    parser.add_argument('--poll-interval', type=float, default=5.0,
+                        help="seconds between checks when there is nothing to do (default 5)")
+    parser.add_argument('--exit-when-empty', action='store_true',
+                        help="stop once every file is converted, instead of waiting for new ones")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="convert every file, even ones already converted with the same contents")
+    parser.add_argument('--no-index', action='store_true',
+                        help="don't add the converted results to the index UnifyIndex.py queries")
+    parser.add_argument('--status', action='store_true', help="print the queue's job counts and failures, and exit")
+    args = parser.parse_args(argv)
+    output_formats = None
+    if args.formats:
+        output_formats = [output_format.strip() for output_format in args.formats.split(',') if output_format.strip()]
+        for output_format in output_formats:
+            if output_format not in UnifyOutputPipeline.output_sink_formats:
+                parser.error("unknown output format {!r}, expected one of {}".format(
+                    output_format, ', '.join(UnifyOutputPipeline.output_sink_formats)))
+    queue_filename = args.queue or os.path.join(args.output_directory, default_work_queue_filename)
+    if args.status:
+        unify_work_queue = UnifyWorkQueue(queue_filename, args.lease_seconds, args.max_attempts,
+                                          watched_directory(args.input_path))
+        print(', '.join('{} {}'.format(count, status) for status, count in unify_work_queue.job_counts().items()))
+        for job in unify_work_queue.jobs('failed'):
+            print("  {}: {}".format(job['filename'], job['message']))
+        return 0
+    cache_index_filename = None
+    if not args.no_cache:
+        cache_index_filename = os.path.join(args.output_directory, default_cache_index_filename)
+    index_filename = None
+    if not args.no_index:
+        index_filename = os.path.join(args.output_directory, default_index_filename)
+    worker_options = {'unified_files_directory': args.output_directory,
+                      'input_path': args.input_path,
+                      'cache_index_filename': cache_index_filename,
+                      'output_formats': output_formats,
+                      'poll_interval': args.poll_interval,
+                      'exit_when_empty': args.exit_when_empty,
+                      'index_filename': index_filename}
+    if args.workers == 1:
+        run_local_worker(queue_filename, args.lease_seconds, args.max_attempts, worker_options)
+        return 0
+    worker_processes = [multiprocessing.Process(target=run_local_worker,
+                                                args=(queue_filename, args.lease_seconds, args.max_attempts,
+                                                      worker_options))
+                        for _ in range(args.workers)]
+    for worker_process in worker_processes:
+        worker_process.start()
+    try:
+        for worker_process in worker_processes:
+            worker_process.join()
+    except KeyboardInterrupt:
+        # ctrl-c reaches the workers too - any file they were part way through goes back on the queue once its
+        # lease runs out
+        for worker_process in worker_processes:
+            worker_process.join()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,200 +1,186 @@
-import csv
-import os.path
-import errno
-import xlsxwriter
+if __package__:
+    from .UnifyConverter import UnifyConverter
+    from .UnifyFieldMapping import UnifyFieldMapping, SourceColumn, DerivedField
+    from .UnifiedTable import UnifiedTable
+    from .WatersXmlReader import WatersXmlReader
+    from .ProjectedCsvReader import ProjectedCsvReader
+else:
+    # run as a script from Source_Code
+    from UnifyConverter import UnifyConverter
+    from UnifyFieldMapping import UnifyFieldMapping, SourceColumn, DerivedField
+    from UnifiedTable import UnifiedTable
+    from WatersXmlReader import WatersXmlReader
+    from ProjectedCsvReader import ProjectedCsvReader
+import functools
+import itertools
 
 
-class WatersUnify:
+@functools.lru_cache(maxsize=256)
+def waters_data_source(method_name):
+    """the data source for a Waters row - the method name says whether it's UPLC/MS/MS or UPLC/UV. A batch only
+    has a method or two, so each one is only built once. """
+
+    return "Waters Instruments: " + method_name
+
+
+def waters_batch_name(data_file_name):
+    """the batch name, from a data file name - the batch name plus the 3 digit injection number. """
+
+    # could do this better, getting the main file name from the first item (individual data file name) minus
+    # the last 3 numbers
+    return data_file_name[:-4]
+
+
+class WatersUnify(UnifyConverter):
     """Converts Waters csv data to the Unified Excel Format.
 
+    The Waters fields are always in the same order regardless of instrument, but they're mapped by header name
+    (see field_mapping) so extra or reordered columns don't matter.
+
     Attributes
     ----------
     csv_file_in_list_of_list_format : list(list)
-        csv file to be converted in a list of lists.
-    csv_file_in_list_of_list_format_condensed : list(list)
-        csv file to be converted in a list of lists. Any extra fields not required are removed.
-    required_fields_index_dictionary : dict
-        dictionary of required file fields, and their indexes. 0's are placeholders, indexes are found later.
-    main_file_name : string
-        the name of the excel file to be generated. Same as the batch name you'd use for the targetlynx file.
+        csv file to be converted in a list of lists. For xml=True, the TargetLynx XML file (filename or file object).
     data_source : string
         the source of the data - either will be UPLC/MS/MS, OR UPLC/UV. Uses the method name to figure it out.
+    data_source_index : int
+        the column the method name (and so the data source) is in. It has no fixed header name, so it goes by
+        position.
+    field_mapping : UnifyFieldMapping
+        how a Waters row becomes a condensed line. Blank rows (there can be some at the end of the file) are skipped.
+
+    The rest are as in UnifyConverter.
     """
 
-    def __init__(self, csv_file_in_list_of_list_format):
+    converter_version = 2
+    instrument_name = 'Waters'
+    data_source_index = 12
+    field_mapping = UnifyFieldMapping([DerivedField(waters_data_source, data_source_index),
+                                       SourceColumn('name16'),
+                                       SourceColumn('createdate'),
+                                       SourceColumn('createtime'),
+                                       SourceColumn('sampleid'),
+                                       SourceColumn('type'),
+                                       SourceColumn('name20'),
+                                       SourceColumn('analconc'),
+                                       SourceColumn('percrecovery')],
+                                      batch_name=DerivedField(waters_batch_name, 'name16'),
+                                      skip_blank_column='name16')
+
+    def __init__(self, csv_file_in_list_of_list_format,
+                 unified_files_directory=r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles'):
         """
         Parameters
         ----------
         csv_file_in_list_of_list_format : list(list)
             csv file to be converted in a list of lists.
+        unified_files_directory : string
+            the directory the unified files are written to. Defaults to UnifiedExcelFiles on the T drive.
         """
-        self.csv_file_in_list_of_list_format = csv_file_in_list_of_list_format
-        self.csv_file_in_list_of_list_format_condensed = [['data source',
-                                                           'filename',
-                                                           'create date',
-                                                           'create time',
-                                                           'sample name',
-                                                           'sample type',
-                                                           'analyte name',
-                                                           'analyte concentration',
-                                                           'percent recovery']]
-        self.required_fields_index_dictionary = {'name16': 0,
-                                                 'createdate': 0,
-                                                 'createtime': 0,
-                                                 'sampleid': 0,
-                                                 'type': 0,
-                                                 'name20': 0,
-                                                 'analconc': 0,
-                                                 'percrecovery': 0
-                                                 }
-        self.main_file_name = ""
+        super().__init__(csv_file_in_list_of_list_format, unified_files_directory)
         self.data_source = ""
 
-    def waters_unify_controller(self):
-        """The main controller function for WatersUnify. """
+    def waters_unify_controller(self, streaming=False, columnar=False, output_formats=None, xml=False,
+                                projected=False):
+        """The main controller function for WatersUnify.
 
-        self.find_indexes_of_required_fields()
-        self.create_condensed_csv_file_with_only_relevant_fields()
-        self.generate_excel_files()
-        # have the option of generating excel files with xlsxwriter, can format somewhat
-        # or make un-formatted csv files.
-        # self.generate_csv_files()
+        Parameters
+        ----------
+        streaming=False
+            True if csv_file_in_list_of_list_format is an iterator of rows (e.g. a csv.reader on an open file) that
+            should be streamed through to the excel file one row at a time, instead of condensed into a list first.
+        columnar=False
+            True to condense into a UnifiedTable (unified_table) instead of a list of lists.
+        output_formats=None
+            the outputs to write in one pass, e.g. ['xlsx', 'csv'] - see generate_output_files. None for just the
+            excel file.
+        xml=False
+            True if csv_file_in_list_of_list_format is a TargetLynx XML export rather than csv rows. It is always
+            streamed, straight from the XML to the output, unless columnar is set too.
+        projected=False
+            True if csv_file_in_list_of_list_format is the filename of a csv export, to be read with
+            read_projected_csv_file - only the columns used are read. Works with any of the other options.
+        """
 
-    def find_indexes_of_required_fields(self):
-        """finds the indexes of the fields we need to create our unified excel format.
-
-        This could be hard-coded in because the fields are always in the same order regardless of instrument,
-        but it's nice to have the option, so I'm leaving it in. """
-
-        required_field_index_counter = 0
-        for item in self.csv_file_in_list_of_list_format[0]:
-            if item in self.required_fields_index_dictionary.keys():
-                # then it is a required field
-                # add the index we are at to the dictionary
-                self.required_fields_index_dictionary[item] = required_field_index_counter
-            required_field_index_counter += 1
-
-    def create_condensed_csv_file_with_only_relevant_fields(self):
-        """takes only the required fields from the full csv file, and creates a condensed list of lists.
-
-        Waters XML files have an abundance of data and produce all the values we need separately, so we just have
-        to re-organize them. With Agilent instruments, a little more massaging is needed. We just need functionality
-        to filter out blank lines, which isn't necessary with the Agilent .csv output files. """
-        for item in self.csv_file_in_list_of_list_format[1:]:
-            if item[self.required_fields_index_dictionary['name16']] == '':
-                # so we can ignore the blank lines potentially at the end of the file
-                pass
-            else:
-                # creating a csv line
-                condensed_line = [str("Waters Instruments: " + item[12]),
-                                  item[self.required_fields_index_dictionary['name16']],
-                                  item[self.required_fields_index_dictionary['createdate']],
-                                  item[self.required_fields_index_dictionary['createtime']],
-                                  item[self.required_fields_index_dictionary['sampleid']],
-                                  item[self.required_fields_index_dictionary['type']],
-                                  item[self.required_fields_index_dictionary['name20']],
-                                  item[self.required_fields_index_dictionary['analconc']],
-                                  item[self.required_fields_index_dictionary['percrecovery']]]
-                self.csv_file_in_list_of_list_format_condensed.append(condensed_line)
-        # could do this better, getting the main file name from the first item (individual data file name) minus
-        # the last 3 numbers
-        self.main_file_name = self.csv_file_in_list_of_list_format_condensed[1][1][:-4]
-
-    def generate_excel_files(self):
-        """generates excel file versions of the unified excel format, using xlsxwriter.
-
-        allows us to add formatting to the file produced, which we can't do with the .csv version. the formats
-        denote shared fields - all rows in the file will have the same values in header_cell_format_1 cells,
-        all rows in a sample will have the same values in header_cell_format_2 cells, and the cells with
-        header_format_3 change each line.  """
-
-        target = r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles\ '
-        batch_name = str(self.main_file_name)
-        filename = target[:-1] + batch_name + '.xlsx'
-        workbook = xlsxwriter.Workbook(filename)
-        worksheet = workbook.add_worksheet()
-        # set column width
-        worksheet.set_column('A:A', 50)
-        worksheet.set_column('B:I', 20)
-        # header format for the first two columns
-        header_cell_format_1 = workbook.add_format({'bold': True, 'font_color': 'white', 'bg_color': '#2321a7'})
-        header_cell_format_2 = workbook.add_format({'bold': True, 'font_color': 'white', 'bg_color': '#3330db'})
-        header_cell_format_3 = workbook.add_format({'bold': True, 'font_color': 'black', 'bg_color': '#29abdc'})
-        odd_sample_format = workbook.add_format({'bg_color': "#c7d6db"})
-        even_sample_format = workbook.add_format({'bg_color': "#e9edef"})
-        row = 0
-        for item in self.csv_file_in_list_of_list_format_condensed:
-            if row == 0:
-                worksheet.write(row, 0, item[0], header_cell_format_1)
-                worksheet.write(row, 1, item[1], header_cell_format_2)
-                worksheet.write(row, 2, item[2], header_cell_format_2)
-                worksheet.write(row, 3, item[3], header_cell_format_2)
-                worksheet.write(row, 4, item[4], header_cell_format_2)
-                worksheet.write(row, 5, item[5], header_cell_format_3)
-                worksheet.write(row, 6, item[6], header_cell_format_3)
-                worksheet.write(row, 7, item[7], header_cell_format_3)
-                worksheet.write(row, 8, item[8], header_cell_format_3)
-            else:
-                if row % 2 == 0:
-                    worksheet.write(row, 0, item[0], even_sample_format)
-                    worksheet.write(row, 1, item[1], even_sample_format)
-                    worksheet.write(row, 2, item[2], even_sample_format)
-                    worksheet.write(row, 3, item[3], even_sample_format)
-                    worksheet.write(row, 4, item[4], even_sample_format)
-                    worksheet.write(row, 5, item[5], even_sample_format)
-                    worksheet.write(row, 6, item[6], even_sample_format)
-                    worksheet.write(row, 7, item[7], even_sample_format)
-                    worksheet.write(row, 8, item[8], even_sample_format)
+        with self.unify_instrumentation.profile():
+            if projected and not xml:
+                if streaming:
+                    self.read_projected_csv_file(self.csv_file_in_list_of_list_format)
                 else:
-                    worksheet.write(row, 0, item[0], odd_sample_format)
-                    worksheet.write(row, 1, item[1], odd_sample_format)
-                    worksheet.write(row, 2, item[2], odd_sample_format)
-                    worksheet.write(row, 3, item[3], odd_sample_format)
-                    worksheet.write(row, 4, item[4], odd_sample_format)
-                    worksheet.write(row, 5, item[5], odd_sample_format)
-                    worksheet.write(row, 6, item[6], odd_sample_format)
-                    worksheet.write(row, 7, item[7], odd_sample_format)
-                    worksheet.write(row, 8, item[8], odd_sample_format)
-
-            row += 1
-        workbook.close()
-
-    def generate_csv_files(self):
-        """generates csv file versions of the unified excel format, using python's built in csv library. """
-
-        target = r'T:\ANALYST WORK FILES\Peter\CrystalMB\UnifiedExcelFiles\ '
-        try:
-            batch_name = str(self.main_file_name)
-            filename = target[:-1] + batch_name + '.csv'
-            filename = filename.replace('/', '-')
-            with self.safe_open_w(filename) as f:
-                csv_writer = csv.writer(f)
-                for item in self.csv_file_in_list_of_list_format_condensed:
-                    csv_writer.writerow(item)
-        except OSError:
-            pass
-
-    def mkdir_p(self, path):
-        """tries to make the directory."""
-
-        try:
-            os.makedirs(path)
-        except OSError as exc:  # Python >2.5
-            if exc.errno == errno.EEXIST and os.path.isdir(path):
-                pass
+                    with self.unify_instrumentation.phase('read') as unify_phase:
+                        self.read_projected_csv_file(self.csv_file_in_list_of_list_format)
+                        self.csv_file_in_list_of_list_format = list(self.csv_file_in_list_of_list_format)
+                        unify_phase.rows_out = self.input_row_count()
+            if xml:
+                self.stream_condensed_lines_from_xml_file(columnar, output_formats)
             else:
-                raise
-
-    def safe_open_w(self, path):
-        """ Open "path" for writing, creating any parent directories as needed. """
-
-        self.mkdir_p(os.path.dirname(path))
-        return open(path, 'w', newline='')
-
-
+                self.condense_and_write(streaming, columnar, output_formats)
+        # have the option of generating excel files with xlsxwriter, can format somewhat
+        # or make un-formatted csv files.
+        # self.generate_csv_files()
+        # or a typed, compressed parquet file for loading into the database/dataframes.
+        # self.generate_parquet_files()
+        # or straight into the database, e.g. UnifiedDatabaseSink(UnifiedConnectionPool.for_sqlite('unified.db')).
+        # self.load_condensed_lines_into_database(database_sink)
 
+    def stream_condensed_lines_from_xml_file(self, columnar=False, output_formats=None):
+        """condenses a TargetLynx XML export with WatersXmlReader - no csv export needed.
 
+        Parameters
+        ----------
+        columnar=False
+            True to condense into unified_table first, rather than streaming straight to the output.
+        output_formats=None
+            the outputs to write in one pass - see generate_output_files. None for just the excel file.
+        """
 
+        with self.unify_instrumentation.phase('xml streaming') as unify_phase:
+            condensed_lines = WatersXmlReader(self.csv_file_in_list_of_list_format).generate_condensed_lines()
+            if columnar:
+                self.unified_table = UnifiedTable.from_condensed_lines(unify_phase.count_rows(condensed_lines))
+                if len(self.unified_table) == 0:
+                    raise ValueError("No sample lines found in the Waters XML file.")
+                self.main_file_name = self.unified_table[0][1][:-4]
+                # the table itself, so the excel file gets it typed once per distinct value
+                self.generate_unified_files(self.unified_table, output_formats)
+                return
+            condensed_lines = unify_phase.count_rows(condensed_lines)
+            first_condensed_line = next(condensed_lines, None)
+            if first_condensed_line is None:
+                raise ValueError("No sample lines found in the Waters XML file.")
+            self.main_file_name = first_condensed_line[1][:-4]
+            self.generate_unified_files(itertools.chain(self.csv_file_in_list_of_list_format_condensed,
+                                                        [first_condensed_line],
+                                                        condensed_lines),
+                                        output_formats)
+
+    def read_projected_csv_file(self, filename):
+        """sets csv_file_in_list_of_list_format to a ProjectedCsvReader over the file, which splits out and decodes
+        only the columns this converter uses, and drops the blank lines before decoding them at all. Much quicker
+        than csv.reader on wide exports.
+
+        The rows (header included) come out with just the columns field_mapping reads, so it's compiled for those
+        projected rows (and required_fields_index_dictionary set to their projected positions). Rows are read as
+        they're iterated over.
 
+        Parameters
+        ----------
+        filename : string
+            the Waters csv export.
 
+        Raises
+        ------
+        UnicodeDecodeError
+            file is not being recognized as a csv file.
+        """
 
+        projected_csv_reader = ProjectedCsvReader(filename)
+        self.compile_field_mapping(self.field_mapping, projected_csv_reader.header_row)
+        compiled_field_mapping = self.compiled_field_mapping
+        projected_csv_reader.project(compiled_field_mapping.source_indexes,
+                                     skip_blank_index=compiled_field_mapping.row_index('name16'))
+        self.compiled_field_mapping = compiled_field_mapping.projected()
+        self.required_fields_index_dictionary = {column_name: self.compiled_field_mapping.row_index(column_name)
+                                                 for column_name in self.required_fields_index_dictionary}
+        self.csv_file_in_list_of_list_format = itertools.chain([projected_csv_reader.projected_header_row()],
+                                                               projected_csv_reader)
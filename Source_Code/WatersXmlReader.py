@@ -0,0 +1,110 @@
+import xml.etree.ElementTree as ElementTree
+
+
+class WatersXmlReader:
+    """Reads a Waters TargetLynx XML export straight into condensed lines, without exporting it to csv first.
+
+    The file is read with iterparse, so only the sample being read is ever in memory: the sample's attributes are
+    kept when its SAMPLE element starts, each COMPOUND in it becomes one condensed line when it ends (with the
+    results from its PEAK), and each finished SAMPLE is cleared and dropped from the tree. Memory stays flat however
+    big the file is. COMPOUND elements outside a SAMPLE (the method's compound list) are skipped.
+
+    The XML names its fields after the same things the csv export does - name16 is the sample's data file name,
+    name20 the compound name and so on - but which element and attribute each one lives on is set by
+    field_attributes, so a different TargetLynx version can be handled by changing the mapping rather than the code.
+
+    Attributes
+    ----------
+    xml_file : string or file object
+        the TargetLynx XML export.
+    field_attributes : dict
+        field name -> (element tag, attribute name), for each of the fields in required_fields_index_dictionary plus
+        methodname (which gives the data source).
+    """
+
+    default_field_attributes = {'name16': ('SAMPLE', 'name'),
+                                'createdate': ('SAMPLE', 'createdate'),
+                                'createtime': ('SAMPLE', 'createtime'),
+                                'sampleid': ('SAMPLE', 'desc'),
+                                'type': ('SAMPLE', 'type'),
+                                'methodname': ('SAMPLE', 'inletmethodname'),
+                                'name20': ('COMPOUND', 'name'),
+                                'analconc': ('PEAK', 'analconc'),
+                                'percrecovery': ('PEAK', 'percrecovery')}
+    sample_tag = 'SAMPLE'
+    compound_tag = 'COMPOUND'
+    peak_tag = 'PEAK'
+
+    def __init__(self, xml_file, field_attributes=None):
+        """
+        Parameters
+        ----------
+        xml_file : string or file object
+            the TargetLynx XML export.
+        field_attributes : dict
+            overrides for default_field_attributes, e.g. {'sampleid': ('SAMPLE', 'sampleid')}.
+        """
+
+        self.xml_file = xml_file
+        self.field_attributes = dict(self.default_field_attributes, **(field_attributes or {}))
+
+    def element_fields(self, tag, element):
+        """the fields that come from this kind of element, read off its attributes. Missing ones are ''.
+
+        Parameters
+        ----------
+        tag : string
+            SAMPLE, COMPOUND or PEAK.
+        element : xml.etree.ElementTree.Element
+            the element.
+        """
+
+        return {field_name: element.get(attribute_name, '')
+                for field_name, (field_tag, attribute_name) in self.field_attributes.items() if field_tag == tag}
+
+    def generate_condensed_lines(self):
+        """yields one condensed line (the nine unified fields) per compound result, in file order.
+
+        Raises
+        ------
+        xml.etree.ElementTree.ParseError
+            the file isn't well formed XML.
+        """
+
+        element_stack = []
+        sample_fields = None
+        compound_fields = None
+        for event, element in ElementTree.iterparse(self.xml_file, events=('start', 'end')):
+            if event == 'start':
+                element_stack.append(element)
+                if element.tag == self.sample_tag:
+                    sample_fields = self.element_fields(self.sample_tag, element)
+                elif element.tag == self.compound_tag and sample_fields is not None:
+                    # peak fields default to '' (or the compound's own attribute) if the compound has no PEAK
+                    compound_fields = dict(self.element_fields(self.peak_tag, element),
+                                           **self.element_fields(self.compound_tag, element))
+                continue
+            element_stack.pop()
+            if element.tag == self.peak_tag and compound_fields is not None:
+                compound_fields.update(self.element_fields(self.peak_tag, element))
+            elif element.tag == self.compound_tag and compound_fields is not None:
+                fields = dict(sample_fields, **compound_fields)
+                compound_fields = None
+                # same test as the csv - a sample without a data file name is a blank line
+                if fields.get('name16', '') != '':
+                    yield [str("Waters Instruments: " + fields.get('methodname', '')),
+                           fields['name16'],
+                           fields.get('createdate', ''),
+                           fields.get('createtime', ''),
+                           fields.get('sampleid', ''),
+                           fields.get('type', ''),
+                           fields.get('name20', ''),
+                           fields.get('analconc', ''),
+                           fields.get('percrecovery', '')]
+                element.clear()
+            elif element.tag == self.sample_tag:
+                sample_fields = None
+                # done with this sample - drop it from its parent so the tree never grows
+                element.clear()
+                if element_stack:
+                    element_stack[-1].remove(element)
@@ -0,0 +1,59 @@
+"""UnifyMB's conversion core, importable as a package without Tk.
+
+Nothing is imported until it's used - `from Source_Code import unify_single_file` loads UnifyBatch (and what it
+needs) at that point, and the writer backends (xlsxwriter, pyarrow, numpy) only load when a file is actually written
+in that format. The GUI is UnifyTK.main(), and is never imported from here.
+"""
+import importlib
+
+# public name -> the module it lives in
+lazy_exports = {'AgilentUnify': 'AgilentUnify',
+                'WatersUnify': 'WatersUnify',
+                'UnifyConverter': 'UnifyConverter',
+                'UnifyFieldMapping': 'UnifyFieldMapping',
+                'SourceColumn': 'UnifyFieldMapping',
+                'ConstantField': 'UnifyFieldMapping',
+                'DerivedField': 'UnifyFieldMapping',
+                'WideColumnName': 'UnifyFieldMapping',
+                'WideColumnValue': 'UnifyFieldMapping',
+                'WatersXmlReader': 'WatersXmlReader',
+                'ProjectedCsvReader': 'ProjectedCsvReader',
+                'UnifiedTable': 'UnifiedTable',
+                'UnifiedExcelWriter': 'UnifiedExcelWriter',
+                'UnifiedParquetWriter': 'UnifiedParquetWriter',
+                'read_unified_files': 'UnifiedParquetWriter',
+                'UnifiedDatabaseSink': 'UnifiedDatabaseSink',
+                'UnifiedConnectionPool': 'UnifiedDatabaseSink',
+                'UnifyOutputPipeline': 'UnifyOutputPipeline',
+                'UnifyOutputAborted': 'UnifyOutputPipeline',
+                'UnifyFormat': 'UnifyFormatRegistry',
+                'UnifyFormatRegistry': 'UnifyFormatRegistry',
+                'unify_format_registry': 'UnifyFormatRegistry',
+                'UnifyFormatSchema': 'UnifyFormatSchema',
+                'field_mapping_schema': 'UnifyFormatRegistry',
+                'UnifySchemaError': 'UnifyFormatSchema',
+                'UnifyBatch': 'UnifyBatch',
+                'unify_single_file': 'UnifyBatch',
+                'unify_pathway_decider': 'UnifyBatch',
+                'UnifyCache': 'UnifyCache',
+                'UnifyMerge': 'UnifyMerge',
+                'UnifyTail': 'UnifyTail',
+                'UnifyPrefetch': 'UnifyPrefetch',
+                'UnifyIndex': 'UnifyIndex',
+                'IndexOutputSink': 'UnifyIndex',
+                'UnifyInstrumentation': 'UnifyInstrumentation',
+                'UnifyWatcher': 'UnifyWatcher',
+                'UnifyWorkQueue': 'UnifyWorkQueue',
+                'UnifyWorker': 'UnifyWorkQueue'}
+
+__all__ = list(lazy_exports)
+
+
+def __getattr__(name):
+    """imports the module a public name lives in the first time the name is used. """
+
+    if name not in lazy_exports:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + lazy_exports[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,122 @@
+"""several local worker processes sharing one UnifyWorkQueue, standing in for several PCs on a share.
+
+Run from the repository root with `python -m pytest tests` (or `python -m unittest discover tests`).
+"""
+
+import multiprocessing
+import contextlib
+import unittest
+import tempfile
+import sqlite3
+import shutil
+import time
+import csv
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Source_Code'))
+
+from UnifyWorkQueue import UnifyWorkQueue, run_local_worker
+
+
+def write_agilent_export(filename, batch_name, output_rows=40):
+    """writes a small new ICP/MS export. Each file gets its own batch name, and so its own unified file. """
+
+    with open(filename, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(['Sample Name', 'Sample Type', 'Date and Time Acquired', 'Data File Name', 'Vial Number',
+                             'Batch Name', 'Analyte', 'Mass', 'Concentration', 'Units', 'Tune Step'])
+        for row in range(output_rows):
+            sample = row // 4
+            csv_writer.writerow(['Sample ' + str(sample), 'Sample', '06/22/2021 10:{:02d}:00'.format(sample),
+                                 '{:03d}SMPL.d'.format(sample), str(sample + 1), batch_name, 'Pb', '208',
+                                 '{:.4f}'.format(row / 7), 'ppb', '1'])
+
+
+class UnifyWorkQueueTest(unittest.TestCase):
+
+    worker_count = 3
+    file_count = 12
+    lease_seconds = 2.0
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='unify_work_queue_test_')
+        self.input_directory = os.path.join(self.directory, 'CSVFilesToUnify')
+        self.output_directory = os.path.join(self.directory, 'UnifiedExcelFiles')
+        self.queue_filename = os.path.join(self.output_directory, '.unify_work_queue.sqlite3')
+        os.makedirs(self.input_directory)
+        for file_number in range(self.file_count):
+            write_agilent_export(os.path.join(self.input_directory, 'export{:02d}.csv'.format(file_number)),
+                                 'ICP{:02d}01'.format(file_number))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def unify_work_queue(self, input_directory=None):
+        return UnifyWorkQueue(self.queue_filename, self.lease_seconds, 3, input_directory or self.input_directory)
+
+    def run_workers(self, input_directories):
+        """runs a worker process for each input directory until the queue is finished. Returns the files each one
+        converted. """
+
+        worker_arguments = [(self.queue_filename, self.lease_seconds, 3,
+                             {'unified_files_directory': self.output_directory, 'input_path': input_directory,
+                              'poll_interval': 0.1, 'settle_seconds': 0.0, 'exit_when_empty': True})
+                            for input_directory in input_directories]
+        with multiprocessing.Pool(len(worker_arguments)) as pool:
+            return pool.starmap(run_local_worker, worker_arguments)
+
+    def assert_converted_once(self, jobs_done):
+        jobs = self.unify_work_queue().jobs()
+        self.assertEqual(len(jobs), self.file_count)
+        self.assertEqual([job['status'] for job in jobs], ['done'] * self.file_count,
+                         [job['message'] for job in jobs])
+        # every file is done, and between them the workers only converted that many - so none was converted twice
+        self.assertEqual(sum(jobs_done), self.file_count)
+        for job in jobs:
+            self.assertTrue(os.path.isfile(job['output_filename']), job['output_filename'])
+
+    def test_each_file_converted_once(self):
+        jobs_done = self.run_workers([self.input_directory] * self.worker_count)
+        self.assert_converted_once(jobs_done)
+
+    def test_share_mapped_differently(self):
+        # the same share, reached by a different path on each "PC"
+        input_directories = [self.input_directory]
+        for worker_number in range(1, self.worker_count):
+            mapped_directory = os.path.join(self.directory, 'mapped{}'.format(worker_number))
+            try:
+                os.symlink(self.input_directory, mapped_directory, target_is_directory=True)
+            except (OSError, NotImplementedError):
+                self.skipTest("can't make directory symlinks here")
+            input_directories.append(mapped_directory)
+        jobs_done = self.run_workers(input_directories)
+        self.assert_converted_once(jobs_done)
+        self.assertEqual(sorted(job['filename'] for job in self.unify_work_queue().jobs()),
+                         ['export{:02d}.csv'.format(file_number) for file_number in range(self.file_count)])
+
+    def test_expired_lease_converted_once(self):
+        # a worker claims a file, then its PC is switched off without converting it
+        unify_work_queue = self.unify_work_queue()
+        unify_work_queue.enqueue_files(sorted(os.path.join(self.input_directory, filename)
+                                              for filename in os.listdir(self.input_directory)))
+        crashed_job = unify_work_queue.claim_job('crashed-pc:1')
+        self.assertIsNotNone(crashed_job)
+        claimed = time.time()
+        jobs_done = self.run_workers([self.input_directory] * self.worker_count)
+        self.assert_converted_once(jobs_done)
+        crashed_job_row = [job for job in unify_work_queue.jobs() if job['filename'] == crashed_job][0]
+        self.assertEqual(crashed_job_row['attempts'], 2)
+        self.assertNotEqual(crashed_job_row['worker'], 'crashed-pc:1')
+        self.assertGreaterEqual(crashed_job_row['finished'], claimed + self.lease_seconds)
+        # the crashed worker coming back can't record a result over the one that converted it
+        self.assertFalse(unify_work_queue.renew_lease(crashed_job, 'crashed-pc:1'))
+        self.assertFalse(unify_work_queue.complete_job(crashed_job, 'crashed-pc:1',
+                                                       {'success': False, 'output_filename': '', 'message': 'late'}))
+        with contextlib.closing(sqlite3.connect(self.queue_filename)) as connection:
+            self.assertEqual(connection.execute("SELECT COUNT(*) FROM unify_jobs WHERE status != 'done'").fetchone(),
+                             (0,))
+
+
+if __name__ == '__main__':
+    unittest.main()